@@ -1,38 +1,415 @@
-from django.contrib import admin
+
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.contrib.admin.widgets import AutocompleteMixin
+from django.contrib.auth import admin as auth_admin
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.admin import GenericTabularInline
+from django.contrib.contenttypes.forms import BaseGenericInlineFormSet
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.forms import BaseInlineFormSet, CharField, HiddenInput, IntegerField, ModelChoiceField, ModelForm
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from . import approvals, archive, audit, budgets, bulk, exports, jobs, models, search, states, tasks
+
+
+def audit_changes(obj):
+    """The decoded diff of an audit, one ``field: old → new`` per line."""
+    try:
+        changes = audit.decode_changes(obj.audited_changes)
+    except ValueError:
+        return obj.audited_changes
+    return "\n".join(f"{field}: {old} → {new}" for field, (old, new) in
+                     ((field, audit.as_pair(obj.action, value)) for field, value in changes.items()))
+
+
+class EstimatedCountPaginator(Paginator):
+    """Uses the planner's row estimate for unfiltered changelists of big PostgreSQL tables."""
+
+    threshold = 100_000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            estimate = archive.estimated_rows(self.object_list.model, self.object_list.db)
+            if estimate and estimate > self.threshold:
+                return estimate
+        return super().count
+
+
+# ---------- Changelists ----------
+
+KEYSET_VAR = "after"
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages through the default ordering by seeking past the last row shown
+    (``?after=<pk>``) instead of an ``OFFSET``, so page 5,000 of an append-only
+    table costs what the first one does. Sorting by a column falls back to numbered
+    pages.
+    """
+
+    keyset = False
+    next_page_link = first_page_link = None
+
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        # sorting and filter links start from the newest rows again
+        self.params.pop(KEYSET_VAR, None)
+        self.filter_params.pop(KEYSET_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(KEYSET_VAR, None)
+        return lookup_params
+
+    def _seek(self, queryset, ordering, after):
+        """Rows ordered after the row with pk ``after``."""
+        fields = [name.lstrip("-") for name in ordering]
+        anchor = self.root_queryset.filter(pk=after).values(*fields).first()
+        if anchor is None or None in anchor.values():
+            raise IncorrectLookupParameters
+        beyond, equal = Q(), {}
+        for name, field in zip(ordering, fields):
+            beyond |= Q(**equal, **{f"{field}__{'lt' if name.startswith('-') else 'gt'}": anchor[field]})
+            equal[field] = anchor[field]
+        return queryset.filter(beyond)
+
+    def get_results(self, request):
+        ordering = tuple(dict.fromkeys(self.queryset.query.order_by))
+        if ORDER_VAR in self.params or self.show_all or not all(isinstance(name, str) for name in ordering):
+            return super().get_results(request)
+        after = request.GET.get(KEYSET_VAR)
+        queryset = self._seek(self.queryset, ordering, after) if after else self.queryset
+        rows = list(queryset[:self.list_per_page + 1])
+        self.keyset = True
+        self.result_list = rows[:self.list_per_page]
+        self.next_page_link = (self.get_query_string({KEYSET_VAR: rows[self.list_per_page - 1].pk})
+                               if len(rows) > self.list_per_page else None)
+        self.first_page_link = self.get_query_string(remove=[KEYSET_VAR]) if after else None
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = bool(self.next_page_link or after)
+
+
+class HighVolumeAdminMixin:
+    """
+    For changelists of big tables: displayed foreign keys (including nullable ones,
+    which Django does not join by itself) are joined with ``select_related``, plus
+    ``list_select_related_extra`` for relations their ``__str__`` follows. Unfiltered
+    counts are PostgreSQL's estimate (``EstimatedCountPaginator``) and the filtered
+    full count is skipped. With ``keyset_pagination`` (append-only tables) pages seek
+    instead of counting offsets, see ``KeysetChangeList``.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_select_related_extra = ()
+    keyset_pagination = False
+
+    def get_list_select_related(self, request):
+        if self.list_select_related not in (True, False):
+            return self.list_select_related
+        related = []
+        for name in self.get_list_display(request):
+            try:
+                field = self.model._meta.get_field(name) if isinstance(name, str) else None
+            except FieldDoesNotExist:
+                continue
+            if field is not None and field.many_to_one:
+                related.append(name)
+        return (*related, *self.list_select_related_extra) or self.list_select_related
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList if self.keyset_pagination else super().get_changelist(request, **kwargs)
+
+    @property
+    def change_list_template(self):
+        return "admin/keyset_change_list.html" if self.keyset_pagination else None
+
+
+class ExportActionsMixin:
+    """
+    Actions exporting the selected rows with their event, user and budget. CSV and
+    XLSX stream from the database while they download; the background export writes
+    the file in a job and mails the link, for more rows than a request should take.
+    """
+
+    actions = ("export_csv", "export_xlsx", "export_csv_in_background")
+
+    def _stream(self, queryset, fmt):
+        response = StreamingHttpResponse(exports.stream(queryset, fmt), content_type=exports.CONTENT_TYPES[fmt])
+        response["Content-Disposition"] = f'attachment; filename="{exports.filename(queryset.model, fmt)}"'
+        return response
+
+    @admin.action(description="Export selected %(verbose_name_plural)s as CSV")
+    def export_csv(self, request, queryset):
+        return self._stream(queryset, "csv")
+
+    @admin.action(description="Export selected %(verbose_name_plural)s as XLSX")
+    def export_xlsx(self, request, queryset):
+        return self._stream(queryset, "xlsx")
+
+    @admin.action(description="Export selected %(verbose_name_plural)s as CSV by email")
+    def export_csv_in_background(self, request, queryset):
+        if not request.user.email:
+            self.message_user(request, "You have no email address to send the export to.", messages.ERROR)
+            return
+        tasks.export_rows.delay(jobs.Selection.of(queryset).dump(), "csv", request.user.pk)
+        self.message_user(request, f"The export will be sent to {request.user.email} when it is ready.")
+
+
+class BulkActionsMixin:
+    """
+    Runs bulk actions with ``bulk.run``: set-based, a chunk per transaction. A
+    selection of more than ``bulk.BACKGROUND_THRESHOLD`` rows goes to the
+    ``bulk_action`` job; its progress shows in the delayed job admin. With a
+    ``machine`` (see ``event.states``) every event of it is an action.
+    """
+
+    machine = None
+
+    def run_bulk(self, request, queryset, operation, **options):
+        total = queryset.count()
+        if total > bulk.BACKGROUND_THRESHOLD:
+            tasks.bulk_action.delay(jobs.Selection.of(queryset).dump(), operation, request.user.pk, options)
+            self.message_user(request, f"{total} {self.model._meta.verbose_name_plural} are changed in the "
+                                       "background; the delayed jobs show the progress.")
+            return
+        outcome = bulk.run(queryset, operation, user=request.user, **options)
+        self.message_user(request, f"{outcome}.", messages.WARNING if outcome.skipped else messages.SUCCESS)
+
+    def _transition_action(self, event):
+        def action(modeladmin, request, queryset):
+            return modeladmin.run_bulk(request, queryset, "transition", event=event)
+        return action
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if self.machine is not None and self.has_change_permission(request):
+            for event in self.machine.transitions:
+                name = f"transition_{event}"
+                description = f"{event.replace('_', ' ').capitalize()} selected {self.model._meta.verbose_name_plural}"
+                actions[name] = (self._transition_action(event), name, description)
+        return actions
+
+
+class EventActionForm(helpers.ActionForm):
+    organizer = CharField(required=False, label="Organizer (username or email)")
+
+
+APPROVAL_FIELDS = ("approved_amount", "approved_currency")
+APPROVAL_ERRORS = (approvals.ApprovalConflict, budgets.BudgetExceeded, budgets.UnknownRate)
+
+
+class RequestExpenseForm(ModelForm):
+    """
+    Carries the ``lock_version`` the reviewer saw. A changed approval is tried with
+    ``approvals.approve`` (and rolled back) while validating, so a conflict or an
+    exceeded budget shows as a form error instead of being saved.
+    """
+
+    lock_version = IntegerField(widget=HiddenInput, required=False)
+
+    class Meta:
+        model = models.RequestExpense
+        # never written from the form; approvals bump it
+        exclude = ("lock_version",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["lock_version"].initial = self.instance.lock_version
+
+    def approval_changed(self):
+        return self.instance.pk is not None and any(name in self.changed_data for name in APPROVAL_FIELDS)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.approval_changed() and "request" in self.changed_data:
+            self.add_error("request", "Move the expense and change its approval in separate saves.")
+        elif self.approval_changed() and not self.has_error("approved_amount"):
+            try:
+                approvals.approve(
+                    models.Request(pk=self.instance.request_id),
+                    {self.instance.pk: (cleaned_data.get("approved_amount"), cleaned_data.get("approved_currency"))},
+                    versions={self.instance.pk: cleaned_data.get("lock_version")}, dry_run=True,
+                )
+            except approvals.ApprovalConflict:
+                raise ValidationError("This expense was changed by someone else since you opened it. "
+                                      "Reload it and decide again.")
+            except budgets.UnknownRate as e:
+                self.add_error("approved_currency", str(e))
+            except budgets.BudgetExceeded as e:
+                self.add_error("approved_amount", str(e))
+        return cleaned_data
+
+
+class IndexedAutocompleteMixin:
+    """Autocomplete requests search the ``event.search`` index instead of ``search_fields``."""
+
+    def get_search_results(self, request, queryset, search_term):
+        match = getattr(request, "resolver_match", None)
+        if search_term and match is not None and match.url_name == "autocomplete":
+            ids = search.lookup(self.model, search_term)
+            if ids is not None:
+                return queryset.filter(pk__in=ids).order_by("-pk"), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+# ---------- Inline formsets ----------
+
+class SharedChoicesMixin:
+    """
+    Renders the select of a foreign key once per formset: every row (and the empty
+    form) reuses the choices evaluated for the first one, instead of querying them
+    again per row. Autocomplete widgets load their own choices and are left alone.
+    """
+
+    def _share_choices(self, form):
+        shared = self.__dict__.setdefault("_shared_choices", {})
+        for name, field in form.fields.items():
+            widget = getattr(field.widget, "widget", field.widget)
+            if not isinstance(field, ModelChoiceField) or widget.is_hidden or isinstance(widget, AutocompleteMixin):
+                continue
+            if name not in shared:
+                shared[name] = list(iter(field.choices))  # iter: no COUNT query for len()
+            field.choices = widget.choices = shared[name]
+        return form
+
+    def _construct_form(self, i, **kwargs):
+        return self._share_choices(super()._construct_form(i, **kwargs))
+
+    @property
+    def empty_form(self):
+        return self._share_choices(super().empty_form)
+
+
+class SharedChoicesInlineFormSet(SharedChoicesMixin, BaseInlineFormSet):
+    pass
+
+
+class SharedChoicesGenericInlineFormSet(SharedChoicesMixin, BaseGenericInlineFormSet):
+    pass
+
+
+class HistoryFormSet(SharedChoicesGenericInlineFormSet):
+    """Only the newest ``limit`` rows (``None``: all of them)."""
+
+    limit = None
+
+    def get_queryset(self):
+        if not hasattr(self, "_queryset"):
+            queryset = super().get_queryset()
+            self._queryset = queryset[:self.limit] if self.limit else queryset
+        return self._queryset
+
+
+class PrefetchingInlineMixin:
+    """Inline rows come with their ``select_related`` relations, so rendering them costs no query per row."""
+
+    select_related = ()
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.select_related(*self.select_related) if self.select_related else queryset
+
+
+class TabularInline(PrefetchingInlineMixin, admin.TabularInline):
+    formset = SharedChoicesInlineFormSet
+
+
+class GenericInline(PrefetchingInlineMixin, GenericTabularInline):
+    formset = SharedChoicesGenericInlineFormSet
+
+
+class HistoryInline(GenericInline):
+    """
+    Read-only history (audits, state changes), newest first. Only the latest
+    ``history_limit`` rows are loaded; ``?history=all`` on the change page loads the
+    rest, from a link in the inline's heading.
+    """
+
+    formset = HistoryFormSet
+    history_limit = 20
+    history_param = "history"
+    select_related = ("user",)
+    ordering = ("-created_at", "-pk")
+    extra = 0
+
+    def get_readonly_fields(self, request, obj=None):
+        # no form fields, so no choices to load for them
+        return self.fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
-from . import models
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.limit = None if request.GET.get(self.history_param) == "all" else self.history_limit
+        if formset.limit and obj is not None and obj.pk is not None:
+            content_type = ContentType.objects.get_for_model(obj, for_concrete_model=formset.for_concrete_model)
+            total = self.get_queryset(request).filter(
+                **{self.ct_field: content_type, self.ct_fk_field: obj.pk}).count()
+            if total > formset.limit:
+                query = request.GET.copy()
+                query[self.history_param] = "all"
+                self.verbose_name_plural = format_html(
+                    '{} <a href="?{}">(latest {} of {}, show all)</a>',
+                    self.model._meta.verbose_name_plural, query.urlencode(), formset.limit, total,
+                )
+        return formset
 
 
 # ---------- Inlines (fixed ct_field/ct_fk_field) ----------
 
-class EventOrganizerInline(admin.TabularInline):
+class EventOrganizerInline(TabularInline):
     model = models.EventOrganizer
     extra = 0
     autocomplete_fields = ["user"]
+    select_related = ("user",)
 
 
-class PaymentInline(admin.TabularInline):
+class PaymentInline(TabularInline):
     model = models.Payment
     extra = 0
 
 
-class BankAccountInline(admin.TabularInline):
+class BankAccountInline(TabularInline):
     model = models.BankAccount
     extra = 0
 
 
-class ReimbursementAttachmentInline(admin.TabularInline):
+class ReimbursementAttachmentInline(TabularInline):
     model = models.ReimbursementAttachment
     extra = 0
 
 
-class ReimbursementLinkInline(admin.TabularInline):
+class ReimbursementLinkInline(TabularInline):
     model = models.ReimbursementLink
     extra = 0
 
 
-class CommentGenericInline(GenericTabularInline):
+class CommentGenericInline(GenericInline):
     """
     For models referencing Comment via (machine_content_type, machine_object_id)
     """
@@ -40,82 +417,150 @@ class CommentGenericInline(GenericTabularInline):
     ct_field = "machine_content_type"
     ct_fk_field = "machine_object_id"
     extra = 0
+    select_related = ("user",)
 
 
-class StateChangeGenericInline(GenericTabularInline):
+class StateChangeGenericInline(HistoryInline):
     """
     For models referencing StateChange via (machine_content_type, machine_object_id)
     """
     model = models.StateChange
     ct_field = "machine_content_type"
     ct_fk_field = "machine_object_id"
-    extra = 0
+    fields = ("state_event", "from_state", "to_state", "user", "notes", "created_at")
 
 
-class AuditGenericInline(GenericTabularInline):
+class AuditGenericInline(HistoryInline):
     """
     For models referencing Audit via (auditable_content_type, auditable_object_id)
     """
     model = models.Audit
     ct_field = "auditable_content_type"
     ct_fk_field = "auditable_object_id"
-    extra = 0
+    fields = ("version", "action", "user", "changes", "created_at")
+    readonly_fields = ("changes",)
+
+    def changes(self, obj):
+        return audit_changes(obj)
 
 
 # ---------- ModelAdmins ----------
 
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class UserAdmin(IndexedAutocompleteMixin, auth_admin.UserAdmin):
+    pass
+
+
 @admin.register(models.Budget)
-class BudgetAdmin(admin.ModelAdmin):
+class BudgetAdmin(IndexedAutocompleteMixin, admin.ModelAdmin):
     list_display = ("id", "name", "amount", "currency", "created_at", "updated_at")
     list_filter = ("currency",)
     search_fields = ("name", "description")
 
 
 @admin.register(models.Event)
-class EventAdmin(admin.ModelAdmin):
+class EventAdmin(IndexedAutocompleteMixin, BulkActionsMixin, HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = (
         "id", "name", "country_code", "start_date", "end_date",
-        "validated", "budget", "shipment_type",
+        "validated", "archived", "budget", "shipment_type",
     )
-    list_filter = ("validated", "country_code", "shipment_type", "start_date", "end_date")
+    list_filter = ("validated", "archived", "country_code", "shipment_type", "start_date", "end_date")
     search_fields = ("name", "description", "url")
     date_hierarchy = "start_date"
     autocomplete_fields = ["budget", "organizers"]
     #filter_horizontal = ("organizers",)
     inlines = [EventOrganizerInline, CommentGenericInline, StateChangeGenericInline, AuditGenericInline]
+    action_form = EventActionForm
+    actions = ("validate", "archive", "add_organizer")
+
+    @admin.action(description="Validate selected events", permissions=["change"])
+    def validate(self, request, queryset):
+        return self.run_bulk(request, queryset, "validate")
+
+    @admin.action(description="Archive selected events", permissions=["change"])
+    def archive(self, request, queryset):
+        return self.run_bulk(request, queryset, "archive")
+
+    @admin.action(description="Add the organizer to selected events", permissions=["change"])
+    def add_organizer(self, request, queryset):
+        name = request.POST.get("organizer", "").strip()
+        organizer = User.objects.filter(Q(username=name) | Q(email__iexact=name)).order_by("pk").first() \
+            if name else None
+        if organizer is None:
+            self.message_user(request, f"No user {name!r} to add as organizer.", messages.ERROR)
+            return
+        return self.run_bulk(request, queryset, "add_organizer", organizer_id=organizer.pk)
 
 
 @admin.register(models.PostalAddress)
-class PostalAddressAdmin(admin.ModelAdmin):
+class PostalAddressAdmin(IndexedAutocompleteMixin, admin.ModelAdmin):
     list_display = ("id", "name", "line1", "city", "postal_code", "country_code")
     list_filter = ("country_code",)
     search_fields = ("name", "line1", "line2", "city", "postal_code", "county")
 
 
 @admin.register(models.Request)
-class RequestAdmin(admin.ModelAdmin):
+class RequestAdmin(IndexedAutocompleteMixin, ExportActionsMixin, BulkActionsMixin, HighVolumeAdminMixin,
+                   admin.ModelAdmin):
     list_display = ("id", "state", "user", "event", "visa_letter", "created_at", "updated_at")
     list_filter = ("state", "visa_letter", "event")
     search_fields = ("description", "contact_phone_number")
     autocomplete_fields = ["user", "event", "postal_address"]
     date_hierarchy = "created_at"
     inlines = [CommentGenericInline, StateChangeGenericInline, AuditGenericInline]
+    machine = states.request_machine
 
 
 @admin.register(models.RequestExpense)
-class RequestExpenseAdmin(admin.ModelAdmin):
+class RequestExpenseAdmin(ExportActionsMixin, HighVolumeAdminMixin, admin.ModelAdmin):
+    """Approved amounts are saved through ``approvals.approve``, see ``RequestExpenseForm``."""
+
+    form = RequestExpenseForm
     list_display = ("id", "request", "subject", "estimated_amount", "approved_amount", "total_amount")
     list_filter = ("estimated_currency", "approved_currency")
     search_fields = ("subject", "description")
     autocomplete_fields = ["request"]
+    list_select_related_extra = ("request__event",)
+
+    def get_readonly_fields(self, request, obj=None):
+        # an amount is approved on an expense that exists, at a version the reviewer saw
+        return super().get_readonly_fields(request, obj) + (APPROVAL_FIELDS if obj is None else ())
+
+    def save_model(self, request, obj, form, change):
+        if change and form.approval_changed():
+            obj.lock_version = form.cleaned_data["lock_version"]
+            try:
+                approvals.approve_expense(obj, obj.approved_amount, obj.approved_currency)
+            except APPROVAL_ERRORS as e:
+                # lost a race after validating; approve saved nothing, and neither is the rest of the form
+                request.approval_error = e
+                return
+        super().save_model(request, obj, form, change)
+
+    def log_change(self, request, obj, message):
+        if getattr(request, "approval_error", None) is None:
+            return super().log_change(request, obj, message)
+
+    def response_change(self, request, obj):
+        error = getattr(request, "approval_error", None)
+        if error is not None:
+            self.message_user(request, f"Nothing was saved: {error}", messages.ERROR)
+            return HttpResponseRedirect(request.path)
+        return super().response_change(request, obj)
 
 
 @admin.register(models.Reimbursement)
-class ReimbursementAdmin(admin.ModelAdmin):
+class ReimbursementAdmin(IndexedAutocompleteMixin, ExportActionsMixin, BulkActionsMixin, HighVolumeAdminMixin,
+                         admin.ModelAdmin):
     list_display = ("id", "state", "request", "user", "state_updated_at", "created_at")
     list_filter = ("state",)
     search_fields = ("description",)
     autocomplete_fields = ["request", "user"]
+    list_select_related_extra = ("request__event",)
+    machine = states.reimbursement_machine
     inlines = [
         PaymentInline,
         BankAccountInline,
@@ -128,7 +573,7 @@ class ReimbursementAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.BankAccount)
-class BankAccountAdmin(admin.ModelAdmin):
+class BankAccountAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = ("id", "holder", "bank_name", "iban", "bic", "country_code", "reimbursement")
     search_fields = ("holder", "bank_name", "iban", "bic")
     list_filter = ("country_code",)
@@ -136,7 +581,7 @@ class BankAccountAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(ExportActionsMixin, HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = ("id", "reimbursement", "date", "amount", "currency", "method", "code")
     list_filter = ("currency", "method", "date")
     search_fields = ("subject", "notes", "code")
@@ -144,22 +589,31 @@ class PaymentAdmin(admin.ModelAdmin):
     date_hierarchy = "date"
 
 
+@admin.register(models.LedgerEntry)
+class LedgerEntryAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
+    list_display = ("id", "occurred_at", "title", "amount", "currency", "status", "match", "payment")
+    list_filter = ("match", "activity_type", "currency")
+    search_fields = ("activity_id", "resource_id", "title")
+    raw_id_fields = ["payment"]
+    date_hierarchy = "occurred_at"
+
+
 @admin.register(models.ReimbursementAttachment)
-class ReimbursementAttachmentAdmin(admin.ModelAdmin):
+class ReimbursementAttachmentAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = ("id", "reimbursement", "title", "file", "created_at")
     search_fields = ("title", "file")
     autocomplete_fields = ["reimbursement"]
 
 
 @admin.register(models.ReimbursementLink)
-class ReimbursementLinkAdmin(admin.ModelAdmin):
+class ReimbursementLinkAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = ("id", "reimbursement", "title", "url", "created_at")
     search_fields = ("title", "url")
     autocomplete_fields = ["reimbursement"]
 
 
 @admin.register(models.EventEmail)
-class EventEmailAdmin(admin.ModelAdmin):
+class EventEmailAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = ("id", "subject", "event", "user", "created_at")
     search_fields = ("subject", "body", "to")
     autocomplete_fields = ["event", "user"]
@@ -175,7 +629,7 @@ class EventOrganizerAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Audit)
-class AuditAdmin(admin.ModelAdmin):
+class AuditAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = (
         "id", "action", "auditable_content_type", "auditable_object_id",
         "user", "version", "created_at", "request_uuid",
@@ -183,10 +637,17 @@ class AuditAdmin(admin.ModelAdmin):
     list_filter = ("auditable_content_type", "created_at")
     search_fields = ("action", "audited_changes", "comment", "request_uuid", "username")
     autocomplete_fields = ["user"]
+    readonly_fields = ("changes",)
+    # newest first along index_audits_on_created_at, which also lets PostgreSQL skip old partitions
+    ordering = ("-created_at",)
+    keyset_pagination = True
+
+    def changes(self, obj):
+        return audit_changes(obj)
 
 
 @admin.register(models.Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = ("id", "user", "private", "created_at", "machine_content_type", "machine_object_id")
     list_filter = ("private", "created_at", "machine_content_type")
     search_fields = ("body",)
@@ -194,7 +655,7 @@ class CommentAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.StateChange)
-class StateChangeAdmin(admin.ModelAdmin):
+class StateChangeAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = (
         "id", "from_state", "to_state", "state_event", "user", "created_at",
         "machine_content_type", "machine_object_id", "type"
@@ -202,24 +663,27 @@ class StateChangeAdmin(admin.ModelAdmin):
     list_filter = ("type", "created_at", "machine_content_type")
     search_fields = ("from_state", "to_state", "state_event", "notes")
     autocomplete_fields = ["user"]
+    # append-only: newest first along the primary key
+    ordering = ("-pk",)
+    keyset_pagination = True
 
 
 @admin.register(models.DelayedJob)
-class DelayedJobAdmin(admin.ModelAdmin):
-    list_display = ("id", "priority", "attempts", "run_at", "failed_at", "queue", "locked_by")
+class DelayedJobAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
+    list_display = ("id", "priority", "attempts", "run_at", "failed_at", "queue", "locked_by", "progress")
     list_filter = ("priority", "queue", "run_at", "failed_at")
     search_fields = ("handler", "last_error", "locked_by")
-    date_hierarchy = "run_at"
+    # no date_hierarchy: its year/month links scan the whole queue, the run_at filter does not
 
 
 @admin.register(models.Role)
-class RoleAdmin(admin.ModelAdmin):
+class RoleAdmin(IndexedAutocompleteMixin, admin.ModelAdmin):
     list_display = ("id", "name")
     search_fields = ("name",)
 
 
 @admin.register(models.UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(HighVolumeAdminMixin, admin.ModelAdmin):
     list_display = ("id", "user", "role", "full_name", "country_code")
     search_fields = ("full_name", "user__username", "user__email")
     list_filter = ("role", "country_code")
@@ -0,0 +1,132 @@
+"""
+Approving expense amounts.
+
+A reviewer decides on the expenses of a request as they saw them: each expense (and
+optionally the request) at some ``lock_version``. ``approve`` applies the decision
+only if nothing changed in between. Otherwise it raises ``ApprovalConflict`` naming
+what changed, and the reviewer reloads instead of silently overwriting someone
+else's approval::
+
+    approvals.approve(request, {expense.pk: Decimal("120")}, versions={expense.pk: 3})
+
+Each expense is claimed with a compare-and-swap ``UPDATE ... WHERE lock_version =
+seen``, so two reviewers never wait on each other unless they touch the same rows.
+Only when the approval raises the amount committed against a limited budget is the
+budget row locked (``budgets.lock``), for the few statements it takes to check what
+is still available and write the amounts. Approvals of other budgets and decreases
+never wait. The amounts are saved with ``bulk_update``, so audits and budget totals
+follow as for any other change.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import budgets, tracking
+from .models import Request, RequestExpense
+from .wise.rates import rate_table
+
+ZERO = Decimal("0")
+
+
+class ApprovalConflict(Exception):
+
+    def __init__(self, stale):
+        # [(model name, pk, version seen, version stored or None if gone)]
+        self.stale = stale
+        super().__init__("changed since it was reviewed: " + ", ".join(
+            f"{name} #{pk} (version {seen}, now {'deleted' if now is None else now})" for name, pk, seen, now in stale
+        ))
+
+
+class _Unclaimed(Exception):
+    pass
+
+
+def _claim(model, versions, **filters):
+    """Bump the ``lock_version`` of rows still at the version seen; raises ``_Unclaimed`` if any is not."""
+    seen = Q()
+    for pk, version in versions.items():
+        seen |= Q(pk=pk, lock_version=version)
+    if model.objects.filter(seen, **filters).update(lock_version=F("lock_version") + 1) != len(versions):
+        raise _Unclaimed(model, versions, filters)
+
+
+def _conflict(unclaimed):
+    """Once the claims are rolled back, the stored versions tell which rows changed."""
+    model, versions, filters = unclaimed.args
+    stored = dict(model.objects.filter(pk__in=versions, **filters).values_list("pk", "lock_version"))
+    return ApprovalConflict([
+        (model._meta.model_name, pk, version, stored.get(pk))
+        for pk, version in sorted(versions.items()) if stored.get(pk) != version
+    ])
+
+
+def _converted(amount, currency, budget, rates):
+    if not amount:
+        return ZERO
+    converted = rates.convert(amount, currency or budget.currency, budget.currency)
+    if converted is None:
+        # counting it as nothing would let any amount through
+        raise budgets.UnknownRate(budget, [currency])
+    return converted
+
+
+def approve(request, amounts, *, versions, request_version=None, rates=None, dry_run=False):
+    """
+    Set approved amounts of expenses of ``request``. ``amounts`` maps expense ids to an
+    amount or an ``(amount, currency)`` pair, ``versions`` maps them to the
+    ``lock_version`` the reviewer saw. With ``request_version`` the request must not
+    have changed either (e.g. been canceled or moved). Raises ``ApprovalConflict``,
+    ``budgets.BudgetExceeded`` or ``budgets.UnknownRate``, in which case nothing is
+    saved. Returns the expenses; with ``dry_run`` nothing is saved either way.
+    """
+    rates = rates or rate_table
+    missing = set(amounts) - set(versions)
+    if missing:
+        raise ValueError(f"no version for expenses {sorted(missing)}")
+    try:
+        with transaction.atomic():
+            if request_version is not None:
+                _claim(Request, {request.pk: request_version})
+            _claim(RequestExpense, {pk: versions[pk] for pk in amounts}, request_id=request.pk)
+            # claimed rows stay locked by this transaction, so these values cannot change under us
+            expenses = list(RequestExpense.objects.filter(pk__in=amounts).order_by("pk"))
+            now = timezone.now()
+            decided = []
+            for expense in expenses:
+                amount, currency = amounts[expense.pk] if isinstance(amounts[expense.pk], tuple) else \
+                    (amounts[expense.pk], None)
+                decided.append((expense, expense.approved_amount, expense.approved_currency))
+                expense.approved_amount = amount
+                expense.approved_currency = currency or expense.approved_currency or expense.estimated_currency
+                expense.updated_at = now
+            owner = Request.objects.select_related("event__budget").get(pk=request.pk)
+            budget = owner.event.budget
+            if budget is not None and budget.amount is not None and owner.state != budgets.CANCELED_STATE:
+                needed = sum((_converted(expense.approved_amount, expense.approved_currency, budget, rates)
+                              - _converted(old, old_currency, budget, rates)
+                              for expense, old, old_currency in decided), ZERO)
+                if needed > 0:
+                    budgets.check(budgets.lock(budget), needed, rates)
+            RequestExpense.objects.bulk_update(expenses, ["approved_amount", "approved_currency", "updated_at"])
+            if dry_run:
+                transaction.set_rollback(True)
+    except _Unclaimed as unclaimed:
+        raise _conflict(unclaimed) from None
+    return expenses
+
+
+def approve_expense(expense, amount, currency=None, rates=None, dry_run=False):
+    """``approve`` for one expense, at the version it was loaded with; updates ``expense`` in place."""
+    request = Request(pk=expense.request_id)
+    [saved] = approve(request, {expense.pk: (amount, currency)}, versions={expense.pk: expense.lock_version},
+                      rates=rates, dry_run=dry_run)
+    if dry_run:
+        return expense
+    fields = ("approved_amount", "approved_currency", "updated_at", "lock_version")
+    for name in fields:
+        setattr(expense, name, getattr(saved, name))
+    tracking.remember(expense, fields)
+    return expense
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class EventConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'event'
+
+    def ready(self):
+        from . import audit, budgets, counters, search, tracing
+
+        audit.register_defaults()
+        budgets.register()
+        counters.register()
+        search.register_defaults()
+        tracing.install()
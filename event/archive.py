@@ -0,0 +1,317 @@
+"""
+Monthly archive and retention of the audit trail (``Audit`` and its ``AuditChange`` index).
+
+Old audit rows are never deleted one by one: a month is removed as a whole table.
+
+* PostgreSQL: both tables are range-partitioned by month on ``created_at``
+  (``archive_audits --setup`` converts existing tables once, in a maintenance
+  window). Partitions are created ahead of time; rows without a matching partition
+  land in the ``<table>_default`` partition and are moved out by ``split_default``.
+* SQLite and others, which cannot partition: rows older than ``AUDIT_HOT_MONTHS``
+  are moved a chunk per transaction into per-month archive tables
+  (``event_audit_y2024m01``), keeping the live table small.
+
+Months older than ``AUDIT_RETENTION_MONTHS`` are written to
+``AUDIT_ARCHIVE_ROOT/audits-YYYY-MM.jsonl.gz`` (outside ``MEDIA_ROOT``, the audit
+trail is not for whoever guesses the name) and their tables dropped.
+Audits without ``created_at`` stay where they are.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import Audit, AuditChange
+
+logger = logging.getLogger(__name__)
+
+TABLES = (Audit, AuditChange)
+DEFAULT_RETENTION_MONTHS = 24
+DEFAULT_HOT_MONTHS = 3
+PARTITIONS_AHEAD = 3
+MOVE_CHUNK = 5000
+_MONTH = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, n):
+    year, index = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return datetime(year, index + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def month_table(model, month):
+    return f"{model._meta.db_table}_y{month:%Y}m{month:%m}"
+
+
+def _literal(month):
+    # DDL cannot take query parameters; the bounds are always our own UTC month starts
+    return f"'{month:%Y-%m-%d} 00:00:00+00'"
+
+
+def _db(using):
+    return using or router.db_for_write(Audit)
+
+
+def month_tables(model, using=None):
+    """``{month: table}`` of the partitions (PostgreSQL) or archive tables of ``model``."""
+    connection = connections[_db(using)]
+    prefix = f"{model._meta.db_table}_y"
+    with connection.cursor() as cursor:
+        names = connection.introspection.table_names(cursor)
+    tables = {}
+    for name in names:
+        match = _MONTH.search(name)
+        if name.startswith(prefix) and match:
+            tables[datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)] = name
+    return dict(sorted(tables.items()))
+
+
+# ---------- PostgreSQL partitions ----------
+
+def is_partitioned(model=Audit, using=None):
+    connection = connections[_db(using)]
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+                       [model._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def estimated_rows(model, using=None):
+    """Row estimate of a (partitioned) PostgreSQL table from its statistics, or ``None``."""
+    connection = connections[_db(using)]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT sum(greatest(c.reltuples, 0))::bigint FROM pg_class c WHERE c.oid = to_regclass(%s)"
+            " OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+            [model._meta.db_table] * 2,
+        )
+        return cursor.fetchone()[0]
+
+
+def partition(model, using=None):
+    """
+    Turn the table of ``model`` into a partitioned table. The existing table becomes its
+    default partition (keeping its indexes); ``split_default`` then moves its rows into
+    monthly partitions.
+    """
+    connection = connections[_db(using)]
+    table = model._meta.db_table
+    legacy = f"{table}_default"
+    qn = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+        cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}")
+        # the identity sequence belongs to the old table; new rows take their ids from a plain sequence
+        cursor.execute(f"SELECT coalesce(max(id), 0) + 1 FROM {qn(legacy)}")
+        next_id = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE {qn(legacy)} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+        cursor.execute(f"CREATE SEQUENCE {qn(table + '_id_seq')} START {int(next_id)}")
+        cursor.execute(f"CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS)"
+                       f" PARTITION BY RANGE (created_at)")
+        cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+        cursor.execute(f"ALTER SEQUENCE {qn(table + '_id_seq')} OWNED BY {qn(table)}.id")
+        cursor.execute(f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(legacy)} DEFAULT")
+        # indexes of the parent table attach the equivalent (renamed) index of the old table
+        for name, info in constraints.items():
+            if info["index"] and not info["primary_key"] and not info["unique"]:
+                cursor.execute(f"ALTER INDEX {qn(name)} RENAME TO {qn(name[:54] + '_default')}")
+        # a partitioned table cannot have a primary key without created_at; ids come from
+        # the sequence, an index is enough for lookups
+        cursor.execute(f"CREATE INDEX {qn(table + '_id_idx')} ON {qn(table)} (id)")
+        with connection.schema_editor(atomic=False) as editor:
+            for statement in editor._model_indexes_sql(model):
+                editor.execute(statement)
+
+
+def _attach(cursor, qn, model, month):
+    table, name = model._meta.db_table, month_table(model, month)
+    start, end = _literal(month), _literal(add_months(month, 1))
+    in_range = f"created_at IS NOT NULL AND created_at >= {start} AND created_at < {end}"
+    cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS)")
+    # with this check in place the ATTACH does not have to scan the new table
+    cursor.execute(f"ALTER TABLE {qn(name)} ADD CONSTRAINT {qn(name + '_range')} CHECK ({in_range})")
+    cursor.execute(f"WITH moved AS (DELETE FROM {qn(table + '_default')} WHERE {in_range} RETURNING *)"
+                   f" INSERT INTO {qn(name)} SELECT * FROM moved")
+    cursor.execute(f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM ({start}) TO ({end})")
+    cursor.execute(f"ALTER TABLE {qn(name)} DROP CONSTRAINT {qn(name + '_range')}")
+
+
+def ensure_partitions(ahead=PARTITIONS_AHEAD, using=None):
+    """Create the partitions of this month and the next ``ahead`` months; returns the tables created."""
+    connection = connections[_db(using)]
+    qn = connection.ops.quote_name
+    this_month = month_start(timezone.now())
+    created = []
+    for model in TABLES:
+        existing = month_tables(model, using)
+        for n in range(ahead + 1):
+            month = add_months(this_month, n)
+            if month not in existing:
+                with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                    _attach(cursor, qn, model, month)
+                created.append(month_table(model, month))
+    return created
+
+
+def split_default(using=None):
+    """Move rows that landed in the default partitions into monthly partitions, a month per transaction."""
+    connection = connections[_db(using)]
+    qn = connection.ops.quote_name
+    moved = []
+    for model in TABLES:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT date_trunc('month', created_at) FROM"
+                           f" {qn(model._meta.db_table + '_default')} WHERE created_at IS NOT NULL")
+            months = sorted(month_start(row[0]) for row in cursor.fetchall())
+        for month in months:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                _attach(cursor, qn, model, month)
+            moved.append(month_table(model, month))
+    return moved
+
+
+# ---------- Archive tables (no partitioning) ----------
+
+def archive_rows(before, chunk=MOVE_CHUNK, using=None):
+    """
+    Move audits created before ``before`` (and their ``AuditChange`` rows) into monthly
+    archive tables, ``chunk`` audits per transaction so writers are only held up briefly.
+    Returns the number of audits moved.
+    """
+    connection = connections[_db(using)]
+    qn = connection.ops.quote_name
+    moved = 0
+    while True:
+        rows = list(Audit.objects.using(connection.alias).filter(created_at__lt=before)
+                    .order_by("created_at").values_list("pk", "created_at")[:chunk])
+        if not rows:
+            return moved
+        by_month = {}
+        for pk, created_at in rows:
+            by_month.setdefault(month_start(created_at), []).append(pk)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            for month, ids in by_month.items():
+                placeholders = ", ".join(["%s"] * len(ids))
+                for model, column in ((Audit, "id"), (AuditChange, "audit_id")):
+                    table, name = model._meta.db_table, month_table(model, month)
+                    cursor.execute(f"CREATE TABLE IF NOT EXISTS {qn(name)} AS SELECT * FROM {qn(table)} WHERE 1 = 0")
+                    cursor.execute(f"INSERT INTO {qn(name)} SELECT * FROM {qn(table)}"
+                                   f" WHERE {column} IN ({placeholders})", ids)
+                    cursor.execute(f"DELETE FROM {qn(table)} WHERE {column} IN ({placeholders})", ids)
+        moved += len(rows)
+
+
+# ---------- Export and retention ----------
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"cannot export {type(value).__name__}")
+
+
+def archive_path(month):
+    return os.path.join(settings.AUDIT_ARCHIVE_ROOT, f"audits-{month:%Y-%m}.jsonl.gz")
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def export_month(month, using=None):
+    """
+    Write the audits of ``month`` as gzipped JSON lines (one row per line, columns as
+    stored) and return the path. The file, and its name in the directory, are on
+    disk before this returns, so the month can be dropped after it.
+    """
+    connection = connections[_db(using)]
+    table = month_tables(Audit, using)[month]
+    path = archive_path(month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + ".partial"
+    rows = 0
+    with open(partial, "wb") as raw:
+        # a server-side cursor on PostgreSQL, so a month never has to fit in memory
+        with connection.chunked_cursor() as cursor, gzip.open(raw, "wt", encoding="utf-8") as out:
+            cursor.execute(f"SELECT * FROM {connection.ops.quote_name(table)} ORDER BY id")
+            columns = [column[0] for column in cursor.description]
+            while batch := cursor.fetchmany(2000):
+                for row in batch:
+                    out.write(json.dumps(dict(zip(columns, row)), default=_json_default) + "\n")
+                rows += len(batch)
+        # only now, with the gzip stream closed, is its trailer written
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial, path)
+    _fsync_dir(os.path.dirname(path))
+    logger.info("exported %s audits of %s to %s", rows, f"{month:%Y-%m}", path)
+    return path
+
+
+def drop_month(month, using=None):
+    connection = connections[_db(using)]
+    qn = connection.ops.quote_name
+    partitioned = is_partitioned(using=using)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for model in TABLES:
+            name = month_tables(model, using).get(month)
+            if name is None:
+                continue
+            if partitioned:
+                cursor.execute(f"ALTER TABLE {qn(model._meta.db_table)} DETACH PARTITION {qn(name)}")
+            cursor.execute(f"DROP TABLE {qn(name)}")
+
+
+def expired_months(retention_months, using=None):
+    cutoff = add_months(month_start(timezone.now()), -retention_months)
+    months = {month for month in month_tables(Audit, using) if month < cutoff}
+    if not is_partitioned(using=using):  # not moved to archive tables yet
+        months.update(datetime(day.year, day.month, 1, tzinfo=dt_timezone.utc) for day in
+                      Audit.objects.using(_db(using)).filter(created_at__lt=cutoff).dates("created_at", "month"))
+    return sorted(months)
+
+
+def run(retention_months=None, hot_months=None, export=True, dry_run=False, using=None):
+    """
+    One maintenance pass: prepare partitions (or move cold rows into archive tables),
+    then export and drop every month past retention. Returns a summary dict.
+    """
+    retention_months = retention_months or getattr(settings, "AUDIT_RETENTION_MONTHS",
+                                                   DEFAULT_RETENTION_MONTHS)
+    hot_months = hot_months or getattr(settings, "AUDIT_HOT_MONTHS", DEFAULT_HOT_MONTHS)
+    summary = {"created": [], "archived": 0, "expired": [], "files": []}
+    partitioned = is_partitioned(using=using)
+    if not dry_run:
+        if partitioned:
+            summary["created"] = split_default(using) + ensure_partitions(using=using)
+        else:
+            before = add_months(month_start(timezone.now()), -min(hot_months, retention_months))
+            summary["archived"] = archive_rows(before, using=using)
+    for month in expired_months(retention_months, using):
+        summary["expired"].append(f"{month:%Y-%m}")
+        if dry_run:
+            continue
+        if export:
+            summary["files"].append(export_month(month, using))
+        drop_month(month, using)
+    return summary
@@ -0,0 +1,375 @@
+"""
+Audit trail writer for the ``Audit`` model (modelled on the Rails ``audited`` gem).
+
+Saves, deletes and ``bulk_update`` calls of registered models are turned into field
+diffs (see ``tracking``) but nothing is inserted right away: inside a transaction the
+audits are staged with ``transaction.on_commit`` and written with one ``bulk_create``
+per transaction after the outermost commit (audits of a rolled back transaction or savepoint are
+dropped with it); outside a transaction they are collected for the rest of the
+request by ``AuditMiddleware``. An admin change form with many inlines therefore costs
+one insert.
+
+``audited_changes`` holds the diff as compact JSON (``{"field": [old, new]}``, or the
+values themselves for create/destroy), zlib-compressed when large, and every changed
+field gets an ``AuditChange`` row so ``field_history`` answers "who changed this
+field" through an index without parsing unrelated audits. Rows written in the old
+Rails YAML format are still read (with PyYAML installed) and are converted by
+``manage.py reencode_audits``.
+
+Version numbers come from the ``AuditVersion`` counter of each audited object and are
+allocated for a whole flush with a single ``INSERT ... ON CONFLICT DO UPDATE ...
+RETURNING`` statement, so concurrent writers never read-modify-write the same version.
+"""
+import base64
+import contextvars
+import json
+import logging
+import uuid
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from . import tracing, tracking
+from .models import Audit, AuditChange, AuditVersion
+
+try:
+    import yaml  # only needed to read audits written by the Rails application
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+CREATE, UPDATE, DESTROY = "create", "update", "destroy"
+IGNORED_FIELDS = ("created_at", "updated_at", "lock_version")
+VERSION_CHUNK = 500  # objects per version statement, well below the bind parameter limits
+COMPRESSED_PREFIX = "z:"
+COMPRESS_THRESHOLD = 512  # bytes of JSON above which a diff is stored compressed
+
+
+@dataclass
+class AuditOptions:
+    associated: str = None  # name of the foreign key to the owning record, e.g. "reimbursement"
+    exclude: tuple = IGNORED_FIELDS
+
+
+_registry = {}
+
+# who is making the changes: set per request by AuditMiddleware, or by ``audit_context``
+_context = contextvars.ContextVar("audit_context", default=None)
+# audits recorded outside a transaction during a request
+_request_buffer = contextvars.ContextVar("audit_request_buffer", default=None)
+
+
+def register(model, associated=None, exclude=IGNORED_FIELDS):
+    _registry[model] = AuditOptions(associated, tuple(exclude))
+    tracking.track(model, exclude=exclude)
+    uid = f"audit-{model._meta.label}"
+    post_save.connect(_saved, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(_deleted, sender=model, weak=False, dispatch_uid=uid)
+    tracking.post_bulk_update.connect(_bulk_updated, sender=model, weak=False, dispatch_uid=uid)
+
+
+def set_context(user=None, remote_address=None, request_uuid=None, comment=None):
+    """Attribute the audits recorded from here on in this thread/task; returns a token for ``reset_context``."""
+    return _context.set({"user": user, "remote_address": remote_address,
+                         "request_uuid": request_uuid or tracing.current_request_id() or str(uuid.uuid4()),
+                         "comment": comment})
+
+
+def reset_context(token):
+    _context.reset(token)
+
+
+# ---------- Change format ----------
+
+def encode_changes(changes):
+    text = json.dumps(changes, cls=DjangoJSONEncoder, separators=(",", ":"))
+    if len(text) > COMPRESS_THRESHOLD:
+        packed = COMPRESSED_PREFIX + base64.b64encode(zlib.compress(text.encode(), 6)).decode()
+        if len(packed) < len(text):
+            return packed
+    return text
+
+
+if yaml is not None:
+    class _RailsLoader(yaml.SafeLoader):
+        """Safe YAML that reads Ruby-tagged values (``!ruby/object:BigDecimal 18:0.1E2``) as plain data."""
+
+    def _ruby(loader, suffix, node):
+        if isinstance(node, yaml.ScalarNode):
+            value = loader.construct_scalar(node)
+            return value.split(":", 1)[1] if suffix.endswith("BigDecimal") and ":" in value else value
+        if isinstance(node, yaml.SequenceNode):
+            return loader.construct_sequence(node, deep=True)
+        return loader.construct_mapping(node, deep=True)
+
+    _RailsLoader.add_multi_constructor("!ruby/", _ruby)
+
+
+def decode_changes(text):
+    """The changes dict of an ``audited_changes`` value, in any format ever written."""
+    if not text:
+        return {}
+    if text.startswith(COMPRESSED_PREFIX):
+        try:
+            return json.loads(zlib.decompress(base64.b64decode(text[len(COMPRESSED_PREFIX):])))
+        except zlib.error as e:
+            raise ValueError(f"corrupt compressed audit: {e}") from e
+    if text.startswith("{"):
+        return json.loads(text)
+    if yaml is None:
+        raise ValueError("audit written in YAML, install PyYAML to read it")
+    try:
+        changes = yaml.load(text, Loader=_RailsLoader) or {}
+    except yaml.YAMLError as e:
+        raise ValueError(f"unreadable audit: {e}") from e
+    if not isinstance(changes, dict):
+        raise ValueError("audit changes are not a mapping")
+    return changes
+
+
+def as_pair(action, value):
+    """``(old, new)`` of one field of an audit."""
+    if action == UPDATE and isinstance(value, (list, tuple)) and len(value) == 2:
+        return tuple(value)
+    return (value, None) if action == DESTROY else (None, value)
+
+
+# ---------- Building audits ----------
+
+
+def build(instance, action, changes):
+    options = _registry[type(instance)]
+    context = _context.get() or {}
+    user = context.get("user")
+    audit = Audit(
+        auditable_content_type=ContentType.objects.get_for_model(instance, for_concrete_model=False),
+        auditable_object_id=instance.pk,
+        action=action,
+        audited_changes=encode_changes(changes),
+        comment=context.get("comment"),
+        created_at=timezone.now(),
+        remote_address=context.get("remote_address"),
+        request_uuid=context.get("request_uuid") or tracing.current_request_id(),
+    )
+    if user is not None and getattr(user, "is_authenticated", False):
+        audit.user_id = user.pk
+        audit.username = user.get_username()
+    if options.associated:
+        field = type(instance)._meta.get_field(options.associated)
+        associated_id = getattr(instance, field.attname)
+        if associated_id is not None:
+            audit.associated_content_type = ContentType.objects.get_for_model(field.related_model)
+            audit.associated_object_id = associated_id
+    audit._changed_fields = list(changes)
+    return audit
+
+
+def _saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        values = {name: instance.__dict__.get(attname) for name, attname in tracking.tracked_fields(sender)}
+        record(build(instance, CREATE, {k: v for k, v in values.items() if v is not None}),
+               using=kwargs.get("using"))
+    else:
+        diff = tracking.changes(instance, update_fields)
+        if diff:
+            record(build(instance, UPDATE, {k: list(v) for k, v in diff.items()}), using=kwargs.get("using"))
+    tracking.remember(instance, update_fields)
+
+
+def _deleted(sender, instance, **kwargs):
+    saved = tracking.saved_values(instance)
+    values = {name: saved.get(attname) for name, attname in tracking.tracked_fields(sender)}
+    values = {name: value for name, value in values.items() if value is not None}
+    record(build(instance, DESTROY, values), using=kwargs.get("using"))
+
+
+def _bulk_updated(sender, changes, using=None, **kwargs):
+    for instance, diff in changes.items():
+        record(build(instance, UPDATE, {k: list(v) for k, v in diff.items()}), using=using)
+
+
+# ---------- Buffering ----------
+
+class _Staged:
+    """
+    The on_commit callback holding the audits of one transaction (or savepoint) level.
+
+    Audits recorded inside a savepoint are staged separately so that Django drops them
+    with the savepoint if it is rolled back; usually a transaction has just one.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.audits = []
+
+    def __call__(self):
+        write(self.audits, using=self.using)
+
+
+def record(audit, using=None):
+    using = using or router.db_for_write(Audit)
+    conn = connections[using]
+    if conn.in_atomic_block:
+        key = tuple(conn.savepoint_ids)
+        staged = conn.__dict__.setdefault("_audits_staged", {}).get(key)
+        # a callback that is no longer registered belongs to a finished (or rolled back) transaction
+        if staged is None or not any(entry[1] is staged for entry in conn.run_on_commit):
+            staged = conn.__dict__["_audits_staged"][key] = _Staged(using)
+            # robust: an audit that cannot be written must not fail a request that already committed
+            transaction.on_commit(staged, using=using, robust=True)
+        staged.audits.append(audit)
+        return
+    buffer = _request_buffer.get()
+    if buffer is not None:
+        buffer.append(audit)
+    else:
+        write([audit], using=using)
+
+
+def flush_request_buffer():
+    buffer = _request_buffer.get()
+    if buffer:
+        audits = list(buffer)
+        buffer.clear()
+        write(audits)
+
+
+# ---------- Writing ----------
+
+def allocate_versions(keys, using=None):
+    """
+    Reserve ``count`` versions for each ``(content_type_id, object_id): count`` of ``keys``
+    and return the last one reserved per key, with one statement per ``VERSION_CHUNK`` keys.
+    """
+    using = using or router.db_for_write(AuditVersion)
+    conn = connections[using]
+    if not keys:
+        return {}
+    if conn.vendor in ("postgresql", "sqlite"):
+        table = conn.ops.quote_name(AuditVersion._meta.db_table)
+        items = list(keys.items())
+        last = {}
+        with conn.cursor() as cursor:
+            for start in range(0, len(items), VERSION_CHUNK):
+                chunk = items[start:start + VERSION_CHUNK]
+                rows = ", ".join(["(%s, %s, %s)"] * len(chunk))
+                params = [value for (content_type_id, object_id), count in chunk
+                          for value in (content_type_id, object_id, count)]
+                cursor.execute(
+                    f"INSERT INTO {table} (content_type_id, object_id, version) VALUES {rows} "
+                    f"ON CONFLICT (content_type_id, object_id) "
+                    f"DO UPDATE SET version = {table}.version + excluded.version "
+                    f"RETURNING content_type_id, object_id, version",
+                    params,
+                )
+                last.update(((ct, obj), version) for ct, obj, version in cursor.fetchall())
+        return last
+    last = {}
+    with transaction.atomic(using=using):
+        for (content_type_id, object_id), count in keys.items():
+            counter, _ = AuditVersion.objects.using(using).select_for_update().get_or_create(
+                content_type_id=content_type_id, object_id=object_id)
+            counter.version += count
+            counter.save(update_fields=["version"])
+            last[(content_type_id, object_id)] = counter.version
+    return last
+
+
+def index_rows(audits):
+    """``AuditChange`` rows of saved ``audits``."""
+    rows = []
+    for audit in audits:
+        fields = getattr(audit, "_changed_fields", None)
+        if fields is None:
+            fields = list(decode_changes(audit.audited_changes))
+        rows += [
+            AuditChange(audit_id=audit.pk, content_type_id=audit.auditable_content_type_id,
+                        object_id=audit.auditable_object_id, field=field[:64], created_at=audit.created_at)
+            for field in fields
+        ]
+    return rows
+
+
+def write(audits, using=None):
+    """Number and insert ``audits`` and their field index, with one ``bulk_create`` each."""
+    if not audits:
+        return []
+    using = using or router.db_for_write(Audit)
+    counts = Counter((a.auditable_content_type_id, a.auditable_object_id) for a in audits)
+    with transaction.atomic(using=using):
+        last = allocate_versions(counts, using=using)
+        first = {key: version - counts[key] + 1 for key, version in last.items()}
+        for audit in audits:  # in recording order, so versions follow the order of the changes
+            key = (audit.auditable_content_type_id, audit.auditable_object_id)
+            audit.version = first[key]
+            first[key] += 1
+        Audit.objects.using(using).bulk_create(audits)
+        AuditChange.objects.using(using).bulk_create(index_rows(audits))
+    return audits
+
+
+def field_history(model, object_id, field, limit=50):
+    """
+    Latest changes of ``field`` on one object, newest first: dicts with ``at``, ``user``,
+    ``username``, ``action``, ``version``, ``old``, ``new`` and ``request_uuid``.
+    """
+    content_type = ContentType.objects.get_for_model(model, for_concrete_model=False)
+    entries = (AuditChange.objects.filter(content_type=content_type, object_id=object_id, field=field)
+               .select_related("audit").order_by("-created_at", "-audit_id")[:limit])
+    history = []
+    for entry in entries:
+        audit = entry.audit
+        old, new = as_pair(audit.action, decode_changes(audit.audited_changes).get(field))
+        history.append({"at": audit.created_at, "user": audit.user_id, "username": audit.username,
+                        "action": audit.action, "version": audit.version, "old": old, "new": new,
+                        "request_uuid": audit.request_uuid})
+    return history
+
+
+# ---------- Requests ----------
+
+def client_address(request):
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    return forwarded.split(",")[0].strip() if forwarded else request.META.get("REMOTE_ADDR")
+
+
+class audit_context:
+    """``with audit_context(user=..., comment=...):`` attributes and batches the audits of a block."""
+
+    def __init__(self, **context):
+        self.context = context
+
+    def __enter__(self):
+        self._token = set_context(**self.context)
+        self._buffer = _request_buffer.set([])
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            flush_request_buffer()
+        finally:
+            _request_buffer.reset(self._buffer)
+            reset_context(self._token)
+
+
+def register_defaults():
+    from . import models
+
+    register(models.Budget)
+    register(models.Event, associated="budget")
+    register(models.Request, associated="event")
+    register(models.RequestExpense, associated="request")
+    register(models.Reimbursement, associated="request")
+    register(models.BankAccount, associated="reimbursement")
+    register(models.Payment, associated="reimbursement")
+    register(models.ReimbursementAttachment, associated="reimbursement")
+    register(models.ReimbursementLink, associated="reimbursement")
@@ -0,0 +1,348 @@
+"""
+Running budget totals.
+
+``BudgetTotal`` keeps the estimated, approved and authorised expense amounts and the
+paid amount of every event and every budget, one row per currency. Amounts are
+summed in the currency they were entered in and only converted when read, so
+changing rates never makes the totals drift.
+
+Saves, deletes and ``bulk_update`` of expenses and payments adjust the rows with
+``F()`` increments in the same transaction. So do requests moving to another event
+or to or from ``canceled``, and events moving to another budget. Expenses of
+canceled requests and payments whose transfer failed do not count.
+``reconcile`` (``manage.py reconcile_budgets``, also a periodic job) recomputes
+everything from the expenses and payments and repairs what drifted.
+
+``lock`` and ``check`` let approvals (see ``event.approvals``) hold the budget row
+while they compare new amounts with what is still available, so concurrent approvals
+of one budget cannot overspend it. The check reads a handful of ``BudgetTotal`` rows
+however many requests the budget has.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from . import tracking
+from .models import Budget, BudgetTotal, Event, Payment, Reimbursement, Request, RequestExpense
+from .transfers import TERMINAL_STATES
+from .wise.rates import rate_table
+
+COLUMNS = ("estimated", "approved", "authorized", "paid")
+# column -> (amount, currency) field of RequestExpense
+EXPENSE_COLUMNS = {
+    "estimated": ("estimated_amount", "estimated_currency"),
+    "approved": ("approved_amount", "approved_currency"),
+    "authorized": ("authorized_amount", "approved_currency"),
+}
+CANCELED_STATE = "canceled"
+FAILED_PAYMENTS = tuple(state for state, event in TERMINAL_STATES.items() if event == "payout_failed")
+ZERO = Decimal("0")
+
+_BEFORE = "_budgeted_as"
+
+
+class BudgetExceeded(Exception):
+
+    def __init__(self, budget, needed, available):
+        self.budget = budget
+        self.needed = needed
+        self.available = available
+        super().__init__(f"{budget}: {needed} {budget.currency} needed, {available} available")
+
+
+class UnknownRate(Exception):
+
+    def __init__(self, budget, currencies):
+        self.budget = budget
+        self.currencies = sorted(set(currencies))
+        super().__init__(f"{budget}: no rate from {', '.join(self.currencies)} to {budget.currency}, "
+                         "so what is still available is not known")
+
+
+# ---------- Applying changes ----------
+
+def _bump(lookup, create, currency, amounts, now):
+    rows = BudgetTotal.objects.filter(currency=currency, **lookup)
+    if rows.update(updated_at=now, **{column: F(column) + amount for column, amount in amounts.items()}):
+        return
+    if any(amount < 0 for amount in amounts.values()):
+        return  # nothing recorded to take from; reconcile repairs that
+    try:
+        with transaction.atomic():
+            BudgetTotal.objects.create(currency=currency, updated_at=now, **create, **amounts)
+    except IntegrityError:  # created concurrently
+        rows.update(updated_at=now, **{column: F(column) + amount for column, amount in amounts.items()})
+
+
+def apply(deltas):
+    """Add ``{(event id, currency, column): amount}`` to the event rows and the rows of their budgets."""
+    deltas = {key: amount for key, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    budgets = dict(Event.objects.filter(pk__in={key[0] for key in deltas}).values_list("pk", "budget_id"))
+    rows = defaultdict(lambda: defaultdict(Decimal))
+    for (event_id, currency, column), amount in deltas.items():
+        rows[("event", event_id, currency)][column] += amount
+        if budgets.get(event_id):
+            rows[("budget", budgets[event_id], currency)][column] += amount
+    now = timezone.now()
+    # always in the same order, so two transactions never wait on each other's rows crosswise
+    for (scope, pk, currency), amounts in sorted(rows.items()):
+        if scope == "event":
+            _bump({"event_id": pk}, {"event_id": pk}, currency, amounts, now)
+        else:
+            _bump({"budget_id": pk, "event__isnull": True}, {"budget_id": pk}, currency, amounts, now)
+
+
+def _expense_parts(values):
+    for column, (amount, currency) in EXPENSE_COLUMNS.items():
+        if values.get(amount):
+            yield values.get("request_id"), values.get(currency) or "", column, Decimal(values[amount])
+
+
+def _payment_parts(values):
+    if values.get("amount") and values.get("status") not in FAILED_PAYMENTS:
+        yield values.get("reimbursement_id"), values.get("currency") or "", "paid", Decimal(values["amount"])
+
+
+def _events_of(model, owners):
+    owners = {owner for owner in owners if owner is not None}
+    if not owners:
+        return {}
+    if model is RequestExpense:
+        return {pk: event_id for pk, event_id, state in
+                Request.objects.filter(pk__in=owners).values_list("pk", "event_id", "state")
+                if state != CANCELED_STATE}
+    return dict(Reimbursement.objects.filter(pk__in=owners).values_list("pk", "request__event_id"))
+
+
+PARTS = {RequestExpense: _expense_parts, Payment: _payment_parts}
+
+
+def _changed(model, pairs):
+    """``pairs`` of stored values ``(before, after)`` of expenses or payments, ``None`` when absent."""
+    parts = PARTS[model]
+    entries = []
+    for before, after in pairs:
+        old, new = list(parts(before or {})), list(parts(after or {}))
+        if old != new:
+            entries += [(owner, currency, column, -amount) for owner, currency, column, amount in old]
+            entries += new
+    if not entries:
+        return
+    events = _events_of(model, {entry[0] for entry in entries})
+    deltas = defaultdict(Decimal)
+    for owner, currency, column, amount in entries:
+        if events.get(owner):
+            deltas[(events[owner], currency, column)] += amount
+    apply(deltas)
+
+
+def _requests_moved(moves):
+    """``{request id: (event id counted before, event id counted now)}``, ``None`` for not counted."""
+    moves = {pk: (old, new) for pk, (old, new) in moves.items() if old != new}
+    if not moves:
+        return
+    deltas = defaultdict(Decimal)
+    for column, (amount, currency) in EXPENSE_COLUMNS.items():
+        for request_id, code, total in (RequestExpense.objects.filter(request_id__in=moves)
+                                        .values_list("request_id", currency).annotate(total=Sum(amount))
+                                        .order_by()):
+            old, new = moves[request_id]
+            if total:
+                if old:
+                    deltas[(old, code or "", column)] -= total
+                if new:
+                    deltas[(new, code or "", column)] += total
+    apply(deltas)
+
+
+def _events_moved(moves):
+    """``{event id: (old budget id, new budget id)}``: the event's totals follow it."""
+    moves = {pk: (old, new) for pk, (old, new) in moves.items() if old != new}
+    if not moves:
+        return
+    now = timezone.now()
+    changes = defaultdict(lambda: defaultdict(Decimal))
+    for row in BudgetTotal.objects.filter(event_id__in=moves):
+        old, new = moves[row.event_id]
+        for column in COLUMNS:
+            amount = getattr(row, column)
+            if old:
+                changes[(old, row.currency)][column] -= amount
+            if new:
+                changes[(new, row.currency)][column] += amount
+    for (budget_id, currency), amounts in sorted(changes.items()):
+        _bump({"budget_id": budget_id, "event__isnull": True}, {"budget_id": budget_id}, currency, amounts, now)
+
+
+# ---------- Signals ----------
+
+def _stored(sender, instance, before, update_fields):
+    """The values ``instance`` has in the database after a save with ``update_fields``."""
+    current = {attname: instance.__dict__.get(attname) for _, attname in tracking.tracked_fields(sender)}
+    if update_fields is None or before is None:
+        return current
+    return {attname: current[attname] if name in update_fields or attname in update_fields else before.get(attname)
+            for name, attname in tracking.tracked_fields(sender)}
+
+
+def _counted(values):
+    return values.get("event_id") if values.get("state") != CANCELED_STATE else None
+
+
+def _before_save(sender, instance, raw=False, **kwargs):
+    instance.__dict__[_BEFORE] = None if raw or instance._state.adding else dict(tracking.saved_values(instance))
+
+
+def _saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    before = instance.__dict__.pop(_BEFORE, None)
+    if raw:
+        return
+    after = _stored(sender, instance, before, update_fields)
+    if sender is Request:
+        if before is not None:
+            _requests_moved({instance.pk: (_counted(before), _counted(after))})
+    elif sender is Event:
+        if before is not None:
+            _events_moved({instance.pk: (before.get("budget_id"), after.get("budget_id"))})
+    else:
+        _changed(sender, [(before, after)])
+
+
+def _deleted(sender, instance, **kwargs):
+    if sender in PARTS:
+        _changed(sender, [(tracking.saved_values(instance) or instance.__dict__, None)])
+
+
+def _bulk_updated(sender, changes, **kwargs):
+    def before_of(instance, diff):
+        values = {attname: instance.__dict__.get(attname) for _, attname in tracking.tracked_fields(sender)}
+        for name, (old, _) in diff.items():
+            values[sender._meta.get_field(name).attname] = old
+        return values
+
+    pairs = [(before_of(instance, diff), {**instance.__dict__}) for instance, diff in changes.items()]
+    if sender is Request:
+        _requests_moved({after["id"]: (_counted(before), _counted(after)) for before, after in pairs})
+    elif sender is Event:
+        _events_moved({after["id"]: (before.get("budget_id"), after.get("budget_id")) for before, after in pairs})
+    else:
+        _changed(sender, pairs)
+
+
+def register():
+    for model in (RequestExpense, Payment, Request, Event):
+        uid = f"budget-total-{model._meta.label}"
+        pre_save.connect(_before_save, sender=model, weak=False, dispatch_uid=uid)
+        post_save.connect(_saved, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(_deleted, sender=model, weak=False, dispatch_uid=uid)
+        tracking.post_bulk_update.connect(_bulk_updated, sender=model, weak=False, dispatch_uid=uid)
+
+
+# ---------- Reading and approving ----------
+
+def totals(budget=None, event=None):
+    """``{currency: {column: amount}}`` of a budget or an event, as entered."""
+    rows = BudgetTotal.objects.filter(event=event) if event is not None else \
+        BudgetTotal.objects.filter(budget=budget, event__isnull=True)
+    return {row.currency: {column: getattr(row, column) for column in COLUMNS} for row in rows}
+
+
+def position(budget, rates=None):
+    """
+    The totals of ``budget`` converted to its currency, plus ``amount``, ``available``
+    (amount minus approved) and ``unconverted``: currencies without a known rate.
+    """
+    rates = rates or rate_table
+    result = dict.fromkeys(COLUMNS, ZERO)
+    result["unconverted"] = []
+    for currency, amounts in totals(budget=budget).items():
+        for column, amount in amounts.items():
+            converted = rates.convert(amount, currency or budget.currency, budget.currency)
+            if converted is None:
+                result["unconverted"].append(currency)
+                break
+            result[column] += converted
+    result["amount"] = budget.amount
+    result["available"] = budget.amount - result["approved"] if budget.amount is not None else None
+    return result
+
+
+def lock(budget):
+    """``budget`` re-read and locked until the transaction ends; only approvals of the same budget wait for it."""
+    return Budget.objects.select_for_update().get(pk=budget.pk)
+
+
+def check(budget, needed, rates=None):
+    """
+    Raise ``BudgetExceeded`` unless ``needed`` more (in the budget's currency) is still
+    available, or ``UnknownRate`` if part of what is committed cannot be converted.
+    """
+    if needed <= 0:
+        return
+    current = position(budget, rates)
+    if current["unconverted"]:
+        raise UnknownRate(budget, current["unconverted"])
+    if needed > current["available"]:
+        raise BudgetExceeded(budget, needed, current["available"])
+
+
+# ---------- Reconciling ----------
+
+def actual_totals():
+    """``{(scope, id, currency): {column: amount}}`` recomputed from expenses and payments."""
+    events = defaultdict(lambda: dict.fromkeys(COLUMNS, ZERO))
+    expenses = RequestExpense.objects.exclude(request__state=CANCELED_STATE)
+    for column, (amount, currency) in EXPENSE_COLUMNS.items():
+        for event_id, code, total in (expenses.values_list("request__event_id", currency)
+                                      .annotate(total=Sum(amount)).order_by()):
+            if total:
+                events[(event_id, code or "")][column] += total
+    for event_id, code, total in (Payment.objects.filter(reimbursement__isnull=False)
+                                  .exclude(status__in=FAILED_PAYMENTS)
+                                  .values_list("reimbursement__request__event_id", "currency")
+                                  .annotate(total=Sum("amount")).order_by()):
+        if total:
+            events[(event_id, code or "")]["paid"] += total
+    budgets = dict(Event.objects.filter(budget__isnull=False).values_list("pk", "budget_id"))
+    result = {}
+    for (event_id, currency), amounts in events.items():
+        result[("event", event_id, currency)] = amounts
+        if event_id in budgets:
+            budget = result.setdefault(("budget", budgets[event_id], currency), dict.fromkeys(COLUMNS, ZERO))
+            for column, amount in amounts.items():
+                budget[column] += amount
+    return result
+
+
+def reconcile(dry_run=False):
+    """Recompute every total and repair the rows that drifted; returns ``{key: (stored, actual)}``."""
+    drift = {}
+    with transaction.atomic():
+        stored = {("event", row.event_id, row.currency) if row.event_id else ("budget", row.budget_id, row.currency): row
+                  for row in BudgetTotal.objects.select_for_update()}
+        actual = actual_totals()
+        empty = dict.fromkeys(COLUMNS, ZERO)
+        for key in stored.keys() | actual.keys():
+            have = {column: getattr(stored[key], column) for column in COLUMNS} if key in stored else empty
+            should = actual.get(key, empty)
+            if have != should:
+                drift[key] = (have, should)
+        if dry_run or not drift:
+            return drift
+        now = timezone.now()
+        update, create = [], []
+        for key, (_, amounts) in drift.items():
+            row = stored.get(key) or BudgetTotal(currency=key[2], **{f"{key[0]}_id": key[1]})
+            for column, amount in amounts.items():
+                setattr(row, column, amount)
+            row.updated_at = now
+            (update if row.pk else create).append(row)
+        BudgetTotal.objects.bulk_update(update, [*COLUMNS, "updated_at"])
+        BudgetTotal.objects.bulk_create(create)
+    return drift
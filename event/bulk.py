@@ -0,0 +1,149 @@
+"""
+Bulk operations of the admin's changelist actions.
+
+An operation changes a whole selection with set-based statements, a chunk of
+``CHUNK_SIZE`` rows per transaction: validating and archiving events is one
+``UPDATE`` per chunk, adding an organiser one ``bulk_create``, and a state transition
+is a ``Machine.bulk`` per chunk. Nothing is saved object by object, and a long run
+holds its row locks for one chunk at a time::
+
+    outcome = bulk.run(Event.objects.filter(start_date__year=2024), "archive", user=user)
+    outcome.changed, outcome.skipped  # skipped: Counter of reasons
+
+``update()`` sends no signals, so ``_update`` sends ``tracking.post_bulk_update``
+itself, and audits, budget totals and state counts follow as after a ``bulk_update``.
+
+A selection of more than ``BACKGROUND_THRESHOLD`` rows is run by the ``bulk_action``
+job instead of the admin request, on the primary keys selected (``run_selection``).
+The job reports its progress on its ``DelayedJob`` row (shown in the delayed job
+admin) and mails a summary when done.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import tracking
+from .models import EventOrganizer
+from .states import machine_for
+
+CHUNK_SIZE = 500
+BACKGROUND_THRESHOLD = 2000
+
+
+@dataclass
+class Outcome:
+    total: int = 0
+    done: int = 0
+    changed: int = 0
+    # reason -> number of rows left alone for it
+    skipped: Counter = field(default_factory=Counter)
+
+    def __str__(self):
+        text = f"{self.changed} of {self.total} changed"
+        if self.skipped:
+            text += " (skipped: " + ", ".join(f"{n} {reason}" for reason, n in self.skipped.most_common()) + ")"
+        return text
+
+
+# name -> function(objects, *, user, now, **options) returning (changed, {pk: reason skipped})
+OPERATIONS = {}
+
+
+def operation(name):
+    def register(func):
+        OPERATIONS[name] = func
+        return func
+    return register
+
+
+def run(queryset, name, *, user=None, chunk_size=CHUNK_SIZE, progress=None, **options):
+    """
+    Apply operation ``name`` to ``queryset`` chunk by chunk, in primary key order,
+    calling ``progress(outcome)`` after each committed chunk.
+    """
+    return _run(queryset.model, queryset.count(), _keyset_chunks(queryset, chunk_size), name,
+                user=user, progress=progress, **options)
+
+
+def run_selection(selection, name, *, user=None, chunk_size=CHUNK_SIZE, progress=None, **options):
+    """``run`` on the rows of a ``jobs.Selection``; rows deleted since it was made count as done."""
+    return _run(selection.model, len(selection), selection.chunks(chunk_size), name,
+                user=user, progress=progress, **options)
+
+
+def _keyset_chunks(queryset, chunk_size):
+    pks = queryset.order_by("pk").values_list("pk", flat=True)
+    last = None
+    # seeks past the last chunk instead of offsets, so rows an operation moves out of the selection are not missed
+    while chunk := list((pks if last is None else pks.filter(pk__gt=last))[:chunk_size]):
+        yield chunk
+        last = chunk[-1]
+
+
+def _run(model, total, chunks, name, *, user, progress, **options):
+    func = OPERATIONS[name]
+    manager = model._default_manager
+    outcome = Outcome(total=total)
+    for chunk in chunks:
+        with transaction.atomic():
+            changed, skipped = func(manager.filter(pk__in=chunk), user=user, now=timezone.now(), **options)
+        outcome.done += len(chunk)
+        outcome.changed += changed
+        outcome.skipped.update(skipped.values())
+        if progress is not None:
+            progress(outcome)
+    return outcome
+
+
+def _update(objects, values, now):
+    """``objects.update(**values)`` for the rows that differ, with the change tracking of a ``bulk_update``."""
+    model = objects.model
+    differs = Q()
+    for name, value in values.items():
+        differs |= ~Q(**{name: value})
+    rows = list(objects.filter(differs).select_for_update().order_by("pk"))
+    if not rows:
+        return 0, {}
+    if "updated_at" in {f.name for f in model._meta.concrete_fields}:
+        values = {**values, "updated_at": now}
+    model._default_manager.filter(pk__in=[row.pk for row in rows]).update(**values)
+    for row in rows:
+        for name, value in values.items():
+            setattr(row, name, value)
+    changes = {row: diff for row in rows if (diff := tracking.changes(row, values))}
+    if changes:
+        tracking.post_bulk_update.send(sender=model, changes=changes, using=objects.db)
+    for row in rows:
+        tracking.remember(row, values)
+    return len(rows), {}
+
+
+# ---------- Operations ----------
+
+@operation("validate")
+def validate(events, *, user, now):
+    return _update(events, {"validated": True}, now)
+
+
+@operation("archive")
+def archive(events, *, user, now):
+    return _update(events, {"archived": True}, now)
+
+
+@operation("add_organizer")
+def add_organizer(events, *, user, now, organizer_id):
+    ids = set(events.values_list("pk", flat=True))
+    skipped = dict.fromkeys(EventOrganizer.objects.filter(event_id__in=ids, user_id=organizer_id)
+                            .values_list("event_id", flat=True), "already organised by them")
+    EventOrganizer.objects.bulk_create([EventOrganizer(event_id=pk, user_id=organizer_id)
+                                        for pk in sorted(ids - set(skipped))], ignore_conflicts=True)
+    return len(ids) - len(skipped), skipped
+
+
+@operation("transition")
+def transition(objects, *, user, now, event):
+    result = machine_for(objects.model).bulk(objects, event, user=user)
+    return len(result.changed), result.skipped
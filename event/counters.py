@@ -0,0 +1,201 @@
+"""
+Per-event counts of requests and reimbursements by state.
+
+``StateCount`` holds one row per (event, model, state). Every save, delete and
+``bulk_update`` of a ``Request`` or ``Reimbursement`` (the state machine uses the
+latter) adjusts the rows it moves between, in the same transaction and with ``F()``
+increments, so dashboards read counts instead of grouping over all requests. Writes
+that bypass the signals (``QuerySet.update``, ``bulk_create``, raw SQL) leave them
+off; ``manage.py rebuild_state_counts`` recounts.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from . import tracking
+from .models import Event, Reimbursement, Request, StateCount
+
+# model -> (name in StateCount.model, attname of the field leading to the event)
+MODELS = {Request: ("request", "event_id"), Reimbursement: ("reimbursement", "request_id")}
+# states waiting for an organiser, per model
+PENDING = {"request": ("submitted",), "reimbursement": ("submitted", "approved")}
+
+_BEFORE = "_counted_as"
+
+
+def _event_ids(model, owners):
+    """Maps the owner ids of ``model`` instances (event or request ids) to event ids."""
+    if model is not Reimbursement:
+        return {owner: owner for owner in owners}
+    owners = {owner for owner in owners if owner is not None}
+    return dict(Request.objects.filter(pk__in=owners).values_list("pk", "event_id")) if owners else {}
+
+
+def _count(model, moves):
+    """``moves`` are ``(before, after)`` pairs of ``(owner id, state)`` or ``None``."""
+    name, _ = MODELS[model]
+    moves = [(before, after) for before, after in moves if before != after]
+    if not moves:
+        return
+    events = _event_ids(model, {key[0] for pair in moves for key in pair if key})
+    deltas = Counter()
+    for before, after in moves:
+        for key, delta in ((before, -1), (after, 1)):
+            if key is not None and events.get(key[0]) is not None:
+                deltas[(events[key[0]], key[1] or "")] += delta
+    apply(name, deltas)
+
+
+def apply(name, deltas):
+    for (event_id, state), delta in deltas.items():
+        if not delta:
+            continue
+        rows = StateCount.objects.filter(event_id=event_id, model=name, state=state)
+        if rows.update(count=F("count") + delta) or delta < 0:
+            continue  # a missing row is never created with a negative count; a rebuild fixes that
+        try:
+            with transaction.atomic():
+                StateCount.objects.create(event_id=event_id, model=name, state=state, count=delta)
+        except IntegrityError:  # created concurrently
+            rows.update(count=F("count") + delta)
+
+
+def _key(values, owner):
+    return values.get(owner), values.get("state")
+
+
+def _before_save(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        instance.__dict__[_BEFORE] = None
+    else:
+        instance.__dict__[_BEFORE] = _key(tracking.saved_values(instance), MODELS[sender][1])
+
+
+def _saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    owner = MODELS[sender][1]
+    before = instance.__dict__.pop(_BEFORE, None)
+    after = _key(instance.__dict__, owner)
+    if update_fields is not None and before is not None:
+        # fields that were not written keep their stored value
+        owner_written = owner in update_fields or owner.removesuffix("_id") in update_fields
+        after = (after[0] if owner_written else before[0], after[1] if "state" in update_fields else before[1])
+    _count(sender, [(before, after)])
+    if sender is Request and before is not None and before[0] != after[0]:
+        _move_reimbursements(instance.pk, before[0], after[0])
+
+
+def _move_reimbursements(request_id, old_event_id, new_event_id):
+    """A request moved to another event takes the counts of its reimbursements along."""
+    deltas = Counter()
+    for state, n in (Reimbursement.objects.filter(request_id=request_id).values_list("state")
+                     .annotate(n=Count("pk")).order_by()):
+        deltas[(old_event_id, state or "")] -= n
+        deltas[(new_event_id, state or "")] += n
+    apply("reimbursement", deltas)
+
+
+def _deleted(sender, instance, **kwargs):
+    values = tracking.saved_values(instance) or instance.__dict__
+    _count(sender, [(_key(values, MODELS[sender][1]), None)])
+
+
+def _bulk_updated(sender, changes, **kwargs):
+    owner = MODELS[sender][1]
+    owner_name = owner.removesuffix("_id")
+    moves = []
+    for instance, diff in changes.items():
+        if "state" not in diff and owner_name not in diff:
+            continue
+        now = _key(instance.__dict__, owner)
+        before = (diff[owner_name][0] if owner_name in diff else now[0],
+                  diff["state"][0] if "state" in diff else now[1])
+        moves.append((before, now))
+    _count(sender, moves)
+
+
+def register():
+    for model in MODELS:
+        uid = f"state-count-{model._meta.label}"
+        pre_save.connect(_before_save, sender=model, weak=False, dispatch_uid=uid)
+        post_save.connect(_saved, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(_deleted, sender=model, weak=False, dispatch_uid=uid)
+        tracking.post_bulk_update.connect(_bulk_updated, sender=model, weak=False, dispatch_uid=uid)
+
+
+# ---------- Reading ----------
+
+def counts(event):
+    """``{"request": {state: n}, "reimbursement": {state: n}}`` of one event."""
+    result = {name: {} for name, _ in MODELS.values()}
+    for model, state, count in StateCount.objects.filter(event=event, count__gt=0).values_list(
+            "model", "state", "count"):
+        result.setdefault(model, {})[state] = count
+    return result
+
+
+def pending_work(user=None, limit=20):
+    """
+    Events with requests or reimbursements waiting for an organiser, most pending
+    first: dicts with ``event``, ``requests`` and ``reimbursements``. Staff see every
+    event, other users the events they organise.
+    """
+    waiting = Q()
+    for model, states in PENDING.items():
+        waiting |= Q(model=model, state__in=states)
+    rows = StateCount.objects.filter(waiting, count__gt=0)
+    if user is not None and not user.is_staff:
+        rows = rows.filter(event__event_organizers__user=user)
+    totals = {}
+    for event_id, model, count in rows.values_list("event_id", "model", "count"):
+        entry = totals.setdefault(event_id, {"requests": 0, "reimbursements": 0})
+        entry[f"{model}s"] += count
+    top = sorted(totals.items(), key=lambda item: -(item[1]["requests"] + item[1]["reimbursements"]))[:limit]
+    events = Event.objects.in_bulk([event_id for event_id, _ in top])
+    return [{"event": events[event_id], **entry} for event_id, entry in top if event_id in events]
+
+
+# ---------- Rebuilding ----------
+
+def actual_counts(event_ids=None):
+    """``{(event id, model name, state): n}`` counted from the requests and reimbursements themselves."""
+    result = {}
+    sources = ((Request.objects, "event_id", "request"),
+               (Reimbursement.objects, "request__event_id", "reimbursement"))
+    for manager, event_field, name in sources:
+        rows = manager.all() if event_ids is None else manager.filter(**{f"{event_field}__in": event_ids})
+        for event_id, state, count in rows.values_list(event_field, "state").annotate(n=Count("pk")).order_by():
+            key = (event_id, name, state or "")
+            result[key] = result.get(key, 0) + count
+    return result
+
+
+def rebuild(event_ids=None, dry_run=False):
+    """Recount and fix the counters of ``event_ids`` (or all events); returns ``{key: (stored, actual)}`` of drift."""
+    drift = {}
+    with transaction.atomic():
+        stored_rows = StateCount.objects.select_for_update()
+        if event_ids is not None:
+            stored_rows = stored_rows.filter(event_id__in=event_ids)
+        stored = {(row.event_id, row.model, row.state): row for row in stored_rows}
+        actual = actual_counts(event_ids)
+        for key in stored.keys() | actual.keys():
+            have = stored[key].count if key in stored else 0
+            if have != actual.get(key, 0):
+                drift[key] = (have, actual.get(key, 0))
+        if dry_run or not drift:
+            return drift
+        update = []
+        for key, (_, count) in drift.items():
+            if key in stored:
+                stored[key].count = count
+                update.append(stored[key])
+        StateCount.objects.bulk_update(update, ["count"])
+        StateCount.objects.bulk_create([
+            StateCount(event_id=key[0], model=key[1], state=key[2], count=count)
+            for key, (_, count) in drift.items() if key not in stored
+        ])
+    return drift
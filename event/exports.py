@@ -0,0 +1,272 @@
+"""
+Streaming CSV and XLSX exports of requests, expenses, reimbursements and payments.
+
+Every exported model has an ``Export``: its columns as ``values_list`` lookups, so
+the event, user and budget of a row are joined into the same query and no model
+instances are built. Rows are read with ``iterator(chunk_size=CHUNK_SIZE)`` (a
+server-side cursor on PostgreSQL) and written out in pieces of about
+``FLUSH_BYTES``, so memory stays flat however many rows there are::
+
+    StreamingHttpResponse(exports.stream(queryset, "csv"), content_type=exports.CONTENT_TYPES["csv"])
+
+XLSX is written by hand: a zip on a non-seekable stream (data descriptors, no
+seeking back) holding one sheet of inline strings, because nothing here needs
+styles and a spreadsheet library would keep the whole sheet in memory.
+
+Exports too big for a request are written by the ``export_rows`` job instead, into
+the user's own directory below ``EXPORT_ROOT`` (outside ``MEDIA_ROOT``), and the user is
+mailed a link to ``views.download_export``, which only hands them their own files.
+"""
+import csv
+import datetime
+import io
+import os
+import re
+import secrets
+import zipfile
+from dataclasses import dataclass
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Payment, Reimbursement, Request, RequestExpense
+
+CHUNK_SIZE = 2000
+FLUSH_BYTES = 64 * 1024
+_NAME = re.compile(r"^[\w-]+\.(csv|xlsx)$")
+XLSX_MAX_ROWS = 1048576  # including the header; the rest does not fit in a sheet
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+@dataclass(frozen=True)
+class Export:
+    name: str
+    # (header, lookup) pairs
+    columns: tuple
+
+    @property
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+    @property
+    def lookups(self):
+        return [lookup for _, lookup in self.columns]
+
+
+EXPORTS = {
+    Request: Export("requests", (
+        ("id", "pk"), ("state", "state"), ("type", "type"),
+        ("event", "event__name"), ("event id", "event_id"), ("budget", "event__budget__name"),
+        ("user", "user__username"), ("email", "user__email"),
+        ("visa letter", "visa_letter"), ("created at", "created_at"), ("updated at", "updated_at"),
+    )),
+    RequestExpense: Export("expenses", (
+        ("id", "pk"), ("request id", "request_id"), ("request state", "request__state"),
+        ("event", "request__event__name"), ("budget", "request__event__budget__name"),
+        ("user", "request__user__username"), ("subject", "subject"),
+        ("estimated amount", "estimated_amount"), ("estimated currency", "estimated_currency"),
+        ("approved amount", "approved_amount"), ("approved currency", "approved_currency"),
+        ("total amount", "total_amount"), ("authorized amount", "authorized_amount"),
+    )),
+    Reimbursement: Export("reimbursements", (
+        ("id", "pk"), ("state", "state"), ("request id", "request_id"),
+        ("event", "request__event__name"), ("budget", "request__event__budget__name"),
+        ("user", "user__username"), ("email", "user__email"),
+        ("created at", "created_at"), ("state updated at", "state_updated_at"),
+    )),
+    Payment: Export("payments", (
+        ("id", "pk"), ("reimbursement id", "reimbursement_id"),
+        ("event", "reimbursement__request__event__name"), ("budget", "reimbursement__request__event__budget__name"),
+        ("user", "reimbursement__user__username"), ("date", "date"),
+        ("amount", "amount"), ("currency", "currency"), ("cost amount", "cost_amount"),
+        ("cost currency", "cost_currency"), ("method", "method"), ("code", "code"), ("status", "status"),
+    )),
+}
+
+
+def rows(queryset, chunk_size=CHUNK_SIZE):
+    """Value tuples of the export columns of ``queryset``, in id order."""
+    export = EXPORTS[queryset.model]
+    return queryset.values_list(*export.lookups).order_by("pk").iterator(chunk_size=chunk_size)
+
+
+def selection_rows(selection, chunk_size=CHUNK_SIZE):
+    """``rows`` of a ``jobs.Selection``, one query per ``chunk_size`` primary keys."""
+    export = EXPORTS[selection.model]
+    for queryset in selection.querysets(chunk_size):
+        yield from queryset.values_list(*export.lookups).order_by("pk")
+
+
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).replace(tzinfo=None, microsecond=0).isoformat(" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+# ---------- CSV ----------
+
+# a cell starting with one of these is taken for a formula by spreadsheets
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value):
+    value = _value(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(export, values):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export.headers)
+    for row in values:
+        writer.writerow([_csv_cell(value) for value in row])
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+# ---------- XLSX ----------
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_PACKAGE_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_DOCUMENT_RELS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        f'<Relationships xmlns="{_PACKAGE_RELS}">'
+        f'<Relationship Id="rId1" Type="{_DOCUMENT_RELS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        f'<workbook xmlns="{_MAIN}" xmlns:r="{_DOCUMENT_RELS}">'
+        '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        f'<Relationships xmlns="{_PACKAGE_RELS}">'
+        f'<Relationship Id="rId1" Type="{_DOCUMENT_RELS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+_ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _Pipe:
+    """Where the zip is written to; whatever was written is taken out and streamed."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        return data
+
+
+def _xlsx_cell(value):
+    value = _value(value)
+    if value is None:
+        return "<c/>"
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)) or hasattr(value, "as_tuple"):  # Decimal
+        return f"<c><v>{value}</v></c>"
+    text = escape(_ILLEGAL_XML.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return ("<row>" + "".join(_xlsx_cell(value) for value in values) + "</row>").encode()
+
+
+def xlsx_chunks(export, values):
+    """One sheet with a header row; rows past ``XLSX_MAX_ROWS`` are left out."""
+    pipe = _Pipe()
+    # not seekable, so ZipFile writes sizes after each member instead of going back for them
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_DEFLATED) as package:
+        for name, xml in _XLSX_PARTS.items():
+            package.writestr(name, _XML + xml.replace("{name}", export.name))
+        with package.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(f'{_XML}<worksheet xmlns="{_MAIN}"><sheetData>'.encode())
+            sheet.write(_xlsx_row(export.headers))
+            for n, row in enumerate(values, 2):
+                if n > XLSX_MAX_ROWS:
+                    break
+                sheet.write(_xlsx_row(row))
+                if pipe.size >= FLUSH_BYTES:
+                    yield pipe.take()
+            sheet.write(b"</sheetData></worksheet>")
+    yield pipe.take()
+
+
+FORMATS = {"csv": csv_chunks, "xlsx": xlsx_chunks}
+
+
+def stream(queryset, fmt, chunk_size=CHUNK_SIZE):
+    """The export of ``queryset`` as an iterator of bytes, for a ``StreamingHttpResponse``."""
+    return FORMATS[fmt](EXPORTS[queryset.model], rows(queryset, chunk_size))
+
+
+def filename(model, fmt):
+    return f"{EXPORTS[model].name}-{timezone.localdate():%Y-%m-%d}.{fmt}"
+
+
+# ---------- Exports in the background ----------
+
+def _directory(user_id):
+    return os.path.join(settings.EXPORT_ROOT, str(int(user_id)))
+
+
+def path(user_id, name):
+    """Where export ``name`` of user ``user_id`` is, or ``None`` if they have no such export."""
+    if not _NAME.match(name):
+        return None
+    found = os.path.join(_directory(user_id), name)
+    return found if os.path.isfile(found) else None
+
+
+def save(selection, fmt, user_id, chunk_size=CHUNK_SIZE):
+    """
+    Write the export of ``selection`` (a ``jobs.Selection``) into the directory of user
+    ``user_id`` below ``EXPORT_ROOT`` and return its name there, for ``path``.
+    """
+    name = f"{filename(selection.model, fmt).rsplit('.', 1)[0]}-{secrets.token_urlsafe(8)}.{fmt}"
+    directory = _directory(user_id)
+    os.makedirs(directory, exist_ok=True)
+    partial = os.path.join(directory, name + ".partial")
+    with open(partial, "wb") as out:
+        for chunk in FORMATS[fmt](EXPORTS[selection.model], selection_rows(selection, chunk_size)):
+            out.write(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(partial, os.path.join(directory, name))
+    return name
@@ -0,0 +1,467 @@
+"""
+Background jobs on top of ``DelayedJob``.
+
+Functions decorated with ``@task`` are enqueued as ``DelayedJob`` rows whose
+``handler`` is a small JSON document (task name, args, kwargs) and are run by
+``manage.py jobworker``::
+
+    @task(queue="payouts")
+    def payout_event(event_id):
+        ...
+
+    payout_event.delay(event.pk)
+
+Workers claim jobs in batches, ordered by ``priority`` (lowest first) and ``run_at``.
+On PostgreSQL the claim is a ``SELECT ... FOR UPDATE SKIP LOCKED``, so concurrent
+workers never wait on each other; elsewhere (SQLite) candidates are claimed with one
+conditional ``UPDATE`` that only takes rows which are still unlocked. A failed job is
+retried after ``attempts ** 4 + 5`` seconds until ``max_attempts``; a job locked for
+longer than ``max_run_time`` belongs to a dead worker and is claimed again.
+
+A task with ``every`` is periodic: workers enqueue it when no job of it is waiting,
+and each run enqueues the next one ``every`` later::
+
+    @task(every=timedelta(hours=1))
+    def refresh_rates():
+        ...
+
+A long job can call ``report_progress("1500 / 12000")``; it is stored on its
+``DelayedJob`` row, where the admin shows it whichever process runs the job.
+
+A job enqueued while a request (or another job) is traced keeps its request id and
+runs under it, see ``event.tracing``.
+"""
+import contextvars
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from datetime import timedelta
+
+import django
+from django.apps import apps
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics, tracing
+from .models import DelayedJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE = "default"
+DEFAULT_MAX_ATTEMPTS = 25
+DEFAULT_MAX_RUN_TIME = timedelta(hours=4)
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_SLEEP = 5.0
+PERIODIC_CHECK_SECONDS = 60.0
+
+_registry = {}
+# (job id, worker name) of the job running in this thread
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class UnknownTask(Exception):
+    pass
+
+
+@dataclass
+class Task:
+    func: object
+    name: str
+    queue: str = DEFAULT_QUEUE
+    priority: int = 0
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    # run again this long after each run, see schedule_periodic
+    every: timedelta = None
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """Enqueue a call with the task's default queue and priority."""
+        return enqueue(self.name, *args, **kwargs)
+
+    def schedule(self, *, run_at=None, priority=None, queue=None, args=(), kwargs=None):
+        return enqueue(self.name, *args, _run_at=run_at, _priority=priority, _queue=queue, **(kwargs or {}))
+
+
+def task(func=None, *, name=None, queue=DEFAULT_QUEUE, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS, every=None):
+    """Register ``func`` as a job; arguments must be JSON serialisable."""
+    def register(func):
+        registered = Task(func, name or f"{func.__module__}.{func.__qualname__}", queue, priority, max_attempts,
+                          every)
+        _registry[registered.name] = registered
+        return registered
+    return register(func) if func is not None else register
+
+
+def autodiscover():
+    """Import the ``tasks`` module of every installed app, so their tasks are registered."""
+    for config in apps.get_app_configs():
+        try:
+            importlib.import_module(f"{config.name}.tasks")
+        except ModuleNotFoundError as e:
+            if e.name != f"{config.name}.tasks":
+                raise
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        autodiscover()
+    try:
+        return _registry[name]
+    except KeyError:
+        raise UnknownTask(name) from None
+
+
+def enqueue(name, *args, _run_at=None, _priority=None, _queue=None, **kwargs):
+    """Store a call of task ``name`` as a ``DelayedJob``; it commits with the surrounding transaction."""
+    registered = get_task(name)
+    now = timezone.now()
+    payload = {"task": name, "args": list(args), "kwargs": kwargs}
+    request_id = tracing.current_request_id()
+    if request_id:
+        payload["request_id"] = request_id
+    return DelayedJob.objects.create(
+        handler=json.dumps(payload),
+        queue=_queue or registered.queue,
+        priority=registered.priority if _priority is None else _priority,
+        run_at=_run_at or now,
+        created_at=now,
+        updated_at=now,
+    )
+
+
+class Selection:
+    """
+    Rows picked in the admin, as a job argument: the model label and the primary keys,
+    consecutive ones stored as ``[first, last]`` runs. It is plain JSON, so a job that
+    is edited in the admin can at most name other rows, never run code::
+
+        tasks.export_rows.delay(jobs.Selection.of(queryset).dump(), "csv", user.pk)
+        selection = jobs.Selection.load(dumped)
+        for pks in selection.chunks(500):
+            ...
+    """
+
+    def __init__(self, model, runs):
+        self.model = model
+        self.runs = runs
+
+    @classmethod
+    def of(cls, queryset):
+        runs = []
+        for pk in queryset.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=10000):
+            if runs and runs[-1][1] == pk - 1:
+                runs[-1][1] = pk
+            else:
+                runs.append([pk, pk])
+        return cls(queryset.model, runs)
+
+    def dump(self):
+        return [self.model._meta.label, self.runs]
+
+    @classmethod
+    def load(cls, dumped):
+        label, runs = dumped
+        if not all(isinstance(run, list) and len(run) == 2 and all(type(pk) is int for pk in run) for run in runs):
+            raise ValueError(f"not a selection of primary keys: {runs!r:.100}")
+        return cls(apps.get_model(label), runs)
+
+    def __len__(self):
+        return sum(last - first + 1 for first, last in self.runs)
+
+    def chunks(self, size):
+        """Lists of at most ``size`` primary keys, in order; keys of rows deleted since are included."""
+        chunk = []
+        for first, last in self.runs:
+            while first <= last:
+                taken = min(size - len(chunk), last - first + 1)
+                chunk.extend(range(first, first + taken))
+                first += taken
+                if len(chunk) == size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def querysets(self, size):
+        manager = self.model._default_manager
+        for chunk in self.chunks(size):
+            yield manager.filter(pk__in=chunk)
+
+
+def report_progress(text):
+    """Show ``text`` as the progress of the running job; does nothing outside a job."""
+    current = _current_job.get()
+    if current is not None:
+        job_id, worker_name = current
+        DelayedJob.objects.filter(pk=job_id, locked_by=worker_name).update(progress=text[:255])
+
+
+def waiting(name):
+    """Jobs of task ``name`` that are still to run (or running)."""
+    # enqueue writes the handler with json.dumps' default separators
+    return DelayedJob.objects.filter(failed_at__isnull=True, handler__contains=json.dumps({"task": name})[1:-1])
+
+
+def schedule_periodic(queues=None):
+    """Enqueue every periodic task (of ``queues``) that has no job waiting; returns their names."""
+    autodiscover()
+    enqueued = []
+    for registered in list(_registry.values()):
+        if registered.every is None or (queues is not None and registered.queue not in queues):
+            continue
+        if not waiting(registered.name).exists():
+            registered.delay()
+            enqueued.append(registered.name)
+    return enqueued
+
+
+def _schedule_next(registered):
+    # a second job enqueued by two workers starting at once is not carried on
+    if registered is not None and registered.every is not None and not waiting(registered.name).exists():
+        registered.schedule(run_at=timezone.now() + registered.every)
+
+
+# ---------- Claiming ----------
+
+def _ready(queues, now, max_run_time):
+    jobs = DelayedJob.objects.filter(failed_at__isnull=True).filter(Q(run_at__isnull=True) | Q(run_at__lte=now))
+    # a lock older than max_run_time was left by a worker that died
+    jobs = jobs.filter(Q(locked_at__isnull=True) | Q(locked_at__lt=now - max_run_time))
+    if queues:
+        jobs = jobs.filter(queue__in=queues) if DEFAULT_QUEUE not in queues else \
+            jobs.filter(Q(queue__in=queues) | Q(queue__isnull=True))
+    return jobs.order_by("priority", "run_at", "pk")
+
+
+def claim(worker_name, queues=None, limit=DEFAULT_BATCH_SIZE, max_run_time=DEFAULT_MAX_RUN_TIME):
+    """Lock up to ``limit`` runnable jobs for ``worker_name`` and return them."""
+    now = timezone.now()
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(_ready(queues, now, max_run_time).select_for_update(skip_locked=True)
+                       .values_list("pk", flat=True)[:limit])
+            DelayedJob.objects.filter(pk__in=ids).update(locked_at=now, locked_by=worker_name, updated_at=now)
+    else:
+        candidates = list(_ready(queues, now, max_run_time).values_list("pk", flat=True)[:limit])
+        # the WHERE clause is re-evaluated by the UPDATE itself, so a job another worker
+        # took in the meantime is skipped instead of being claimed twice
+        DelayedJob.objects.filter(pk__in=candidates).filter(
+            Q(locked_at__isnull=True) | Q(locked_at__lt=now - max_run_time)
+        ).update(locked_at=now, locked_by=worker_name, updated_at=now)
+        ids = candidates
+    return list(DelayedJob.objects.filter(pk__in=ids, locked_by=worker_name, locked_at=now)
+                .order_by("priority", "run_at", "pk"))
+
+
+def backoff(attempts):
+    return timedelta(seconds=attempts ** 4 + 5)
+
+
+def _payload(handler):
+    try:
+        payload = json.loads(handler)
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def perform(job_id, worker_name):
+    """
+    Run one claimed job; it is deleted on success and rescheduled (or failed) otherwise.
+    Returns ``(outcome, seconds)``, outcome being ``"succeeded"``, ``"failed"`` or
+    ``"lost"`` when another worker took over the job.
+    """
+    close_old_connections()
+    started = time.monotonic()
+    try:
+        job = DelayedJob.objects.filter(pk=job_id, locked_by=worker_name).first()
+        if job is None:
+            return "lost", 0.0  # our lock went stale and another worker took the job
+        registered = None
+        payload = _payload(job.handler)
+        with tracing.trace(payload.get("request_id"), f"job {payload.get('task', job.pk)}") as trace:
+            running = _current_job.set((job.pk, worker_name))
+            try:
+                registered = get_task(payload["task"])
+                registered(*payload.get("args", []), **payload.get("kwargs", {}))
+            except Exception as e:
+                logger.exception("job %s failed", job.pk)
+                attempts = job.attempts + 1
+                now = timezone.now()
+                # an unknown task may only be missing from this worker's code, so it is retried as well
+                gave_up = attempts >= (registered.max_attempts if registered else DEFAULT_MAX_ATTEMPTS)
+                DelayedJob.objects.filter(pk=job.pk, locked_by=worker_name).update(
+                    attempts=attempts, last_error=f"{e}\n{traceback.format_exc()}"[:65535],
+                    run_at=now if gave_up else now + backoff(attempts), failed_at=now if gave_up else None,
+                    locked_at=None, locked_by=None, updated_at=now,
+                )
+                tracing.maybe_log(trace, job=job.pk, attempt=attempts, outcome="failed")
+                finished, outcome = gave_up, "failed"
+            else:
+                DelayedJob.objects.filter(pk=job.pk, locked_by=worker_name).delete()
+                tracing.maybe_log(trace, job=job.pk, attempt=job.attempts + 1, outcome="succeeded")
+                finished, outcome = True, "succeeded"
+            finally:
+                _current_job.reset(running)
+        # outside the trace, so the next run of a periodic task does not take this run's request id
+        if finished:
+            _schedule_next(registered)
+        return outcome, time.monotonic() - started
+    finally:
+        close_old_connections()
+
+
+def _init_process():
+    django.setup()
+    # connections inherited through fork belong to the parent: drop them without closing
+    for conn in connections.all(initialized_only=True):
+        conn.connection = None
+
+
+# ---------- Worker ----------
+
+@dataclass
+class QueueSpec:
+    name: str
+    size: int = 1
+    kind: str = "thread"
+
+    @classmethod
+    def parse(cls, spec):
+        """``"payouts"``, ``"payouts:4"`` or ``"pdf:2:process"``."""
+        name, _, rest = spec.partition(":")
+        size, _, kind = rest.partition(":")
+        if kind not in ("", "thread", "process"):
+            raise ValueError(f"unknown pool kind {kind!r} in {spec!r}")
+        return cls(name, int(size or 1), kind or "thread")
+
+
+class Worker:
+    """
+    Claims jobs for a set of queues and runs each queue on its own thread or process pool.
+
+    Metrics are recorded here in the worker's main thread, also for jobs that ran in a
+    process pool, and rolled up into ``JobStat`` (see ``event.metrics``).
+    """
+
+    def __init__(self, queues=None, *, name=None, batch_size=DEFAULT_BATCH_SIZE, sleep=DEFAULT_SLEEP,
+                 max_run_time=DEFAULT_MAX_RUN_TIME, stats=None):
+        self.queues = queues or [QueueSpec(DEFAULT_QUEUE, 4)]
+        self.name = name or f"{socket.gethostname()} pid:{os.getpid()}"
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.max_run_time = max_run_time
+        self.stopping = threading.Event()
+        self.stats = metrics.StatRollup() if stats is None else stats
+        self._pools = {}
+        self._running = {}  # future -> (queue name, priority)
+        self._periodic_at = None  # monotonic time of the next schedule_periodic
+
+    def _pool(self, spec):
+        pool = self._pools.get(spec.name)
+        if pool is None:
+            if spec.kind == "process":
+                pool = ProcessPoolExecutor(spec.size, mp_context=multiprocessing.get_context("fork")
+                                           if "fork" in multiprocessing.get_all_start_methods() else None,
+                                           initializer=_init_process)
+            else:
+                pool = ThreadPoolExecutor(spec.size, thread_name_prefix=f"job-{spec.name}")
+            self._pools[spec.name] = pool
+        return pool
+
+    def install_signal_handlers(self):
+        def stop(signum, frame):
+            logger.info("worker %s: %s, finishing running jobs", self.name, signal.Signals(signum).name)
+            self.stopping.set()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+    def _busy(self, queue):
+        return sum(1 for q, _ in self._running.values() if q == queue)
+
+    def work_off(self):
+        """Claim and start as many jobs as the pools have free slots for; returns the number started."""
+        started = 0
+        for spec in self.queues:
+            free = spec.size - self._busy(spec.name)
+            if free <= 0 or self.stopping.is_set():
+                continue
+            now = timezone.now()
+            for job in claim(self.name, [spec.name], min(free, self.batch_size), self.max_run_time):
+                wait_seconds = max(0.0, (now - job.run_at).total_seconds()) if job.run_at else 0.0
+                metrics.JOBS_CLAIMED.inc(queue=spec.name, priority=job.priority)
+                metrics.CLAIM_LATENCY.observe(wait_seconds, queue=spec.name)
+                self.stats.add(spec.name, job.priority, claimed=1, claim_wait_seconds=wait_seconds)
+                future = self._pool(spec).submit(perform, job.pk, self.name)
+                self._running[future] = (spec.name, job.priority)
+                started += 1
+        return started
+
+    def _record(self, queue, priority, outcome, seconds):
+        metrics.JOBS_DONE.inc(queue=queue, priority=priority, outcome=outcome)
+        if outcome == "lost":
+            return
+        metrics.RUN_TIME.observe(seconds, queue=queue)
+        self.stats.add(queue, priority, run_seconds=seconds, **{outcome: 1})
+
+    def _reap(self, timeout):
+        if not self._running:
+            self.stopping.wait(timeout)
+            return
+        done, _ = wait(list(self._running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            queue, priority = self._running.pop(future)
+            if future.exception() is not None:
+                logger.error("job runner crashed", exc_info=future.exception())
+                self._record(queue, priority, "failed", 0.0)
+            else:
+                self._record(queue, priority, *future.result())
+        self.stats.maybe_flush()
+
+    def schedule_periodic(self):
+        """Make sure the periodic tasks of this worker's queues are enqueued, about once a minute."""
+        if self._periodic_at is not None and time.monotonic() < self._periodic_at:
+            return
+        self._periodic_at = time.monotonic() + PERIODIC_CHECK_SECONDS
+        try:
+            for name in schedule_periodic([spec.name for spec in self.queues]):
+                logger.info("worker %s: enqueued periodic task %s", self.name, name)
+        except Exception:
+            logger.exception("worker %s: scheduling periodic tasks failed", self.name)
+
+    def run(self, once=False):
+        logger.info("worker %s started on %s", self.name, ", ".join(q.name for q in self.queues))
+        try:
+            while not self.stopping.is_set():
+                if not once:
+                    self.schedule_periodic()
+                started = self.work_off()
+                if once:
+                    if not started and not self._running:
+                        break
+                    self._reap(None)
+                    continue
+                self._reap(0.1 if started else self.sleep)
+        finally:
+            for pool in self._pools.values():
+                pool.shutdown(wait=True)
+            for future, (queue, priority) in self._running.items():
+                if future.exception() is None:
+                    self._record(queue, priority, *future.result())
+            self._running.clear()
+            self.stats.flush()
+            logger.info("worker %s stopped", self.name)
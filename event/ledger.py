@@ -0,0 +1,204 @@
+"""
+Local reconciliation ledger of Wise activities and balances.
+
+``sync_activities`` pages through the activities of a profile with Wise's cursor,
+stores each page as compact ``LedgerEntry`` rows and matches the transfers on it
+against ``Payment`` rows in the same pass: one indexed query per page looks up the
+payments by transfer id (``Payment.code``), so tens of thousands of activities are
+reconciled in linear time and constant memory. The cursor is saved with every page,
+so an interrupted sync resumes where it stopped; a finished pass moves the ``since``
+bound forward so the next one only reads what is new.
+
+Entries are flagged ``amount_mismatch``, ``currency_mismatch`` or ``unknown_transfer``
+(money that left with no payment on our side); ``missing_payments`` lists the other
+direction, payments that Wise never reported.
+"""
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import LedgerCursor, LedgerEntry, Payment, WiseBalance
+from .payouts import PAYMENT_METHOD
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100  # the most Wise returns per page
+# a finished pass starts the next one this much earlier, so activities whose status
+# changed shortly after they were read are read again
+OVERLAP = timedelta(days=1)
+
+MATCHED = "matched"
+AMOUNT_MISMATCH = "amount_mismatch"
+CURRENCY_MISMATCH = "currency_mismatch"
+UNKNOWN_TRANSFER = "unknown_transfer"
+MISMATCHES = (AMOUNT_MISMATCH, CURRENCY_MISMATCH, UNKNOWN_TRANSFER)
+
+_TAG = re.compile(r"<[^>]+>")
+_AMOUNT = re.compile(r"([\d,]+(?:\.\d+)?)\s*([A-Z]{3})")
+
+
+@dataclass
+class SyncReport:
+    pages: int = 0
+    entries: int = 0
+    matches: Counter = field(default_factory=Counter)
+    finished: bool = False
+
+    @property
+    def mismatched(self):
+        return sum(self.matches[m] for m in MISMATCHES)
+
+
+def parse_amount(text):
+    """``(Decimal("1234.50"), "EUR")`` for Wise display amounts like ``"<positive>+ 1,234.50 EUR</positive>"``."""
+    match = _AMOUNT.search(_TAG.sub("", text or ""))
+    if match is None:
+        return None, None
+    try:
+        return Decimal(match.group(1).replace(",", "")), match.group(2)
+    except InvalidOperation:
+        return None, match.group(2)
+
+
+def _datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def compare(entry, payment):
+    """How a transfer ``entry`` relates to the ``(id, amount, currency, cost_amount, cost_currency)`` of its payment."""
+    if payment is None:
+        return UNKNOWN_TRANSFER
+    _, amount, currency, cost_amount, cost_currency = payment
+    # Wise shows the target amount of a transfer; the source side is kept as the payment's cost
+    if (entry.amount, entry.currency) in ((amount, currency), (cost_amount, cost_currency)):
+        return MATCHED
+    if entry.currency in (currency, cost_currency):
+        return AMOUNT_MISMATCH
+    return CURRENCY_MISMATCH
+
+
+def entry_from(profile_id, activity, now):
+    amount, currency = parse_amount(activity.get("primaryAmount"))
+    resource = activity.get("resource") or {}
+    return LedgerEntry(
+        profile_id=profile_id,
+        activity_id=str(activity["id"]),
+        activity_type=activity.get("type"),
+        resource_type=resource.get("type"),
+        resource_id=str(resource["id"]) if resource.get("id") is not None else None,
+        status=activity.get("status"),
+        amount=amount,
+        currency=currency,
+        title=_TAG.sub("", activity.get("title") or "")[:255] or None,
+        occurred_at=_datetime(activity.get("createdOn")),
+        created_at=now,
+        updated_at=now,
+    )
+
+
+def match_entries(entries):
+    """Link the transfer entries of one page to their payments, with a single query."""
+    transfers = [e for e in entries if e.resource_type == "TRANSFER" and e.resource_id]
+    payments = {
+        row[0]: row[1:]
+        for row in Payment.objects.filter(method=PAYMENT_METHOD, code__in={e.resource_id for e in transfers})
+        .values_list("code", "id", "amount", "currency", "cost_amount", "cost_currency")
+    }
+    for entry in transfers:
+        payment = payments.get(entry.resource_id)
+        entry.payment_id = payment[0] if payment else None
+        entry.match = compare(entry, payment)
+    return entries
+
+
+def store_page(profile_id, activities, cursor_row, next_cursor):
+    """Write one page of entries and the cursor after it atomically; returns the stored entries."""
+    now = timezone.now()
+    latest = {}
+    for activity in activities:
+        latest[str(activity["id"])] = entry_from(profile_id, activity, now)
+    entries = match_entries(list(latest.values()))
+    with transaction.atomic():
+        LedgerEntry.objects.bulk_create(
+            entries, update_conflicts=True, unique_fields=["profile_id", "activity_id"],
+            update_fields=["status", "amount", "currency", "title", "payment", "match", "updated_at"],
+        )
+        cursor_row.cursor = next_cursor
+        cursor_row.updated_at = now
+        cursor_row.save(update_fields=["cursor", "updated_at"])
+    return entries
+
+
+def sync_activities(client, profile_id, *, size=PAGE_SIZE, max_pages=None):
+    """
+    Read the activities of ``profile_id`` that are new since the last pass (resuming an
+    interrupted pass) with the blocking ``client``. Returns a ``SyncReport``.
+    """
+    cursor_row, _ = LedgerCursor.objects.get_or_create(profile_id=profile_id)
+    if not cursor_row.cursor:
+        cursor_row.pass_started_at = timezone.now()
+        cursor_row.save(update_fields=["pass_started_at"])
+    report = SyncReport()
+    while max_pages is None or report.pages < max_pages:
+        params = {"size": size, "until": cursor_row.pass_started_at.isoformat()}
+        if cursor_row.since:
+            params["since"] = cursor_row.since.isoformat()
+        if cursor_row.cursor:
+            params["nextCursor"] = cursor_row.cursor
+        page = client.get_activities(profile_id, **params)
+        activities = page.get("activities") or []
+        entries = store_page(profile_id, activities, cursor_row, page.get("cursor") or None)
+        report.pages += 1
+        report.entries += len(entries)
+        report.matches.update(e.match for e in entries if e.match)
+        if not cursor_row.cursor or not activities:
+            report.finished = True
+            break
+    if report.finished:
+        cursor_row.cursor = None
+        cursor_row.since = cursor_row.pass_started_at - OVERLAP
+        cursor_row.save(update_fields=["cursor", "since"])
+    logger.info("ledger sync of profile %s: %d pages, %d activities, %d mismatched%s", profile_id, report.pages,
+                report.entries, report.mismatched, "" if report.finished else " (pass not finished)")
+    return report
+
+
+def sync_balances(client, profile_id):
+    """Store the current balances of ``profile_id``; returns the number of balances."""
+    now = timezone.now()
+    rows = [
+        WiseBalance(
+            profile_id=profile_id, balance_id=balance["id"], currency=balance["currency"],
+            amount=Decimal(str((balance.get("amount") or {}).get("value", 0))),
+            reserved_amount=Decimal(str((balance.get("reservedAmount") or {}).get("value", 0))),
+            synced_at=now,
+        )
+        for balance in client.list_balances(profile_id)
+    ]
+    WiseBalance.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=["profile_id", "balance_id"],
+        update_fields=["currency", "amount", "reserved_amount", "synced_at"],
+    )
+    return len(rows)
+
+
+def missing_payments(before=None):
+    """Wise payments created before ``before`` that no ledger entry has been matched to."""
+    payments = Payment.objects.filter(method=PAYMENT_METHOD).exclude(code__isnull=True).filter(
+        ~Exists(LedgerEntry.objects.filter(payment=OuterRef("pk")))
+    )
+    if before is not None:
+        payments = payments.filter(created_at__lt=before)
+    return payments
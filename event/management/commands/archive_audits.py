@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from event import archive
+from event.models import Audit
+
+
+class Command(BaseCommand):
+    help = ("Archive old audits by month: keep the monthly partitions (PostgreSQL) or archive tables "
+            "in shape, export months past retention to AUDIT_ARCHIVE_ROOT and drop their tables.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--setup", action="store_true",
+                            help="PostgreSQL: convert the audit tables to monthly partitions (takes a table lock)")
+        parser.add_argument("--retention", type=int, help="months of audits to keep (AUDIT_RETENTION_MONTHS)")
+        parser.add_argument("--hot", type=int,
+                            help="months kept in the live table without partitioning (AUDIT_HOT_MONTHS)")
+        parser.add_argument("--no-export", action="store_true", help="drop expired months without writing a file")
+        parser.add_argument("--dry-run", action="store_true", help="only list the months that would expire")
+
+    def handle(self, *args, **options):
+        if options["setup"]:
+            if connections[router.db_for_write(Audit)].vendor != "postgresql":
+                raise CommandError("partitioning needs PostgreSQL; elsewhere old months go to archive tables")
+            for model in archive.TABLES:
+                if archive.is_partitioned(model):
+                    self.stdout.write(f"{model._meta.db_table} is already partitioned")
+                    continue
+                archive.partition(model)
+                self.stdout.write(f"{model._meta.db_table} partitioned by month")
+        summary = archive.run(options["retention"], options["hot"], export=not options["no_export"],
+                              dry_run=options["dry_run"])
+        for table in summary["created"]:
+            self.stdout.write(f"created {table}")
+        if summary["archived"]:
+            self.stdout.write(f"moved {summary['archived']} audits to archive tables")
+        for path in summary["files"]:
+            self.stdout.write(f"exported {path}")
+        expired = ", ".join(summary["expired"]) or "none"
+        self.stdout.write(self.style.SUCCESS(
+            f"expired months {'to drop' if options['dry_run'] else 'dropped'}: {expired}"
+        ))
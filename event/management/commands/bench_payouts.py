@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from event.payouts import DEFAULT_PARALLELISM, PayoutEngine, PayoutItem
+from event.wise.fake import FAKE_RATES, FEE, FakeWise
+from event.wise.rates import RateTable
+from event.wise.sca import OtpSigner
+
+CURRENCIES = ("EUR", "EUR", "EUR", "GBP", "USD")
+
+
+def make_items(count, shared_accounts=0.1):
+    """``count`` payouts; about ``shared_accounts`` of them go to a bank account already paid in the batch."""
+    distinct = max(1, int(count * (1 - shared_accounts)))
+    items = []
+    for n in range(count):
+        account = n % distinct
+        items.append(PayoutItem(
+            reimbursement_id=n + 1, amount=Decimal(50 + n % 400), currency=CURRENCIES[account % len(CURRENCIES)],
+            holder=f"Attendee {account}", recipient_type="iban",
+            details={"legalType": "PRIVATE", "iban": f"BE{account:014d}"}, reference=f"TSP bench {n + 1}",
+        ))
+    return items
+
+
+def balances_for(items, source_currency="EUR"):
+    """A source balance that funds every payout of ``items``, whatever their currency and fees."""
+    needed = sum(item.amount / FAKE_RATES[item.currency] + FEE for item in items)
+    return {source_currency: 2 * needed}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = "Benchmark the payout path against the fake Wise API: payouts/s, p50/p99 latency and memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,1000,10000", help="comma separated batch sizes")
+        parser.add_argument("--parallelism", type=int, default=DEFAULT_PARALLELISM)
+        parser.add_argument("--latency", type=float, default=0.0, help="fake server seconds per request")
+        parser.add_argument("--jitter", type=float, default=0.0)
+        parser.add_argument("--error-rate", type=float, default=0.0)
+        parser.add_argument("--throttle-rate", type=float, default=0.0)
+        parser.add_argument("--sca", action="store_true", help="require SCA approval (cleared by OTP) for funding")
+        parser.add_argument("--no-batch-group", action="store_true")
+        parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, which slows the run")
+        parser.add_argument("--json", help="write the results to this file")
+        parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="allowed slowdown against --baseline before the run fails")
+
+    def run(self, size, options):
+        items = make_items(size)
+        fake = FakeWise(latency=options["latency"], jitter=options["jitter"], error_rate=options["error_rate"],
+                        throttle_rate=options["throttle_rate"], sca=options["sca"], seed=size,
+                        balances=balances_for(items))
+
+        async def payout():
+            async with fake.async_client() as client:
+                engine = PayoutEngine(client, fake.profile_id, parallelism=options["parallelism"],
+                                      rates=RateTable(), signer=OtpSigner(),
+                                      batch_groups=not options["no_batch_group"])
+                return await engine.run(items)
+
+        if not options["no_memory"]:
+            tracemalloc.start()
+        started = time.perf_counter()
+        results = asyncio.run(payout())
+        wall = time.perf_counter() - started
+        peak = 0
+        if not options["no_memory"]:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        latencies = [r.elapsed for r in results]
+        return {
+            "size": size,
+            "payouts_per_second": round(size / wall, 1),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "peak_memory_mb": round(peak / 2 ** 20, 1),
+            "failed": sum(1 for r in results if not r.ok),
+            "unfunded": sum(1 for r in results if r.ok and not r.funded),
+            "requests": sum(fake.calls.values()),
+        }
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",") if size.strip()]
+        rows = []
+        self.stdout.write(f"{'size':>7} {'payouts/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>8} "
+                          f"{'failed':>7} {'unfunded':>9} {'requests':>9}")
+        for size in sizes:
+            row = self.run(size, options)
+            rows.append(row)
+            self.stdout.write(f"{row['size']:>7} {row['payouts_per_second']:>10} {row['p50_ms']:>9} "
+                              f"{row['p99_ms']:>9} {row['peak_memory_mb']:>8} {row['failed']:>7} "
+                              f"{row['unfunded']:>9} {row['requests']:>9}")
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(rows, f, indent=2)
+        if options["baseline"]:
+            self.compare(rows, options["baseline"], options["tolerance"])
+
+    def compare(self, rows, path, tolerance):
+        with open(path) as f:
+            baseline = {row["size"]: row for row in json.load(f)}
+        regressions = []
+        for row in rows:
+            before = baseline.get(row["size"])
+            if before is None:
+                continue
+            if row["payouts_per_second"] < before["payouts_per_second"] * (1 - tolerance):
+                regressions.append(f"{row['size']}: {before['payouts_per_second']} -> "
+                                   f"{row['payouts_per_second']} payouts/s")
+            if row["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+                regressions.append(f"{row['size']}: p99 {before['p99_ms']} -> {row['p99_ms']} ms")
+        if regressions:
+            raise CommandError("payout benchmark regressed: " + "; ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"no regression against {path}"))
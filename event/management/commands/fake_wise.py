@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from event.wise.fake import FAKE_TOKEN, FakeWise
+
+
+class Command(BaseCommand):
+    help = "Serve an in-memory fake of the Wise API for local payout runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+        parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per request")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+        parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+        parser.add_argument("--sca", action="store_true", help="require SCA approval for funding calls")
+        parser.add_argument("--profile", type=int, default=1, help="id of the fake profile")
+
+    def handle(self, *args, **options):
+        fake = FakeWise(latency=options["latency"], jitter=options["jitter"], error_rate=options["error_rate"],
+                        throttle_rate=options["throttle_rate"], sca=options["sca"], profile_id=options["profile"])
+        server = fake.serve(options["host"], options["port"])
+        self.stdout.write(self.style.SUCCESS(
+            f"fake Wise on http://{options['host']}:{server.server_port} "
+            f"(WISE_API_KEY={FAKE_TOKEN}, WISE_PROFILE_ID={options['profile']})"
+        ))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from event import metrics
+from event.jobs import DEFAULT_BATCH_SIZE, DEFAULT_SLEEP, QueueSpec, Worker, autodiscover
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the DelayedJob table until stopped with SIGTERM/SIGINT."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queues", default="default:4,payouts:1,mail:2",
+                            help="comma separated name[:size[:thread|process]] pool per queue")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                            help="most jobs claimed per queue at once")
+        parser.add_argument("--sleep", type=float, default=DEFAULT_SLEEP, help="seconds between polls when idle")
+        parser.add_argument("--max-run-time", type=float, default=4 * 3600,
+                            help="seconds after which a locked job is taken to belong to a dead worker")
+        parser.add_argument("--metrics-port", type=int, default=None,
+                            help="serve this worker's Prometheus metrics on this port")
+        parser.add_argument("--once", action="store_true", help="work off the runnable jobs and exit")
+
+    def handle(self, *args, **options):
+        try:
+            queues = [QueueSpec.parse(spec) for spec in options["queues"].split(",") if spec.strip()]
+        except ValueError as e:
+            raise CommandError(e)
+        autodiscover()
+        if options["metrics_port"]:
+            metrics.serve(options["metrics_port"])
+        worker = Worker(queues, batch_size=options["batch_size"], sleep=options["sleep"],
+                        max_run_time=timedelta(seconds=options["max_run_time"]))
+        worker.install_signal_handlers()
+        worker.run(once=options["once"])
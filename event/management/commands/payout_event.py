@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from event.models import Event
+from event.payouts import DEFAULT_PARALLELISM, settle_event
+
+
+class Command(BaseCommand):
+    help = "Pay out every approved reimbursement of an event through Wise."
+
+    def add_arguments(self, parser):
+        parser.add_argument("event_id", type=int)
+        parser.add_argument("--parallelism", type=int, default=DEFAULT_PARALLELISM,
+                            help="number of payout chains in flight at once")
+        parser.add_argument("--rate", type=float, default=None,
+                            help="max Wise requests per second for this run (defaults to WISE_RATE_LIMIT)")
+        parser.add_argument("--profile", type=int, default=None, help="Wise profile id to pay from")
+        parser.add_argument("--no-fund", action="store_true",
+                            help="create the transfers but leave funding to a manual Wise login")
+        parser.add_argument("--no-batch-group", action="store_true",
+                            help="fund transfers one by one instead of through a Wise batch group")
+
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.get(pk=options["event_id"])
+        except Event.DoesNotExist:
+            raise CommandError(f"Event {options['event_id']} does not exist")
+
+        report = settle_event(event, profile_id=options["profile"], parallelism=options["parallelism"],
+                              rate=options["rate"], fund=not options["no_fund"],
+                              batch_groups=False if options["no_batch_group"] else None)
+        for result in report.failed:
+            self.stderr.write(f"reimbursement {result.reimbursement_id}: {result.error}")
+        for result in report.unfunded:
+            if result.funding_error:
+                self.stderr.write(f"reimbursement {result.reimbursement_id} not funded: {result.funding_error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(report.succeeded)} paid ({len(report.unfunded)} awaiting funding), "
+            f"{len(report.failed)} failed, {len(report.payments)} payments written"
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from event.transfers import TransferPoller
+
+
+class Command(BaseCommand):
+    help = "Poll Wise for the status of in-flight payout transfers (a fallback for missed webhooks)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="check every in-flight transfer once and exit")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--min-interval", type=float, default=30.0)
+        parser.add_argument("--max-interval", type=float, default=1800.0)
+        parser.add_argument("--refresh", type=float, default=60.0,
+                            help="seconds between looks for newly created payments")
+
+    def handle(self, *args, **options):
+        poller = TransferPoller(batch_size=options["batch_size"], min_interval=options["min_interval"],
+                                max_interval=options["max_interval"])
+        try:
+            poller.refresh()
+            if options["once"]:
+                checked = 0
+                while poller.next_due_in() == 0:
+                    checked += poller.tick()
+                self.stdout.write(f"checked {checked} transfers")
+                return
+
+            refreshed = time.monotonic()
+            while True:
+                poller.tick()
+                if time.monotonic() - refreshed >= options["refresh"]:
+                    poller.refresh()
+                    refreshed = time.monotonic()
+                wait = poller.next_due_in()
+                time.sleep(min(options["refresh"], wait if wait is not None else options["refresh"]))
+        finally:
+            poller.close()
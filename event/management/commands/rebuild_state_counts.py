@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from event import counters
+
+
+class Command(BaseCommand):
+    help = "Recount requests and reimbursements per event and state and repair the StateCount rows that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--event", type=int, action="append", dest="events", help="only this event (repeatable)")
+        parser.add_argument("--dry-run", action="store_true", help="only report the drift")
+
+    def handle(self, *args, **options):
+        drift = counters.rebuild(options["events"], dry_run=options["dry_run"])
+        for (event_id, model, state), (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f"event {event_id} {model} {state or '-'}: {stored} -> {actual}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(drift)} counters {'drifted' if options['dry_run'] else 'repaired'}"
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from event import budgets
+
+
+class Command(BaseCommand):
+    help = "Recompute the budget totals from expenses and payments and repair the BudgetTotal rows that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="only report the drift")
+
+    def handle(self, *args, **options):
+        drift = budgets.reconcile(dry_run=options["dry_run"])
+        for (scope, pk, currency), (stored, actual) in sorted(drift.items()):
+            changed = ", ".join(f"{column} {stored[column]} -> {actual[column]}"
+                                for column in budgets.COLUMNS if stored[column] != actual[column])
+            self.stdout.write(f"{scope} {pk} {currency or '-'}: {changed}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(drift)} totals {'drifted' if options['dry_run'] else 'repaired'}"
+        ))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from event import audit
+from event.models import Audit, AuditChange
+
+
+class Command(BaseCommand):
+    help = "Rewrite audited_changes in the compact JSON format and rebuild the per-field audit index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk", type=int, default=1000, help="audits read and written per transaction")
+        parser.add_argument("--after", type=int, default=0, help="resume after this audit id")
+        parser.add_argument("--dry-run", action="store_true", help="only count what would change")
+
+    def handle(self, *args, **options):
+        last, seen, rewritten, failed = options["after"], 0, 0, 0
+        while True:
+            # keyset pagination keeps every chunk an index range scan, however far the run gets
+            chunk = list(Audit.objects.filter(pk__gt=last).order_by("pk")
+                         .only("pk", "audited_changes", "auditable_content_type_id", "auditable_object_id",
+                               "created_at")[:options["chunk"]])
+            if not chunk:
+                break
+            last = chunk[-1].pk
+            changed, decoded = [], []
+            for row in chunk:
+                try:
+                    changes = audit.decode_changes(row.audited_changes)
+                except ValueError as e:
+                    failed += 1
+                    self.stderr.write(f"audit {row.pk}: {e}")
+                    continue
+                encoded = audit.encode_changes(changes)
+                if encoded != row.audited_changes:
+                    row.audited_changes = encoded
+                    changed.append(row)
+                row._changed_fields = list(changes)
+                decoded.append(row)
+            seen += len(chunk)
+            rewritten += len(changed)
+            if not options["dry_run"]:
+                with transaction.atomic():
+                    Audit.objects.bulk_update(changed, ["audited_changes"])
+                    AuditChange.objects.filter(audit_id__in=[row.pk for row in decoded]).delete()
+                    AuditChange.objects.bulk_create(audit.index_rows(decoded))
+            self.stdout.write(f"up to audit {last}: {seen} read, {rewritten} rewritten, {failed} unreadable")
+        self.stdout.write(self.style.SUCCESS(
+            f"{seen} audits read, {rewritten} {'to rewrite' if options['dry_run'] else 'rewritten'}, "
+            f"{failed} unreadable"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from event import search
+
+
+class Command(BaseCommand):
+    help = ("Create the indexes behind admin autocompletes: pg_trgm indexes on PostgreSQL, FTS5 tables "
+            "with triggers on SQLite (rebuilt from the tables on every run).")
+
+    def handle(self, *args, **options):
+        created = search.setup()
+        for name in created:
+            self.stdout.write(f"ready: {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} search indexes ready"))
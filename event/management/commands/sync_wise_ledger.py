@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from event import ledger
+from event.models import LedgerCursor
+from event.wise import get_client
+
+
+class Command(BaseCommand):
+    help = "Read new Wise activities and balances into the reconciliation ledger and match them to payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", type=int, default=None, help="Wise profile id (defaults to WISE_PROFILE_ID)")
+        parser.add_argument("--size", type=int, default=ledger.PAGE_SIZE, help="activities per page")
+        parser.add_argument("--max-pages", type=int, default=None,
+                            help="stop after this many pages; the next run resumes from the saved cursor")
+        parser.add_argument("--reset", action="store_true", help="forget the cursor and read all activities again")
+        parser.add_argument("--no-balances", action="store_true")
+
+    def handle(self, *args, **options):
+        profile_id = int(options["profile"] or settings.WISE_PROFILE_ID)
+        client = get_client()
+        if options["reset"]:
+            LedgerCursor.objects.filter(profile_id=profile_id).delete()
+        if not options["no_balances"]:
+            self.stdout.write(f"{ledger.sync_balances(client, profile_id)} balances synced")
+
+        report = ledger.sync_activities(client, profile_id, size=options["size"], max_pages=options["max_pages"])
+        for match, count in sorted(report.matches.items()):
+            self.stdout.write(f"  {match}: {count}")
+        if not report.finished:
+            self.stdout.write(self.style.WARNING(
+                f"{report.entries} activities read in {report.pages} pages; run again to finish the pass"
+            ))
+            return
+        since = LedgerCursor.objects.get(profile_id=profile_id).since
+        missing = ledger.missing_payments(before=since).count()
+        style = self.style.WARNING if report.mismatched or missing else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{report.entries} activities read in {report.pages} pages, {report.mismatched} mismatched, "
+            f"{missing} payments without a Wise activity"
+        ))
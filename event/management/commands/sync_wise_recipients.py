@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from event.wise import get_client, recipients
+
+
+class Command(BaseCommand):
+    help = "Add existing Wise recipients to the local recipient index and drop deleted ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", type=int, default=None, help="Wise profile id (defaults to WISE_PROFILE_ID)")
+        parser.add_argument("--currency", default=None, help="only sync recipients in this currency")
+
+    def handle(self, *args, **options):
+        profile_id = options["profile"] or settings.WISE_PROFILE_ID
+        added, removed = recipients.sync(get_client(), profile_id, currency=options["currency"])
+        self.stdout.write(self.style.SUCCESS(f"{added} recipients indexed, {removed} removed"))
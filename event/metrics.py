@@ -0,0 +1,250 @@
+"""
+Metrics of the background job engine.
+
+Counters and histograms live in memory in the worker process and are rendered in the
+Prometheus text format (``render``; ``jobworker --metrics-port`` serves them). The
+web process cannot see a worker's memory, so the worker also rolls its numbers up
+into per-minute ``JobStat`` rows; those and the live queue depth read from
+``DelayedJob`` feed the ``/event/metrics`` endpoint and the staff dashboard.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.utils import timezone
+
+from .models import DelayedJob, JobStat
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0, 3600.0)
+FLUSH_INTERVAL = 10.0
+STATS_RETENTION = timedelta(days=14)
+# the rolled-up totals are a gauge over a fixed window: a counter summed from JobStat would drop when it is pruned
+PROCESSED_WINDOW = timedelta(hours=1)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    labels = _labels(self.label_names + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+JOBS_CLAIMED = Counter("tsp_jobs_claimed_total", "Jobs claimed by this worker.", ("queue", "priority"))
+JOBS_DONE = Counter("tsp_jobs_completed_total", "Jobs finished by this worker, by outcome.",
+                    ("queue", "priority", "outcome"))
+CLAIM_LATENCY = Histogram("tsp_job_claim_latency_seconds", "Time from run_at until a worker claimed the job.",
+                          ("queue",))
+RUN_TIME = Histogram("tsp_job_run_seconds", "Time spent running a job.", ("queue",))
+
+
+def render(metrics=None):
+    lines = []
+    for metric in REGISTRY if metrics is None else metrics:
+        samples = metric.samples()
+        if samples:
+            lines += metric.header() + samples
+    return "\n".join(lines) + "\n"
+
+
+def serve(port, host="0.0.0.0"):
+    """Serve ``render()`` on ``http://host:port/`` (any path) from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+# ---------- Per-minute rollup ----------
+
+class StatRollup:
+    """Buffers job numbers per (minute, queue, priority) and adds them to ``JobStat`` every few seconds."""
+
+    FIELDS = ("claimed", "succeeded", "failed", "claim_wait_seconds", "run_seconds")
+
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._pruned = 0.0
+
+    def add(self, queue, priority, **amounts):
+        minute = timezone.now().replace(second=0, microsecond=0)
+        with self._lock:
+            row = self._pending[(minute, queue or "", priority or 0)]
+            for name, amount in amounts.items():
+                row[name] += amount
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+            self._flushed = time.monotonic()
+        for (minute, queue, priority), amounts in pending.items():
+            increments = {name: F(name) + amount for name, amount in amounts.items()}
+            rows = JobStat.objects.filter(minute=minute, queue=queue, priority=priority)
+            if rows.update(**increments):
+                continue
+            try:
+                with transaction.atomic():
+                    JobStat.objects.create(minute=minute, queue=queue, priority=priority, **amounts)
+            except IntegrityError:  # another worker created the row first
+                rows.update(**increments)
+        if time.monotonic() - self._pruned > 3600:
+            JobStat.objects.filter(minute__lt=timezone.now() - STATS_RETENTION).delete()
+            self._pruned = time.monotonic()
+
+
+# ---------- Queue state ----------
+
+def queue_depth(now=None):
+    """Per (queue, priority): runnable, scheduled, running and failed jobs and the oldest runnable ``run_at``."""
+    now = now or timezone.now()
+    waiting = Q(failed_at__isnull=True, locked_at__isnull=True)
+    runnable = waiting & (Q(run_at__isnull=True) | Q(run_at__lte=now))
+    return list(
+        DelayedJob.objects.values("queue", "priority").annotate(
+            runnable=Count("pk", filter=runnable),
+            scheduled=Count("pk", filter=waiting & Q(run_at__gt=now)),
+            running=Count("pk", filter=Q(failed_at__isnull=True, locked_at__isnull=False)),
+            failed=Count("pk", filter=Q(failed_at__isnull=False)),
+            oldest=Min("run_at", filter=runnable),
+        ).order_by("queue", "priority")
+    )
+
+
+def render_queue_state():
+    """Prometheus text of the queue depth and the rolled-up totals of all workers over ``PROCESSED_WINDOW``."""
+    now = timezone.now()
+    registry = []
+    depth = Gauge("tsp_jobs_queued", "Jobs in DelayedJob by state.", ("queue", "priority", "state"), registry)
+    age = Gauge("tsp_jobs_oldest_runnable_seconds", "Age of the oldest runnable job.", ("queue", "priority"),
+                registry)
+    for row in queue_depth(now):
+        labels = {"queue": row["queue"] or "", "priority": row["priority"]}
+        for state in ("runnable", "scheduled", "running", "failed"):
+            depth.set(row[state], state=state, **labels)
+        age.set((now - row["oldest"]).total_seconds() if row["oldest"] else 0, **labels)
+    totals = Gauge("tsp_jobs_processed_last_hour", "Jobs finished by all workers in the last hour.",
+                   ("queue", "priority", "outcome"), registry)
+    for row in (JobStat.objects.filter(minute__gte=now - PROCESSED_WINDOW).values("queue", "priority")
+                .annotate(ok=Sum("succeeded"), ko=Sum("failed")).order_by("queue", "priority")):
+        totals.set(row["ok"], queue=row["queue"], priority=row["priority"], outcome="succeeded")
+        totals.set(row["ko"], queue=row["queue"], priority=row["priority"], outcome="failed")
+    return render(registry)
+
+
+def dashboard(minutes=60):
+    """Pre-aggregated series for the staff dashboard charts."""
+    now = timezone.now().replace(second=0, microsecond=0)
+    start = now - timedelta(minutes=minutes - 1)
+    labels = [start + timedelta(minutes=n) for n in range(minutes)]
+    index = {minute: n for n, minute in enumerate(labels)}
+    series = {}
+    rows = (JobStat.objects.filter(minute__gte=start).values("minute", "queue")
+            .annotate(claimed=Sum("claimed"), succeeded=Sum("succeeded"), failed=Sum("failed"),
+                      wait=Sum("claim_wait_seconds"), run=Sum("run_seconds")))
+    for row in rows:
+        queue = series.setdefault(row["queue"] or "default", {
+            key: [0] * minutes for key in ("succeeded", "failed", "avg_run_seconds", "avg_wait_seconds")
+        })
+        n = index.get(row["minute"])
+        if n is None:
+            continue
+        done = row["succeeded"] + row["failed"]
+        queue["succeeded"][n] = row["succeeded"]
+        queue["failed"][n] = row["failed"]
+        queue["avg_run_seconds"][n] = round(row["run"] / done, 3) if done else 0
+        queue["avg_wait_seconds"][n] = round(row["wait"] / row["claimed"], 3) if row["claimed"] else 0
+    depth = [{**row, "oldest": row["oldest"].isoformat() if row["oldest"] else None} for row in queue_depth()]
+    return {"minutes": [m.strftime("%H:%M") for m in labels], "queues": series, "depth": depth}
@@ -0,0 +1,36 @@
+from . import tracing
+from .audit import audit_context, client_address
+
+
+class TracingMiddleware:
+    """
+    Runs each request in a ``tracing.trace``: echoes its request id in ``X-Request-Id``,
+    adds a ``Server-Timing`` breakdown and logs slow or sampled requests. Goes first in
+    ``MIDDLEWARE`` so the timings cover the whole stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = tracing.clean_id(request.headers.get(tracing.HEADER))
+        with tracing.trace(request_id, f"{request.method} {request.path}") as trace:
+            request.request_id = trace.request_id
+            response = self.get_response(request)
+            response[tracing.HEADER] = trace.request_id
+            response["Server-Timing"] = trace.server_timing()
+            tracing.maybe_log(trace, status=response.status_code,
+                              user=getattr(getattr(request, "user", None), "pk", None))
+            return response
+
+
+class AuditMiddleware:
+    """Attributes the audits of a request to its user and address and writes them in one batch."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with audit_context(user=getattr(request, "user", None), remote_address=client_address(request),
+                           request_uuid=tracing.current_request_id()):
+            return self.get_response(request)
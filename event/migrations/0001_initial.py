@@ -0,0 +1,309 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('description', models.CharField(blank=True, max_length=255, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('currency', models.CharField(blank=True, db_index=True, max_length=10, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostalAddress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line1', models.CharField(blank=True, max_length=255, null=True)),
+                ('line2', models.CharField(blank=True, max_length=255, null=True)),
+                ('city', models.CharField(blank=True, max_length=255, null=True)),
+                ('postal_code', models.CharField(blank=True, max_length=20, null=True)),
+                ('county', models.CharField(blank=True, max_length=255, null=True)),
+                ('country_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Role',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DelayedJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('handler', models.TextField()),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('run_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('failed_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_by', models.CharField(blank=True, max_length=255, null=True)),
+                ('queue', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['priority', 'run_at'], name='delayed_jobs_priority')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('country_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('url', models.CharField(blank=True, max_length=255, null=True)),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('validated', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('visa_letters', models.BooleanField(default=False)),
+                ('request_creation_deadline', models.DateTimeField(blank=True, null=True)),
+                ('reimbursement_creation_deadline', models.DateTimeField(blank=True, null=True)),
+                ('shipment_type', models.CharField(blank=True, max_length=255, null=True)),
+                ('budget', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='event.budget')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EventEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to', models.TextField()),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='emails', to='event.event')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='event_emails', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EventOrganizer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_organizers', to='event.event')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_organizers', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('event', 'user')},
+            },
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='organizers',
+            field=models.ManyToManyField(blank=True, related_name='organized_events', through='event.EventOrganizer', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Reimbursement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(blank=True, max_length=255, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('state_updated_at', models.DateTimeField(blank=True, null=True)),
+                ('acceptance_file', models.CharField(blank=True, max_length=255, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reimbursements', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(blank=True, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('cost_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('cost_currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('method', models.CharField(blank=True, max_length=255, null=True)),
+                ('code', models.CharField(blank=True, max_length=255, null=True)),
+                ('subject', models.CharField(blank=True, max_length=255, null=True)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('file', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('reimbursement', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='event.reimbursement')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BankAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.CharField(blank=True, max_length=255, null=True)),
+                ('bank_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('format', models.CharField(blank=True, max_length=255, null=True)),
+                ('iban', models.CharField(blank=True, max_length=255, null=True)),
+                ('bic', models.CharField(blank=True, max_length=255, null=True)),
+                ('national_bank_code', models.CharField(blank=True, max_length=255, null=True)),
+                ('national_account_code', models.CharField(blank=True, max_length=255, null=True)),
+                ('country_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('bank_postal_address', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('reimbursement', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bank_accounts', to='event.reimbursement')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReimbursementAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('file', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('reimbursement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='event.reimbursement')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReimbursementLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('url', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('reimbursement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links', to='event.reimbursement')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Request',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(blank=True, max_length=255, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('state_updated_at', models.DateTimeField(blank=True, null=True)),
+                ('visa_letter', models.BooleanField(default=False)),
+                ('contact_phone_number', models.CharField(blank=True, max_length=255, null=True)),
+                ('type', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='requests', to='event.event')),
+                ('postal_address', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='requests', to='event.postaladdress')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='requests', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reimbursement',
+            name='request',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reimbursements', to='event.request'),
+        ),
+        migrations.CreateModel(
+            name='RequestExpense',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(blank=True, max_length=255, null=True)),
+                ('description', models.CharField(blank=True, max_length=255, null=True)),
+                ('estimated_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('estimated_currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('approved_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('approved_currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('total_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('authorized_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expenses', to='event.request')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StateChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('machine_object_id', models.IntegerField()),
+                ('state_event', models.CharField(blank=True, max_length=255, null=True)),
+                ('from_state', models.CharField(max_length=255)),
+                ('to_state', models.CharField(max_length=255)),
+                ('notes', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('type', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('machine_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='state_changes_as_machine', to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='state_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('full_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('phone_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('country_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('second_phone_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('description', models.CharField(blank=True, max_length=255, null=True)),
+                ('location', models.CharField(blank=True, max_length=255, null=True)),
+                ('birthday', models.DateField(blank=True, null=True)),
+                ('website', models.CharField(blank=True, max_length=255, null=True)),
+                ('blog', models.CharField(blank=True, max_length=255, null=True)),
+                ('passport', models.CharField(blank=True, max_length=255, null=True)),
+                ('alternate_id_document', models.CharField(blank=True, max_length=255, null=True)),
+                ('zip_code', models.CharField(blank=True, max_length=20, null=True)),
+                ('postal_address', models.CharField(blank=True, max_length=255, null=True)),
+                ('role', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='user_profiles', to='event.role')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Audit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('auditable_object_id', models.IntegerField(blank=True, null=True)),
+                ('action', models.CharField(blank=True, max_length=255, null=True)),
+                ('audited_changes', models.TextField(blank=True, null=True)),
+                ('version', models.IntegerField(default=0)),
+                ('comment', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('remote_address', models.CharField(blank=True, max_length=255, null=True)),
+                ('username', models.CharField(blank=True, max_length=255, null=True)),
+                ('request_uuid', models.CharField(blank=True, max_length=255, null=True)),
+                ('associated_object_id', models.IntegerField(blank=True, null=True)),
+                ('associated_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='audits_as_associated', to='contenttypes.contenttype')),
+                ('auditable_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='audits_as_auditable', to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='audits', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['associated_content_type', 'associated_object_id'], name='associated_index'), models.Index(fields=['auditable_content_type', 'auditable_object_id', 'version'], name='auditable_index'), models.Index(fields=['created_at'], name='index_audits_on_created_at'), models.Index(fields=['request_uuid'], name='index_audits_on_request_uuid')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('machine_object_id', models.IntegerField(blank=True, null=True)),
+                ('body', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('private', models.BooleanField(default=False)),
+                ('machine_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='comments_as_machine', to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='comments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['private'], name='index_comments_on_private')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0002_payment_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WiseRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile_id', models.BigIntegerField()),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('recipient_id', models.BigIntegerField(db_index=True)),
+                ('currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('bank_account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wise_recipients', to='event.bankaccount')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('profile_id', 'fingerprint'), name='unique_wise_recipient_fingerprint')],
+            },
+        ),
+    ]
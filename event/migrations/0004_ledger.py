@@ -0,0 +1,63 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0003_wiserecipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile_id', models.BigIntegerField(unique=True)),
+                ('cursor', models.CharField(blank=True, max_length=255, null=True)),
+                ('since', models.DateTimeField(blank=True, null=True)),
+                ('pass_started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WiseBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile_id', models.BigIntegerField()),
+                ('balance_id', models.BigIntegerField()),
+                ('currency', models.CharField(max_length=10)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('reserved_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('profile_id', 'balance_id'), name='unique_wise_balance')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile_id', models.BigIntegerField()),
+                ('activity_id', models.CharField(max_length=64)),
+                ('activity_type', models.CharField(blank=True, max_length=64, null=True)),
+                ('resource_type', models.CharField(blank=True, max_length=64, null=True)),
+                ('resource_id', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('status', models.CharField(blank=True, max_length=64, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('match', models.CharField(blank=True, db_index=True, max_length=32, null=True)),
+                ('occurred_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='event.payment')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('profile_id', 'activity_id'), name='unique_ledger_entry_activity')],
+            },
+        ),
+    ]
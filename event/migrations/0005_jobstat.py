@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0004_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('queue', models.CharField(blank=True, default='', max_length=255)),
+                ('priority', models.IntegerField(default=0)),
+                ('claimed', models.IntegerField(default=0)),
+                ('succeeded', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('claim_wait_seconds', models.FloatField(default=0)),
+                ('run_seconds', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('minute', 'queue', 'priority'), name='unique_job_stat_minute')],
+            },
+        ),
+    ]
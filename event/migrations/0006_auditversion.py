@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('event', '0005_jobstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.IntegerField()),
+                ('version', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_id'), name='unique_audit_version_object')],
+            },
+        ),
+    ]
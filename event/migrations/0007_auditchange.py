@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('event', '0006_auditversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.IntegerField()),
+                ('field', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('audit', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='changes', to='event.audit')),
+                ('content_type', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contenttypes.contenttype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['content_type', 'object_id', 'field', 'created_at'], name='audit_changes_field_history')],
+            },
+        ),
+    ]
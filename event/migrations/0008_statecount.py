@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0007_auditchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=32)),
+                ('state', models.CharField(blank=True, default='', max_length=255)),
+                ('count', models.IntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='state_counts', to='event.event')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model', 'state'], name='state_counts_pending')],
+                'constraints': [models.UniqueConstraint(fields=('event', 'model', 'state'), name='unique_state_count')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0008_statecount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BudgetTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(blank=True, default='', max_length=10)),
+                ('estimated', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('approved', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('authorized', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('budget', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='event.budget')),
+                ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='budget_totals', to='event.event')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('event__isnull', False)), fields=('event', 'currency'), name='unique_event_total'), models.UniqueConstraint(condition=models.Q(('event__isnull', True)), fields=('budget', 'currency'), name='unique_budget_total')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0009_budgettotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='lock_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='requestexpense',
+            name='lock_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
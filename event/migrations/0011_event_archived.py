@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0010_lock_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='archived',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0011_event_archived'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=10)),
+                ('target', models.CharField(max_length=10)),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('source', 'target'), name='unique_currency_rate_pair')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0012_currencyrate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delayedjob',
+            name='progress',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -3,6 +3,8 @@ from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
+from .tracking import TrackedManager
+
 
 # ---------- Core domain ----------
 
@@ -14,6 +16,8 @@ class Budget(models.Model):
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
 
+    objects = TrackedManager()
+
     def __str__(self):
         return self.name or f"Budget #{self.pk}"
 
@@ -26,6 +30,8 @@ class Event(models.Model):
     start_date = models.DateField(null=True, blank=True)
     end_date = models.DateField(null=True, blank=True)
     validated = models.BooleanField(default=False)
+    # archived events are kept, with their requests, instead of being deleted
+    archived = models.BooleanField(default=False, db_index=True)
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
     visa_letters = models.BooleanField(default=False)
@@ -39,6 +45,8 @@ class Event(models.Model):
         settings.AUTH_USER_MODEL, through="EventOrganizer", related_name="organized_events", blank=True
     )
 
+    objects = TrackedManager()
+
     def __str__(self):
         return self.name
 
@@ -74,6 +82,11 @@ class Request(models.Model):
     contact_phone_number = models.CharField(max_length=255, null=True, blank=True)
     type = models.CharField(max_length=255, null=True, blank=True, db_index=True)
 
+    # bumped by every approval and state transition, see event.approvals; never taken from a form
+    lock_version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = TrackedManager()
+
     def __str__(self):
         return f"Request #{self.pk} for {self.event}"
 
@@ -91,6 +104,11 @@ class RequestExpense(models.Model):
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
 
+    # bumped by every approval and state transition, see event.approvals; never taken from a form
+    lock_version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = TrackedManager()
+
     def __str__(self):
         return self.subject or f"Expense #{self.pk}"
 
@@ -105,6 +123,8 @@ class Reimbursement(models.Model):
     state_updated_at = models.DateTimeField(null=True, blank=True)
     acceptance_file = models.CharField(max_length=255, null=True, blank=True)
 
+    objects = TrackedManager()
+
     def __str__(self):
         return f"Reimbursement #{self.pk}"
 
@@ -125,6 +145,8 @@ class BankAccount(models.Model):
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
 
+    objects = TrackedManager()
+
     def __str__(self):
         return self.iban or f"BankAccount #{self.pk}"
 
@@ -143,12 +165,108 @@ class Payment(models.Model):
     subject = models.CharField(max_length=255, null=True, blank=True)
     notes = models.TextField(null=True, blank=True)
     file = models.CharField(max_length=255, null=True, blank=True)
+    # last known provider state of the transfer behind this payment (e.g. Wise "processing")
+    status = models.CharField(max_length=255, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["method", "code"], name="index_payments_on_method_code")]
+
+    objects = TrackedManager()
+
     def __str__(self):
         return self.subject or f"Payment #{self.pk}"
 
+class WiseRecipient(models.Model):
+    # Wise recipient created for a normalised set of bank details (see event.wise.recipients)
+    profile_id = models.BigIntegerField()
+    fingerprint = models.CharField(max_length=64)
+    recipient_id = models.BigIntegerField(db_index=True)
+    currency = models.CharField(max_length=10, null=True, blank=True)
+    bank_account = models.ForeignKey(
+        BankAccount, null=True, blank=True, on_delete=models.SET_NULL, related_name="wise_recipients"
+    )
+    created_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["profile_id", "fingerprint"], name="unique_wise_recipient_fingerprint"),
+        ]
+
+    def __str__(self):
+        return f"Wise recipient {self.recipient_id}"
+
+class LedgerEntry(models.Model):
+    # one Wise activity, reduced to what reconciliation needs (see event.ledger)
+    profile_id = models.BigIntegerField()
+    activity_id = models.CharField(max_length=64)
+    activity_type = models.CharField(max_length=64, null=True, blank=True)
+    resource_type = models.CharField(max_length=64, null=True, blank=True)
+    resource_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    status = models.CharField(max_length=64, null=True, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    currency = models.CharField(max_length=10, null=True, blank=True)
+    title = models.CharField(max_length=255, null=True, blank=True)
+    payment = models.ForeignKey(
+        Payment, null=True, blank=True, on_delete=models.SET_NULL, related_name="ledger_entries"
+    )
+    match = models.CharField(max_length=32, null=True, blank=True, db_index=True)
+    occurred_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["profile_id", "activity_id"], name="unique_ledger_entry_activity"),
+        ]
+
+    def __str__(self):
+        return f"{self.title or self.activity_id}: {self.amount} {self.currency}"
+
+class LedgerCursor(models.Model):
+    # where the last ledger sync of a profile stopped, so the next one resumes there
+    profile_id = models.BigIntegerField(unique=True)
+    cursor = models.CharField(max_length=255, null=True, blank=True)
+    since = models.DateTimeField(null=True, blank=True)
+    pass_started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Ledger cursor of profile {self.profile_id}"
+
+class WiseBalance(models.Model):
+    profile_id = models.BigIntegerField()
+    balance_id = models.BigIntegerField()
+    currency = models.CharField(max_length=10)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    reserved_amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["profile_id", "balance_id"], name="unique_wise_balance"),
+        ]
+
+    def __str__(self):
+        return f"{self.amount} {self.currency}"
+
+class CurrencyRate(models.Model):
+    # Wise mid-market rate, refreshed by the refresh_rates job and read by every process (see event.wise.rates)
+    source = models.CharField(max_length=10)
+    target = models.CharField(max_length=10)
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["source", "target"], name="unique_currency_rate_pair"),
+        ]
+
+    def __str__(self):
+        return f"1 {self.source} = {self.rate} {self.target}"
+
 # TODO: possibly move this to a different 'payment' app - TBD
 class ReimbursementAttachment(models.Model):
     reimbursement = models.ForeignKey(Reimbursement, on_delete=models.CASCADE, related_name="attachments")
@@ -157,6 +275,8 @@ class ReimbursementAttachment(models.Model):
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
 
+    objects = TrackedManager()
+
     def __str__(self):
         return self.title
 
@@ -168,6 +288,8 @@ class ReimbursementLink(models.Model):
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
 
+    objects = TrackedManager()
+
     def __str__(self):
         return self.title
 
@@ -214,6 +336,39 @@ class Audit(models.Model):
         return f"Audit #{self.pk} {self.action or ''}".strip()
 
 
+class AuditChange(models.Model):
+    # one row per field an audit changed, so field history is an index range scan (see event.audit.field_history).
+    # No database-level foreign keys: audit rows may be archived or partitioned independently.
+    audit = models.ForeignKey(Audit, on_delete=models.DO_NOTHING, db_constraint=False, related_name="changes")
+    content_type = models.ForeignKey(ContentType, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    object_id = models.IntegerField()
+    field = models.CharField(max_length=64)
+    created_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["content_type", "object_id", "field", "created_at"], name="audit_changes_field_history"),
+        ]
+
+    def __str__(self):
+        return f"{self.field} in audit #{self.audit_id}"
+
+
+class AuditVersion(models.Model):
+    # last audit version handed out per audited object (see event.audit.allocate_versions)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name="+")
+    object_id = models.IntegerField()
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["content_type", "object_id"], name="unique_audit_version_object"),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type_id}/{self.object_id} v{self.version}"
+
+
 class Comment(models.Model):
     # machine
     machine_content_type = models.ForeignKey(
@@ -256,6 +411,48 @@ class StateChange(models.Model):
         return f"{self.from_state} → {self.to_state}"
 
 
+class BudgetTotal(models.Model):
+    # running totals of one budget (event is NULL) or one event in one currency, kept by event.budgets
+    budget = models.ForeignKey(Budget, null=True, blank=True, on_delete=models.CASCADE, related_name="totals")
+    event = models.ForeignKey(Event, null=True, blank=True, on_delete=models.CASCADE, related_name="budget_totals")
+    currency = models.CharField(max_length=10, default="", blank=True)
+    estimated = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    approved = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    authorized = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["event", "currency"], condition=models.Q(event__isnull=False),
+                                    name="unique_event_total"),
+            models.UniqueConstraint(fields=["budget", "currency"], condition=models.Q(event__isnull=True),
+                                    name="unique_budget_total"),
+        ]
+
+    def __str__(self):
+        return f"{self.event or self.budget} {self.currency}: {self.approved} approved"
+
+
+class StateCount(models.Model):
+    # requests / reimbursements of an event per state, kept up to date on every change (see event.counters)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="state_counts")
+    model = models.CharField(max_length=32)
+    state = models.CharField(max_length=255, default="", blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["event", "model", "state"], name="unique_state_count"),
+        ]
+        indexes = [
+            models.Index(fields=["model", "state"], name="state_counts_pending"),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} {self.model} {self.state or '-'}: {self.count}"
+
+
 # ---------- Emails & organizers ----------
 
 class EventEmail(models.Model):
@@ -295,6 +492,8 @@ class DelayedJob(models.Model):
     failed_at = models.DateTimeField(null=True, blank=True)
     locked_by = models.CharField(max_length=255, null=True, blank=True)
     queue = models.CharField(max_length=255, null=True, blank=True)
+    # reported by the running job itself (jobs.report_progress), e.g. "1500 / 12000"
+    progress = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(null=True, blank=True)
 
@@ -305,6 +504,26 @@ class DelayedJob(models.Model):
         return f"Job #{self.pk} (prio {self.priority})"
 
 
+class JobStat(models.Model):
+    # jobs of one queue and priority handled in one minute, rolled up by the workers (see event.metrics)
+    minute = models.DateTimeField()
+    queue = models.CharField(max_length=255, default="", blank=True)
+    priority = models.IntegerField(default=0)
+    claimed = models.IntegerField(default=0)
+    succeeded = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    claim_wait_seconds = models.FloatField(default=0)
+    run_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["minute", "queue", "priority"], name="unique_job_stat_minute"),
+        ]
+
+    def __str__(self):
+        return f"{self.queue or 'default'} at {self.minute:%Y-%m-%d %H:%M}"
+
+
 #TODO: this might be replaced by Django Auth Group membership - TBD
 # ---------- Profiles / roles ----------
 class Role(models.Model):
@@ -0,0 +1,415 @@
+"""
+Batch payouts: settle every approved reimbursement of an event through Wise.
+
+The database work is done up front and at the end (one read of everything to pay,
+one bulk write of the resulting ``Payment`` rows); in between, the
+quote -> recipient -> transfer -> fund chains of all attendees run concurrently on
+one pooled ``AsyncWiseClient``. A failing chain is recorded in the report and never
+aborts the rest of the batch. When more than one transfer is funded, the transfers are
+created in Wise batch groups so each group is funded, and SCA-approved, once.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Payment, Reimbursement
+from .states import reimbursement_machine
+from .wise import AsyncWiseClient, WiseError, rate_table, recipients
+from .wise.ratelimit import RequestScheduler
+from .wise.sca import ScaError, ScaHandler, signer_from_settings
+
+logger = logging.getLogger(__name__)
+
+PAYOUT_STATE = "approved"
+PROCESSED_STATE = "processed"
+PAYMENT_METHOD = "wise"
+
+DEFAULT_PARALLELISM = 8
+
+# most transfers Wise accepts in one batch group
+BATCH_GROUP_LIMIT = 1000
+
+# what Wise answers a transfer with when its target recipient is gone; other 400s and 422s
+# are about the quote or amount, and re-creating the recipient would not help
+RECIPIENT_GONE_STATUS = 404
+RECIPIENT_GONE_CODES = ("recipient_not_found",)
+
+# customerTransactionId is derived from the reimbursement and the number of earlier
+# attempts, so running a batch twice hands Wise the same idempotency token and can never
+# pay an attendee twice, while a reimbursement whose transfer bounced gets a fresh one.
+TRANSACTION_NAMESPACE = uuid.UUID("4b0f5b8e-4f3c-4a55-9a57-6d2c1b3e8f10")
+
+
+@dataclass
+class PayoutItem:
+    """Everything one payout chain needs, detached from the ORM."""
+    reimbursement_id: int
+    amount: Decimal
+    currency: str
+    holder: str
+    recipient_type: str
+    details: dict
+    reference: str
+    attempt: int = 0
+    bank_account_id: int = None
+    recipient_id: int = None  # from the recipient index, when the account was paid before
+
+    @property
+    def fingerprint(self):
+        return recipients.fingerprint(self.currency, self.recipient_type, self.details, self.holder)
+
+    @property
+    def transaction_id(self):
+        name = f"reimbursement:{self.reimbursement_id}:{self.attempt}"
+        return str(uuid.uuid5(TRANSACTION_NAMESPACE, name))
+
+
+@dataclass
+class PayoutResult:
+    reimbursement_id: int
+    item: PayoutItem = None
+    quote: dict = None
+    transfer: dict = None
+    recipient_id: int = None
+    recipient_created: bool = False
+    stale_recipient_id: int = None
+    funded: bool = False
+    funding_error: str = None  # the transfer exists but still has to be funded (e.g. by hand)
+    error: str = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+@dataclass
+class BatchReport:
+    results: list = field(default_factory=list)
+    payments: list = field(default_factory=list)
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def unfunded(self):
+        return [r for r in self.results if r.ok and not r.funded]
+
+
+# ---------- Loading ----------
+
+def recipient_for(bank_account):
+    """Map a ``BankAccount`` to a Wise recipient type and its details."""
+    if bank_account.iban:
+        details = {"legalType": "PRIVATE", "iban": bank_account.iban.replace(" ", "").upper()}
+        if bank_account.bic:
+            details["BIC"] = bank_account.bic.strip().upper()
+        return "iban", details
+    if bank_account.national_bank_code and bank_account.national_account_code:
+        return "sort_code", {
+            "legalType": "PRIVATE",
+            "sortCode": bank_account.national_bank_code.replace("-", "").strip(),
+            "accountNumber": bank_account.national_account_code.strip(),
+        }
+    return None, None
+
+
+def collect_items(event, profile_id=None):
+    """
+    Load the approved reimbursements of ``event`` in a fixed number of queries.
+
+    With a ``profile_id`` the recipients already created for these bank accounts are
+    looked up in the recipient index too. Returns ``(items, failures)``: reimbursements that cannot be paid as they stand
+    (no bank account, no authorised amount, mixed currencies) come back as failed
+    ``PayoutResult`` rows instead of items.
+    """
+    reimbursements = (
+        Reimbursement.objects
+        .filter(request__event=event, state=PAYOUT_STATE)
+        .select_related("request", "user")
+        .prefetch_related("bank_accounts", "payments", "request__expenses")
+        .order_by("pk")
+    )
+    items, failures = [], []
+    for reimbursement in reimbursements:
+        expenses = [e for e in reimbursement.request.expenses.all()
+                    if (e.authorized_amount or e.approved_amount)]
+        currencies = {e.approved_currency for e in expenses}
+        bank_accounts = list(reimbursement.bank_accounts.all())
+        recipient_type, details = recipient_for(bank_accounts[0]) if bank_accounts else (None, None)
+
+        error = None
+        if not expenses:
+            error = "nothing approved to pay"
+        elif len(currencies) != 1 or None in currencies:
+            error = f"expenses must share one approved currency, got {sorted(map(str, currencies))}"
+        elif recipient_type is None:
+            error = "no usable bank account"
+        if error:
+            failures.append(PayoutResult(reimbursement.pk, error=error))
+            continue
+
+        items.append(PayoutItem(
+            reimbursement_id=reimbursement.pk,
+            amount=sum(((e.authorized_amount or e.approved_amount) for e in expenses), Decimal("0")),
+            currency=currencies.pop(),
+            holder=bank_accounts[0].holder or str(reimbursement.user),
+            recipient_type=recipient_type,
+            details=details,
+            reference=f"TSP{reimbursement.pk}",
+            attempt=sum(1 for p in reimbursement.payments.all() if p.method == PAYMENT_METHOD),
+            bank_account_id=bank_accounts[0].pk,
+        ))
+    if profile_id and items:
+        known = recipients.lookup(profile_id, {item.fingerprint for item in items})
+        for item in items:
+            item.recipient_id = known.get(item.fingerprint)
+    return items, failures
+
+
+# ---------- Running ----------
+
+def recipient_gone(error):
+    """Whether a failed transfer creation says its target recipient no longer exists."""
+    if error.status_code == RECIPIENT_GONE_STATUS:
+        return True
+    errors = error.payload.get("errors", []) if isinstance(error.payload, dict) else []
+    return any(isinstance(e, dict) and e.get("code") in RECIPIENT_GONE_CODES for e in errors)
+
+
+class PayoutEngine:
+    """
+    Runs payout chains concurrently on one ``AsyncWiseClient``.
+
+    At most ``parallelism`` chains are in flight at once; the client's scheduler keeps
+    all of them within the provider's rate limits. Funding goes through
+    ``ScaHandler`` with ``signer``; with ``batch_groups`` the transfers are collected in
+    batch groups and funded per group after all chains have run; a group
+    none of whose payouts went through is cancelled.
+    """
+
+    def __init__(self, client, profile_id, *, source_currency="EUR", parallelism=DEFAULT_PARALLELISM,
+                 fund=True, rates=None, signer=None, batch_groups=True, batch_name="TSP payout"):
+        self.client = client
+        self.profile_id = profile_id
+        self.source_currency = source_currency
+        self.parallelism = parallelism
+        self.fund = fund
+        self.rates = rate_table if rates is None else rates
+        self.sca = ScaHandler(client, signer)
+        self.batch_groups = batch_groups
+        self.batch_name = batch_name
+        self._recipients = {}
+        self._group_of = {}  # reimbursement id -> batch group id
+
+    async def _create_recipient(self, item):
+        recipient = await self.client.create_recipient(
+            self.profile_id, currency=item.currency, account_holder_name=item.holder,
+            recipient_type=item.recipient_type, details=item.details,
+        )
+        return recipient["id"]
+
+    async def recipient(self, item):
+        """Create the recipient for ``item``; attendees sharing an account share one call."""
+        task = self._recipients.get(item.fingerprint)
+        if task is None:
+            task = self._recipients[item.fingerprint] = asyncio.ensure_future(self._create_recipient(item))
+        return await task
+
+    async def _transfer(self, item, result):
+        group_id = self._group_of.get(item.reimbursement_id)
+        if group_id is not None:
+            return await self.client.create_batch_transfer(
+                self.profile_id, group_id,
+                target_account_id=result.recipient_id, quote_uuid=result.quote["id"],
+                customer_transaction_id=item.transaction_id, reference=item.reference,
+            )
+        return await self.client.create_transfer(
+            target_account_id=result.recipient_id, quote_uuid=result.quote["id"],
+            customer_transaction_id=item.transaction_id, reference=item.reference,
+        )
+
+    async def pay(self, item):
+        result = PayoutResult(item.reimbursement_id, item=item)
+        started = time.monotonic()
+        try:
+            # a quote backs only one transfer, so every payout gets its own
+            result.quote = await self.client.create_quote(
+                self.profile_id, source_currency=self.source_currency, target_currency=item.currency,
+                target_amount=float(item.amount),
+            )
+            self.rates.observe(result.quote)
+            if item.recipient_id:
+                result.recipient_id = item.recipient_id
+                try:
+                    result.transfer = await self._transfer(item, result)
+                except WiseError as e:
+                    if not recipient_gone(e):
+                        raise
+                    # the indexed recipient was deleted at Wise: drop it and create a new one
+                    result.stale_recipient_id = item.recipient_id
+            if result.transfer is None:
+                result.recipient_id = await self.recipient(item)
+                result.recipient_created = True
+                result.transfer = await self._transfer(item, result)
+            if self.fund and item.reimbursement_id not in self._group_of:
+                try:
+                    await self.sca.fund_transfer(self.profile_id, result.transfer["id"])
+                    result.funded = True
+                except (WiseError, ScaError) as e:
+                    result.funding_error = str(e)
+        except WiseError as e:
+            result.error = f"{e.step}: HTTP {e.status_code}"
+        except Exception as e:  # one broken chain must not take the batch down
+            logger.exception("payout of reimbursement %s failed", item.reimbursement_id)
+            result.error = f"{type(e).__name__}: {e}"
+        result.elapsed = time.monotonic() - started
+        return result
+
+    async def _open_groups(self, items):
+        groups = []
+        for start in range(0, len(items), BATCH_GROUP_LIMIT):
+            chunk = items[start:start + BATCH_GROUP_LIMIT]
+            try:
+                group = await self.client.create_batch_group(self.profile_id,
+                                                             source_currency=self.source_currency,
+                                                             name=f"{self.batch_name} {len(groups) + 1}")
+            except WiseError as e:
+                group = {"error": str(e)}
+            if not group.get("id"):
+                logger.warning("no batch group, funding transfers one by one: %s", group)
+                continue
+            groups.append(group["id"])
+            for item in chunk:
+                self._group_of[item.reimbursement_id] = group["id"]
+        return groups
+
+    async def _fund_group(self, group_id, results):
+        members = [r for r in results if r.ok and self._group_of.get(r.reimbursement_id) == group_id]
+        if not members:
+            await self._cancel_group(group_id)
+            return
+        try:
+            await self.sca.fund_batch_group(self.profile_id, group_id)
+        except (WiseError, ScaError) as e:
+            for r in members:
+                r.funding_error = f"batch group {group_id}: {e}"
+            return
+        for r in members:
+            r.funded = True
+
+    async def _cancel_group(self, group_id):
+        """Cancel a group none of whose payouts went through, so it does not stay open at Wise."""
+        try:
+            group = await self.client.get_batch_group(self.profile_id, group_id)
+            if group.get("status") == "NEW":
+                await self.client.cancel_batch_group(self.profile_id, group_id, group.get("version"))
+        except WiseError as e:
+            logger.warning("could not cancel the empty batch group %s: %s", group_id, e)
+
+    async def run(self, items):
+        groups = []
+        if self.fund and self.batch_groups and len(items) > 1:
+            groups = await self._open_groups(items)
+        semaphore = asyncio.Semaphore(self.parallelism)
+
+        async def bounded(item):
+            async with semaphore:
+                return await self.pay(item)
+
+        results = await asyncio.gather(*(bounded(item) for item in items))
+        for group_id in groups:
+            await self._fund_group(group_id, results)
+        return results
+
+
+def write_payments(results, user=None):
+    """Bulk-create the ``Payment`` rows of the transfers that were made and mark them processed."""
+    now = timezone.now()
+    paid = [r for r in results if r.ok and r.transfer]
+    payments = [
+        Payment(
+            reimbursement_id=r.reimbursement_id,
+            date=now.date(),
+            amount=r.item.amount,
+            currency=r.item.currency,
+            cost_amount=r.transfer.get("sourceValue"),
+            cost_currency=r.transfer.get("sourceCurrency"),
+            method=PAYMENT_METHOD,
+            code=str(r.transfer["id"]),
+            subject=r.item.reference,
+            status=r.transfer.get("status"),
+            created_at=now,
+            updated_at=now,
+        )
+        for r in paid
+    ]
+    ids = [r.reimbursement_id for r in paid]
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments)
+        reimbursement_machine.bulk(Reimbursement.objects.filter(pk__in=ids), "process", user=user,
+                                   notes="Wise batch payout")
+    return payments
+
+
+def index_recipients(results, profile_id):
+    """Record the recipients a batch created and invalidate the ones Wise rejected."""
+    stale = {r.stale_recipient_id for r in results if r.stale_recipient_id}
+    created = [(r.item.fingerprint, r.recipient_id, r.item.currency, r.item.bank_account_id)
+               for r in results if r.recipient_created and r.recipient_id]
+    with transaction.atomic():
+        recipients.forget(stale)
+        recipients.remember(profile_id, created)
+
+
+def settle_event(event, *, profile_id=None, parallelism=DEFAULT_PARALLELISM, rate=None, fund=True,
+                 batch_groups=None, client=None, user=None):
+    """
+    Pay out every approved reimbursement of ``event`` and return a ``BatchReport``.
+
+    ``client`` defaults to an ``AsyncWiseClient`` built from the settings; pass one
+    pointing at a local fake server to exercise the whole pipeline offline.
+    """
+    profile_id = profile_id or settings.WISE_PROFILE_ID
+    items, failures = collect_items(event, profile_id)
+    source_currency = getattr(settings, "WISE_SOURCE_CURRENCY", "EUR")
+    if batch_groups is None:
+        batch_groups = getattr(settings, "WISE_BATCH_GROUPS", True)
+
+    async def run():
+        own_client = client is None
+        if own_client:
+            # a --rate override gets its own scheduler; otherwise the process-wide one is shared
+            scheduler = RequestScheduler.from_settings(rate=rate) if rate else None
+            wise = AsyncWiseClient.from_settings(**({"scheduler": scheduler} if scheduler else {}))
+        else:
+            wise = client
+        try:
+            engine = PayoutEngine(wise, profile_id, source_currency=source_currency,
+                                  parallelism=parallelism, fund=fund,
+                                  signer=signer_from_settings(), batch_groups=batch_groups,
+                                  batch_name=f"TSP {event}"[:100])
+            return await engine.run(items)
+        finally:
+            if own_client:
+                await wise.aclose()
+
+    results = asyncio.run(run()) if items else []
+    report = BatchReport(results=failures + list(results))
+    report.payments = write_payments(results, user=user)
+    index_recipients(results, profile_id)
+    logger.info("payout of %s: %d paid (%d awaiting funding), %d failed", event, len(report.succeeded),
+                len(report.unfunded), len(report.failed))
+    return report
@@ -0,0 +1,149 @@
+"""
+Expense rollups for event reports.
+
+``expense_rollup`` reads the amount and currency columns of ``RequestExpense``
+with ``values_list``, chunk by chunk, into NumPy arrays. It converts every column
+to one report currency with a rate vector per distinct currency, taken from the
+cached ``rate_table``. Then it sums per event, per event country and per budget
+with ``bincount``. So a report over thousands of expenses in mixed currencies costs
+one query plus a label query per grouping, and no Python loop over expenses.
+
+``write_csv`` and ``Rollup.chart`` turn a rollup into the CSV export and the series
+of the staff dashboard chart.
+"""
+import csv
+from dataclasses import dataclass, field
+from decimal import Decimal
+from itertools import islice
+
+import numpy as np
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from .models import Budget, Event, RequestExpense
+from .wise.rates import rate_table
+
+CHUNK_SIZE = 5000
+CANCELED_STATE = "canceled"
+# column -> (amount field, currency field); an expense without an approved currency is in its estimated one
+COLUMNS = {
+    "estimated": ("estimated_amount", "estimated_currency"),
+    "approved": ("approved_amount", "approved_currency"),
+    "total": ("total_amount", "approved_currency"),
+    "authorized": ("authorized_amount", "approved_currency"),
+}
+# grouping -> expression of its key; missing keys are "" and 0 so the arrays get a plain dtype
+GROUPS = {
+    "event": F("request__event_id"),
+    "country": Coalesce("request__event__country_code", Value("")),
+    "budget": Coalesce("request__event__budget_id", Value(0)),
+}
+
+
+@dataclass
+class Rollup:
+    currency: str
+    expenses: int = 0
+    # grouping -> [{"key", "label", "expenses", column: Decimal, ...}], largest approved first
+    groups: dict = field(default_factory=dict)
+    totals: dict = field(default_factory=dict)
+    # currencies without a rate -> number of amounts left out
+    unconverted: dict = field(default_factory=dict)
+
+    def chart(self, by="event", column="approved", limit=15):
+        """``{"labels": [...], "values": [...]}`` of the largest groups, for Chart.js."""
+        rows = sorted(self.groups.get(by, []), key=lambda row: row[column], reverse=True)[:limit]
+        return {"currency": self.currency, "column": column, "labels": [row["label"] for row in rows],
+                "values": [float(row[column]) for row in rows]}
+
+
+def _cents(values):
+    return Decimal(f"{values:.2f}")
+
+
+def _load(expenses, chunk_size):
+    fields = [*GROUPS.values(), Coalesce("estimated_currency", Value("")), F("approved_currency"),
+              *(amount for amount, _ in COLUMNS.values())]
+    rows = expenses.values_list(*fields).order_by().iterator(chunk_size=chunk_size)
+    chunks = []
+    while chunk := list(islice(rows, chunk_size)):
+        chunks.append(np.array(chunk, dtype=object).reshape(len(chunk), len(fields)))
+    if not chunks:
+        return None
+    data = np.concatenate(chunks)
+    groups = {name: data[:, n] for n, name in enumerate(GROUPS)}
+    estimated_currency = data[:, len(GROUPS)].astype(str)
+    approved_currency = data[:, len(GROUPS) + 1]
+    approved_currency = np.where(approved_currency == np.array(None), estimated_currency, approved_currency).astype(str)
+    # None becomes NaN, Decimal becomes float; sums of cents stay exact far beyond any budget
+    amounts = data[:, len(GROUPS) + 2:].astype(float)
+    return groups, estimated_currency, approved_currency, amounts
+
+
+def _rate_vector(codes, currency, rates):
+    return np.array([float(rates.rate(code or currency, currency) or np.nan) for code in codes])
+
+
+def expense_rollup(expenses=None, currency="EUR", rates=None, chunk_size=CHUNK_SIZE):
+    """
+    Sum the expenses of ``expenses`` (by default all of requests that are not
+    canceled) in ``currency``, per event, per country and per budget.
+    """
+    rates = rates or rate_table
+    if expenses is None:
+        expenses = RequestExpense.objects.exclude(request__state=CANCELED_STATE)
+    result = Rollup(currency=currency)
+    loaded = _load(expenses, chunk_size)
+    if loaded is None:
+        result.groups = {name: [] for name in GROUPS}
+        result.totals = {column: Decimal("0.00") for column in COLUMNS}
+        return result
+    groups, estimated_currency, approved_currency, amounts = loaded
+    result.expenses = len(amounts)
+
+    converted = np.empty_like(amounts)
+    for n, (_, currency_field) in enumerate(COLUMNS.values()):
+        codes, inverse = np.unique(
+            estimated_currency if currency_field == "estimated_currency" else approved_currency, return_inverse=True)
+        rate = _rate_vector(codes, currency, rates)[inverse]
+        # rounded half up to cents per amount, like RateTable.convert
+        converted[:, n] = np.floor(amounts[:, n] * rate * 100 + 0.5) / 100
+        missing = np.isnan(rate) & ~np.isnan(amounts[:, n])
+        for code, count in zip(*np.unique(codes[inverse[missing]], return_counts=True)):
+            result.unconverted[str(code)] = result.unconverted.get(str(code), 0) + int(count)
+    converted = np.nan_to_num(converted)
+
+    result.totals = {column: _cents(total) for column, total in zip(COLUMNS, converted.sum(axis=0))}
+    for name, keys in groups.items():
+        keys = keys.astype(str if name == "country" else np.int64)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(unique))
+        sums = [np.bincount(inverse, weights=converted[:, n], minlength=len(unique)) for n in range(len(COLUMNS))]
+        labels = _labels(name, unique)
+        rows = [
+            {"key": key.item(), "label": labels.get(key.item(), ""), "expenses": int(counts[i]),
+             **{column: _cents(sums[n][i]) for n, column in enumerate(COLUMNS)}}
+            for i, key in enumerate(unique)
+        ]
+        result.groups[name] = sorted(rows, key=lambda row: row["approved"], reverse=True)
+    return result
+
+
+def _labels(name, keys):
+    if name == "country":
+        return {key: key or "-" for key in keys.tolist()}
+    model = Event if name == "event" else Budget
+    labels = {pk: label for pk, label in model.objects.filter(pk__in=keys.tolist()).values_list("pk", "name")}
+    labels.setdefault(0, "-")
+    return labels
+
+
+def write_csv(rollup, file, by="event"):
+    """One line per group of ``by``, amounts in the rollup's currency."""
+    writer = csv.writer(file)
+    writer.writerow([by, "expenses", *(f"{column} ({rollup.currency})" for column in COLUMNS)])
+    for row in rollup.groups.get(by, []):
+        writer.writerow([row["label"], row["expenses"], *(row[column] for column in COLUMNS)])
+    writer.writerow(["total", rollup.expenses, *(rollup.totals[column] for column in COLUMNS)])
+    if rollup.unconverted:
+        writer.writerow(["not converted", *(f"{code}: {n}" for code, n in sorted(rollup.unconverted.items()))])
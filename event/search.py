@@ -0,0 +1,179 @@
+"""
+Indexed type-ahead for the admin's ``autocomplete_fields``.
+
+Every model an autocomplete points at has an ``Index``. It names a few short text
+columns, never descriptions or audit diffs. Models without a name of their own
+instead list the indexed models whose matches lead to them: a request is found by
+its event or its user. ``manage.py setup_search`` builds the indexes:
+
+* PostgreSQL: ``pg_trgm`` GIN indexes on ``UPPER(column)``. These serve the
+  ``UPPER(...) LIKE UPPER('%term%')`` that ``icontains`` turns into, and prefixes.
+* SQLite: one FTS5 table per model with the trigram tokenizer, kept current by
+  triggers.
+
+Without those indexes, and for terms shorter than a trigram, matching falls back to
+prefixes. ``lookup`` returns at most the index's ``limit`` ids, newest first, and
+caches them for ``AUTOCOMPLETE_CACHE_SECONDS``.
+"""
+import hashlib
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.backends.utils import truncate_name
+from django.db.models import Q
+
+DEFAULT_LIMIT = 20
+MAX_TERM = 100
+TRIGRAM = 3
+
+
+@dataclass(frozen=True)
+class Index:
+    model: type
+    fields: tuple = ()
+    # lookup on ``model`` -> indexed model whose matches lead to it, e.g. {"event_id": Event}
+    via: dict = field(default_factory=dict)
+    limit: int = DEFAULT_LIMIT
+
+
+INDEXES = {}
+_fts_tables = {}  # db alias -> names of the FTS tables that exist
+
+
+def register(model, fields=(), via=None, limit=DEFAULT_LIMIT):
+    INDEXES[model] = Index(model, tuple(fields), dict(via or {}), limit)
+
+
+def register_defaults():
+    from django.contrib.auth import get_user_model
+
+    from . import models
+
+    user = get_user_model()
+    register(user, ("username", "email", "first_name", "last_name"))
+    register(models.Event, ("name",))
+    register(models.Budget, ("name",))
+    register(models.Role, ("name",))
+    register(models.PostalAddress, ("name", "line1", "city"))
+    register(models.Request, via={"event_id": models.Event, "user_id": user})
+    register(models.Reimbursement, via={"request__event_id": models.Event, "user_id": user})
+
+
+def fts_table(model):
+    return f"{model._meta.db_table}_search"
+
+
+def _has_fts(connection, model):
+    if connection.alias not in _fts_tables:
+        with connection.cursor() as cursor:
+            _fts_tables[connection.alias] = set(connection.introspection.table_names(cursor))
+    return fts_table(model) in _fts_tables[connection.alias]
+
+
+# ---------- Lookup ----------
+
+def lookup(model, term, limit=None):
+    """Ids of ``model`` matching ``term``, newest first; ``None`` if ``model`` has no index."""
+    index = INDEXES.get(model)
+    if index is None:
+        return None
+    limit = limit or index.limit
+    term = " ".join(term.split())[:MAX_TERM]
+    if not term:
+        return []
+    digest = hashlib.sha1(term.lower().encode()).hexdigest()
+    key = f"autocomplete:{model._meta.label_lower}:{limit}:{digest}"
+    ids = cache.get(key)
+    if ids is None:
+        ids = _lookup(index, term, limit)
+        cache.set(key, ids, getattr(settings, "AUTOCOMPLETE_CACHE_SECONDS", 30))
+    return ids
+
+
+def _lookup(index, term, limit):
+    manager = index.model._default_manager
+    ids = []
+    if term.isdigit() and manager.filter(pk=int(term)).exists():
+        ids.append(int(term))
+    if index.fields:
+        ids += _match(index, term, limit)
+    for path, related in index.via.items():
+        matched = lookup(related, term)
+        if matched:
+            ids += manager.filter(**{f"{path}__in": matched}).order_by("-pk").values_list("pk", flat=True)[:limit]
+    return sorted(set(ids), reverse=True)[:limit]
+
+
+def _match(index, term, limit):
+    alias = router.db_for_read(index.model)
+    connection = connections[alias]
+    if len(term) >= TRIGRAM and connection.vendor == "sqlite" and _has_fts(connection, index.model):
+        table = connection.ops.quote_name(fts_table(index.model))
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rowid DESC LIMIT %s",
+                           ['"' + term.replace('"', '""') + '"', limit])
+            return [row[0] for row in cursor.fetchall()]
+    # the trigram indexes serve both on PostgreSQL; elsewhere a prefix is all an index could help with
+    lookup_name = "icontains" if len(term) >= TRIGRAM and connection.vendor == "postgresql" else "istartswith"
+    matches = Q()
+    for name in index.fields:
+        matches |= Q(**{f"{name}__{lookup_name}": term})
+    return list(index.model._default_manager.using(alias).filter(matches)
+                .order_by("-pk").values_list("pk", flat=True)[:limit])
+
+
+# ---------- Setup ----------
+
+def _columns(connection, index):
+    return [connection.ops.quote_name(index.model._meta.get_field(name).column) for name in index.fields]
+
+
+def _setup_postgresql(connection, index, cursor):
+    table = index.model._meta.db_table
+    created = []
+    for name, column in zip(index.fields, _columns(connection, index)):
+        index_name = truncate_name(f"{table}_{name}_trgm", connection.ops.max_name_length())
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {connection.ops.quote_name(index_name)} "
+                       f"ON {connection.ops.quote_name(table)} USING gin (UPPER({column}::text) gin_trgm_ops)")
+        created.append(index_name)
+    return created
+
+
+def _setup_sqlite(connection, index, cursor):
+    quote = connection.ops.quote_name
+    table, fts = index.model._meta.db_table, fts_table(index.model)
+    pk = quote(index.model._meta.pk.column)
+    columns = _columns(connection, index)
+    listed = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {quote(fts)} USING fts5({listed}, "
+                   f"content={quote(table)}, content_rowid={pk}, tokenize='trigram')")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {quote(fts + '_ai')} AFTER INSERT ON {quote(table)} BEGIN "
+                   f"INSERT INTO {quote(fts)}(rowid, {listed}) VALUES (new.{pk}, {new}); END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {quote(fts + '_ad')} AFTER DELETE ON {quote(table)} BEGIN "
+                   f"INSERT INTO {quote(fts)}({quote(fts)}, rowid, {listed}) VALUES ('delete', old.{pk}, {old}); END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {quote(fts + '_au')} AFTER UPDATE ON {quote(table)} BEGIN "
+                   f"INSERT INTO {quote(fts)}({quote(fts)}, rowid, {listed}) VALUES ('delete', old.{pk}, {old}); "
+                   f"INSERT INTO {quote(fts)}(rowid, {listed}) VALUES (new.{pk}, {new}); END")
+    cursor.execute(f"INSERT INTO {quote(fts)}({quote(fts)}) VALUES ('rebuild')")
+    return [fts]
+
+
+def setup(using=None):
+    """Create the search indexes of every registered model; returns what was created or rebuilt."""
+    created = []
+    for model, index in INDEXES.items():
+        if not index.fields:
+            continue
+        connection = connections[using or router.db_for_write(model)]
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                created += _setup_postgresql(connection, index, cursor)
+            elif connection.vendor == "sqlite":
+                created += _setup_sqlite(connection, index, cursor)
+        _fts_tables.pop(connection.alias, None)
+    return created
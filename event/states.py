@@ -0,0 +1,216 @@
+"""
+State machines of ``Request`` and ``Reimbursement``.
+
+Each machine declares its states and events; an event moves an object from one of
+its source states to the target state, if its guard agrees::
+
+    request_machine.fire(request, "approve", user=request.user)
+    result = request_machine.bulk(event.requests.filter(state="submitted"), "approve", user=user)
+    result.changed, result.skipped  # {pk: reason} for the ones that could not move
+
+A transition locks the rows, re-checks their state, saves ``state``,
+``state_updated_at`` and a bumped ``lock_version`` with ``bulk_update`` (audited like
+any other change) and writes one ``StateChange`` per object, all in one transaction.
+``fire`` is ``bulk`` with one object, so a bulk transition costs the same fixed number
+of queries whether it moves one object or four hundred. ``state_changed`` is sent
+once the transaction commits.
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import QuerySet
+from django.dispatch import Signal
+from django.utils import timezone
+
+from . import tracking
+from .models import Reimbursement, Request, StateChange
+
+STATE_CHANGE_TYPE = "StateTransition"
+
+# sent with event, changes ([(instance, from_state)]), to_state and user after a transition committed
+state_changed = Signal()
+
+
+class TransitionNotAllowed(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Transition:
+    event: str
+    sources: tuple
+    target: str
+    # called with (instance, **context); a falsy result blocks the transition
+    guard: Optional[Callable] = None
+    # prefetch_related lookups the guard needs, loaded once for a whole bulk transition
+    prefetch: tuple = ()
+
+
+@dataclass
+class BulkResult:
+    changed: list = field(default_factory=list)
+    skipped: dict = field(default_factory=dict)  # pk -> reason
+    state_changes: list = field(default_factory=list)
+
+
+class Machine:
+
+    def __init__(self, model, states, transitions, initial=None, field="state", changed_at="state_updated_at"):
+        self.model = model
+        self.states = tuple(states)
+        self.initial = initial or self.states[0]
+        self.field = field
+        self.changed_at = changed_at
+        self.transitions = {}
+        for t in transitions:
+            unknown = {*t.sources, t.target} - set(self.states)
+            if unknown:
+                raise ValueError(f"{model.__name__}.{t.event}: unknown states {sorted(unknown)}")
+            self.transitions[t.event] = t
+        names = {f.name for f in model._meta.concrete_fields}
+        self.update_fields = [field, changed_at] + [name for name in ("updated_at", "lock_version") if name in names]
+        _machines[model] = self
+
+    def transition(self, event):
+        try:
+            return self.transitions[event]
+        except KeyError:
+            raise ValueError(f"{self.model.__name__} has no event {event!r}") from None
+
+    def state(self, instance):
+        return getattr(instance, self.field) or self.initial
+
+    def why_not(self, instance, event, **context):
+        """The reason ``event`` cannot happen to ``instance`` now, or ``None`` if it can."""
+        t = self.transition(event)
+        state = self.state(instance)
+        if state not in t.sources:
+            return f"{event} is not possible from {state}"
+        if t.guard is not None and not t.guard(instance, **context):
+            return f"{event}: {getattr(t.guard, '__doc__', None) or t.guard.__name__}".strip()
+        return None
+
+    def can(self, instance, event, **context):
+        return self.why_not(instance, event, **context) is None
+
+    def events(self, instance, **context):
+        """Events that are possible for ``instance`` right now."""
+        return [event for event in self.transitions if self.can(instance, event, **context)]
+
+    def fire(self, instance, event, *, user=None, notes=None, **context):
+        """Move ``instance`` through ``event``; returns the ``StateChange`` or raises ``TransitionNotAllowed``."""
+        result = self.bulk([instance], event, user=user, notes=notes, **context)
+        if not result.state_changes:
+            raise TransitionNotAllowed(result.skipped.get(instance.pk, f"{instance} is not saved"))
+        return result.state_changes[0]
+
+    def bulk(self, objects, event, *, user=None, notes=None, **context):
+        """
+        Move every object of ``objects`` (a queryset or instances) that can go through
+        ``event``; the others are reported in ``skipped``. Instances passed in are
+        updated in place.
+        """
+        t = self.transition(event)
+        given = {}
+        if isinstance(objects, QuerySet):
+            rows = objects
+        else:
+            given = {obj.pk: obj for obj in objects}
+            rows = self.model.objects.filter(pk__in=list(given))
+        result = BulkResult()
+        now = timezone.now()
+        with transaction.atomic():
+            # locked in primary key order, so concurrent bulk transitions cannot deadlock
+            locked = rows.select_for_update(of=("self",)).order_by("pk")
+            if t.prefetch:
+                locked = locked.prefetch_related(*t.prefetch)
+            moved = []
+            for instance in locked:
+                reason = self.why_not(instance, event, **context)
+                if reason:
+                    result.skipped[instance.pk] = reason
+                    continue
+                moved.append((instance, self.state(instance)))
+                setattr(instance, self.field, t.target)
+                setattr(instance, self.changed_at, now)
+                if "updated_at" in self.update_fields:
+                    instance.updated_at = now
+                if "lock_version" in self.update_fields:
+                    # the row is locked, so this is the stored version; edits made against the old one conflict
+                    instance.lock_version += 1
+            if not moved:
+                return result
+            self.model.objects.bulk_update([instance for instance, _ in moved], self.update_fields)
+            content_type = ContentType.objects.get_for_model(self.model)
+            result.state_changes = StateChange.objects.bulk_create([
+                StateChange(machine_content_type=content_type, machine_object_id=instance.pk, state_event=event,
+                            from_state=from_state or "", to_state=t.target, user=user, notes=notes,
+                            created_at=now, updated_at=now, type=STATE_CHANGE_TYPE)
+                for instance, from_state in moved
+            ])
+            for instance, _ in moved:
+                caller = given.get(instance.pk)
+                if caller is not None:
+                    saved = tracking.saved_values(caller)
+                    for name in self.update_fields:
+                        setattr(caller, name, getattr(instance, name))
+                        saved[name] = getattr(instance, name)
+                result.changed.append(caller or instance)
+            transaction.on_commit(lambda: state_changed.send(
+                sender=self.model, event=event, changes=moved, to_state=t.target, user=user,
+            ))
+        return result
+
+
+_machines = {}
+
+
+def machine_for(model_or_instance):
+    model = model_or_instance if isinstance(model_or_instance, type) else type(model_or_instance)
+    return _machines[model]
+
+
+def fire(instance, event, **kwargs):
+    return machine_for(instance).fire(instance, event, **kwargs)
+
+
+# ---------- Requests ----------
+
+def _expenses_approved(request, **context):
+    """every expense needs an approved amount"""
+    expenses = list(request.expenses.all())
+    return bool(expenses) and all(expense.approved_amount is not None for expense in expenses)
+
+
+request_machine = Machine(
+    Request,
+    states=("incomplete", "submitted", "approved", "accepted", "canceled"),
+    transitions=[
+        Transition("submit", ("incomplete",), "submitted"),
+        Transition("approve", ("submitted",), "approved", guard=_expenses_approved, prefetch=("expenses",)),
+        Transition("accept", ("approved",), "accepted"),
+        Transition("roll_back", ("submitted", "approved"), "incomplete"),
+        Transition("cancel", ("incomplete", "submitted", "approved", "accepted"), "canceled"),
+    ],
+)
+
+
+# ---------- Reimbursements ----------
+
+reimbursement_machine = Machine(
+    Reimbursement,
+    states=("incomplete", "submitted", "approved", "processed", "payed", "canceled"),
+    transitions=[
+        Transition("submit", ("incomplete",), "submitted"),
+        Transition("approve", ("submitted",), "approved"),
+        # a Wise transfer was created for it (see event.payouts)
+        Transition("process", ("approved",), "processed"),
+        # Wise reports the transfer as paid out, or as failed / returned (see event.transfers)
+        Transition("confirm", ("processed",), "payed"),
+        Transition("payout_failed", ("processed", "payed"), "approved"),
+        Transition("roll_back", ("submitted", "approved"), "incomplete"),
+        Transition("cancel", ("incomplete", "submitted", "approved"), "canceled"),
+    ],
+)
@@ -0,0 +1,97 @@
+"""
+Background jobs of the event app (run by ``manage.py jobworker``).
+
+Anything slow or talking to an outside service is enqueued from the request path,
+e.g. ``payout_event.delay(event.pk, user_id=request.user.pk)``.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+from django.urls import reverse
+
+from .jobs import task
+
+logger = logging.getLogger(__name__)
+
+
+@task(queue="payouts", max_attempts=1)
+def payout_event(event_id, user_id=None, **options):
+    """Pay out an event; never retried automatically, a second run is a decision for a person."""
+    from .models import Event
+    from .payouts import settle_event
+
+    user = User.objects.filter(pk=user_id).first() if user_id else None
+    settle_event(Event.objects.get(pk=event_id), user=user, **options)
+
+
+@task(queue="payouts")
+def sync_wise_ledger(profile_id=None):
+    from . import ledger
+    from .wise import get_client
+
+    profile_id = int(profile_id or settings.WISE_PROFILE_ID)
+    ledger.sync_balances(get_client(), profile_id)
+    ledger.sync_activities(get_client(), profile_id)
+
+
+@task(max_attempts=3, every=timedelta(hours=1))
+def refresh_rates():
+    """Store the current Wise rates, which every process's ``rate_table`` reads (see ``event.wise.rates``)."""
+    from .wise import get_client, rate_table
+
+    logger.info("refreshed %d currency rates", rate_table.refresh(get_client()))
+
+
+@task(max_attempts=3)
+def archive_audits():
+    from . import archive
+
+    archive.run()
+
+
+@task(max_attempts=3, every=timedelta(days=1))
+def reconcile_budgets():
+    from . import budgets
+
+    drift = budgets.reconcile()
+    if drift:
+        logger.warning("budget totals drifted and were repaired: %s", sorted(drift))
+
+
+@task(max_attempts=1)
+def export_rows(selection, fmt, user_id):
+    """Write an export too big to stream from the admin for user ``user_id`` and mail them its link."""
+    from . import exports, jobs
+
+    selection = jobs.Selection.load(selection)
+    name = exports.save(selection, fmt, user_id)
+    logger.info("exported %s for user %s to %s", selection.model._meta.label, user_id, name)
+    user = User.objects.filter(pk=user_id).first()
+    if user is not None and user.email:
+        url = settings.SITE_URL.rstrip("/") + reverse("event:download_export", args=[name])
+        send_email.delay("Your export is ready", f"Download it from {url} (you need to be logged in).",
+                         [user.email])
+
+
+@task
+def bulk_action(selection, operation, user_id, options=None):
+    """A bulk admin action on a selection too large for the request; safe to retry, done rows are skipped."""
+    from . import audit, bulk, jobs
+
+    selection = jobs.Selection.load(selection)
+    user = User.objects.filter(pk=user_id).first()
+    with audit.audit_context(user=user, comment=f"bulk {operation}"):
+        outcome = bulk.run_selection(selection, operation, user=user, **(options or {}),
+                                     progress=lambda outcome: jobs.report_progress(f"{outcome.done} / {outcome.total}"))
+    what = f"{(options or {}).get('event', operation).replace('_', ' ')} of {selection.model._meta.verbose_name_plural}"
+    logger.info("bulk %s: %s", what, outcome)
+    if user is not None and user.email:
+        send_email.delay(f"Bulk {what} finished", f"{outcome}.", [user.email])
+
+
+@task(queue="mail")
+def send_email(subject, message, recipient_list, from_email=None, html_message=None):
+    send_mail(subject, message, from_email, recipient_list, html_message=html_message)
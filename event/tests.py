@@ -1,3 +1,734 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (admin, approvals, archive, audit, budgets, counters, exports, jobs, reports, states, tasks,
+               transfers)
+from .models import (Audit, AuditChange, Budget, CurrencyRate, DelayedJob, Event, JobStat, Payment, Reimbursement,
+                     Request, RequestExpense, StateChange)
+from .payouts import PayoutEngine, PayoutItem
+from .wise.fake import FakeWise
+from .wise.rates import RateTable
+
+
+def make_request(state="submitted", user=None, event=None, expenses=(), **kwargs):
+    """A request of ``event`` (a new one by default) with one expense per ``(estimated, approved)`` pair."""
+    user = user or User.objects.get_or_create(username="attendee", defaults={"email": "attendee@example.org"})[0]
+    if event is None:
+        budget = Budget.objects.create(name="budget", amount=Decimal("1000"), currency="EUR")
+        event = Event.objects.create(name="conference", budget=budget, country_code="DE")
+    request = Request.objects.create(user=user, event=event, state=state, **kwargs)
+    for estimated, approved in expenses:
+        RequestExpense.objects.create(request=request, subject="travel", estimated_amount=estimated,
+                                      estimated_currency="EUR", approved_amount=approved,
+                                      approved_currency="EUR" if approved is not None else None)
+    return request
+
+
+# ---------- Payouts ----------
+
+class PayoutRecipientTests(TestCase):
+
+    def item(self, recipient_id=None):
+        return PayoutItem(reimbursement_id=1, amount=Decimal("10"), currency="EUR", holder="Attendee",
+                          recipient_type="iban", details={"legalType": "PRIVATE", "iban": "BE00000000000001"},
+                          reference="TSP test", recipient_id=recipient_id)
+
+    def pay(self, fake, item):
+        async def run():
+            async with fake.async_client() as client:
+                return await PayoutEngine(client, fake.profile_id, fund=False, batch_groups=False).pay(item)
+        return asyncio.run(run())
+
+    def test_deleted_recipient_is_recreated(self):
+        fake = FakeWise()
+        result = self.pay(fake, self.item(recipient_id=424242))
+        self.assertTrue(result.ok)
+        self.assertEqual(result.stale_recipient_id, 424242)
+        self.assertTrue(result.recipient_created)
+        self.assertIn(result.recipient_id, fake.recipients)
+
+    def test_other_rejections_keep_the_recipient(self):
+        fake = FakeWise(fail={"POST /v1/transfers": 422})
+        result = self.pay(fake, self.item(recipient_id=424242))
+        self.assertFalse(result.ok)
+        self.assertIsNone(result.stale_recipient_id)
+        self.assertFalse(result.recipient_created)
+        self.assertEqual(fake.calls["POST /v1/accounts"], 0)
+
+
+class BatchGroupTests(TestCase):
+
+    def run_engine(self, fake):
+        items = [PayoutItem(reimbursement_id=n, amount=Decimal("10"), currency="EUR", holder=f"Attendee {n}",
+                            recipient_type="iban", details={"legalType": "PRIVATE", "iban": f"BE0000000000000{n}"},
+                            reference=f"TSP {n}") for n in (1, 2)]
+
+        async def run():
+            async with fake.async_client() as client:
+                return await PayoutEngine(client, fake.profile_id, rates=RateTable(fallback={})).run(items)
+        return asyncio.run(run())
+
+    def test_group_is_funded_once(self):
+        fake = FakeWise()
+        results = self.run_engine(fake)
+        self.assertTrue(all(r.ok and r.funded for r in results))
+        [group] = fake.batch_groups.values()
+        self.assertEqual((group["status"], len(group["transferIds"])), ("COMPLETED", 2))
+
+    def test_group_without_payouts_is_cancelled(self):
+        fake = FakeWise(fail={"POST /v1/accounts": 422})
+        results = self.run_engine(fake)
+        self.assertFalse(any(r.ok for r in results))
+        [group] = fake.batch_groups.values()
+        self.assertEqual(group["status"], "CANCELLED")
+
+
+class FakeWiseTests(TestCase):
+
+    def test_transfers_are_idempotent_by_customer_transaction_id(self):
+        fake = FakeWise()
+        client = fake.client()
+        recipient = client.create_recipient(fake.profile_id, currency="EUR", account_holder_name="Attendee",
+                                            recipient_type="iban", details={"legalType": "PRIVATE",
+                                                                            "iban": "BE00000000000001"})
+        created = []
+        for _ in range(2):
+            quote = client.create_quote(fake.profile_id, source_currency="EUR", target_currency="EUR",
+                                        target_amount=10)
+            created.append(client.create_transfer(target_account_id=recipient["id"], quote_uuid=quote["id"],
+                                                  customer_transaction_id="tsp-1", reference="TSP test"))
+        self.assertEqual(created[0]["id"], created[1]["id"])
+        self.assertEqual(len(fake.transfers), 1)
+
+# ---------- Transfer status ----------
+
+class WebhookTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.public_pem = cls.key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    def sign(self, body):
+        return base64.b64encode(self.key.sign(body, padding.PKCS1v15(), hashes.SHA256())).decode()
+
+    def test_signature(self):
+        body = b'{"event_type": "transfers#state-change"}'
+        self.assertTrue(transfers.verify_signature(body, self.sign(body), self.public_pem))
+        self.assertFalse(transfers.verify_signature(body + b" ", self.sign(body), self.public_pem))
+        self.assertFalse(transfers.verify_signature(body, "", self.public_pem))
+        self.assertFalse(transfers.verify_signature(body, "not base64!", self.public_pem))
+
+    def test_state_change_confirms_the_reimbursement_once(self):
+        request = make_request(state="accepted")
+        reimbursement = Reimbursement.objects.create(user=request.user, request=request, state="processed")
+        Payment.objects.create(reimbursement=reimbursement, method="wise", code="77", amount=Decimal("10"),
+                               currency="EUR")
+        payload = {"event_type": "transfers#state-change",
+                   "data": {"resource": {"type": "transfer", "id": 77}, "current_state": "outgoing_payment_sent"}}
+        for _ in range(2):
+            transfers.handle_webhook(json.loads(json.dumps(payload)))
+        reimbursement.refresh_from_db()
+        self.assertEqual(reimbursement.state, "payed")
+        self.assertEqual(Payment.objects.get(code="77").status, "outgoing_payment_sent")
+        self.assertEqual(StateChange.objects.filter(machine_object_id=reimbursement.pk).count(), 1)
+
+    def test_unknown_transfer_is_ignored(self):
+        self.assertIsNone(transfers.apply_transfer_status("404", "outgoing_payment_sent"))
+
+
+class TransferPollerTests(TestCase):
+
+    def test_one_client_for_every_tick(self):
+        fake = FakeWise()
+        clients = []
+
+        def client_factory():
+            clients.append(fake.async_client())
+            return clients[-1]
+
+        poller = transfers.TransferPoller(min_interval=0, max_interval=0, client_factory=client_factory)
+        poller.track("1")
+        poller.track("2")
+        try:
+            self.assertEqual(poller.tick(), 2)
+            self.assertEqual(poller.tick(), 2)
+        finally:
+            poller.close()
+        self.assertEqual(len(clients), 1)
+        self.assertEqual(fake.calls["GET /v1/transfers/{id}"], 4)
+
+    def test_network_errors_reschedule_the_transfer(self):
+        class Unreachable:
+            async def get_transfer(self, transfer_id):
+                raise httpx.ConnectError("connection refused")
+
+            async def aclose(self):
+                pass
+
+        poller = transfers.TransferPoller(min_interval=0, max_interval=0, client_factory=Unreachable)
+        poller.track("1")
+        try:
+            with self.assertLogs("event.transfers", "WARNING"):
+                self.assertEqual(poller.tick(), 1)
+            self.assertEqual(poller.due(), ["1"])
+        finally:
+            poller.close()
+
+
+# ---------- Budget totals ----------
+
+class BudgetTotalTests(TestCase):
+
+    def amounts(self, estimated, approved, authorized=0, paid=0):
+        return {"EUR": {"estimated": Decimal(estimated), "approved": Decimal(approved),
+                        "authorized": Decimal(authorized), "paid": Decimal(paid)}}
+
+    def test_totals_follow_expenses_payments_and_cancels(self):
+        request = make_request(expenses=[("100", "80"), ("50", None)])
+        budget, event = request.event.budget, request.event
+        self.assertEqual(budgets.totals(event=event), self.amounts("150", "80"))
+        self.assertEqual(budgets.totals(budget=budget), self.amounts("150", "80"))
+        reimbursement = Reimbursement.objects.create(user=request.user, request=request, state="approved")
+        payment = Payment.objects.create(reimbursement=reimbursement, amount=Decimal("30"), currency="EUR")
+        self.assertEqual(budgets.totals(budget=budget), self.amounts("150", "80", paid="30"))
+        payment.status = "bounced_back"
+        payment.save()
+        self.assertEqual(budgets.totals(budget=budget), self.amounts("150", "80"))
+        self.assertEqual(budgets.position(budget)["available"], Decimal("920"))
+        states.request_machine.bulk(Request.objects.filter(pk=request.pk), "cancel")
+        self.assertEqual(budgets.totals(budget=budget), self.amounts("0", "0"))
+        self.assertEqual(budgets.reconcile(), {})
+
+    def test_reconcile_repairs_updates_without_signals(self):
+        request = make_request(expenses=[("100", "80")])
+        RequestExpense.objects.filter(request=request).update(approved_amount=Decimal("90"))  # no signals
+        drift = budgets.reconcile(dry_run=True)
+        self.assertEqual(set(drift), {("event", request.event_id, "EUR"), ("budget", request.event.budget_id, "EUR")})
+        self.assertEqual(budgets.totals(event=request.event), self.amounts("100", "80"))
+        self.assertEqual(budgets.reconcile(), drift)
+        self.assertEqual(budgets.totals(event=request.event), self.amounts("100", "90"))
+        self.assertEqual(budgets.reconcile(), {})
+
+
+# ---------- Reports ----------
+
+class ExpenseReportTests(TestCase):
+
+    def setUp(self):
+        request = make_request(expenses=[("100", "80")])
+        self.event = request.event
+        self.other = Event.objects.create(name="meetup", budget=self.event.budget, country_code="GB")
+        gbp = make_request(event=self.other)
+        RequestExpense.objects.create(request=gbp, subject="hotel", estimated_amount=Decimal("50"),
+                                      estimated_currency="GBP", approved_amount=Decimal("40.01"),
+                                      approved_currency="GBP")
+        RequestExpense.objects.create(request=gbp, subject="visa", estimated_amount=Decimal("10"),
+                                      estimated_currency="XAF")
+        make_request(event=self.event, state="canceled", expenses=[("999", "999")])
+
+    def test_mixed_currencies_are_converted_and_grouped(self):
+        rollup = reports.expense_rollup(rates=RateTable(fallback={"EUR": 1, "GBP": "0.5"}))
+        self.assertEqual(rollup.expenses, 3)
+        self.assertEqual(rollup.totals["estimated"], Decimal("200.00"))
+        self.assertEqual(rollup.totals["approved"], Decimal("160.02"))
+        self.assertEqual(rollup.unconverted, {"XAF": 1})
+        self.assertEqual([(row["label"], row["approved"]) for row in rollup.groups["event"]],
+                         [("meetup", Decimal("80.02")), ("conference", Decimal("80.00"))])
+        self.assertEqual([(row["key"], row["expenses"]) for row in rollup.groups["country"]], [("GB", 2), ("DE", 1)])
+        self.assertEqual(len(rollup.groups["budget"]), 1)
+        out = io.StringIO()
+        reports.write_csv(rollup, out, by="country")
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "country,expenses,estimated (EUR),approved (EUR),total (EUR),authorized (EUR)")
+        self.assertEqual(lines[-2:], ["total,3,200.00,160.02,0.00,0.00", "not converted,XAF: 1"])
+
+    def test_ids_must_be_integers(self):
+        self.client.force_login(User.objects.create_user("staff", is_staff=True))
+        for name in ("event:expense_report", "event:expense_report_csv"):
+            self.assertEqual(self.client.get(reverse(name), {"event": "abc"}).status_code, 400)
+            self.assertEqual(self.client.get(reverse(name), {"budget": ["1", "x"]}).status_code, 400)
+        response = self.client.get(reverse("event:expense_report"), {"event": self.event.pk})
+        self.assertEqual(response.json()["labels"], ["conference"])
+
+
+# ---------- Currency rates ----------
+
+class RateTableTests(TestCase):
+
+    def test_refreshed_rates_reach_other_processes(self):
+        fake = FakeWise()
+        self.assertGreater(RateTable(fallback={}).refresh(fake.client()), 0)
+        other = RateTable(fallback={})
+        self.assertEqual(other.rate("EUR", "GBP"), CurrencyRate.objects.get(source="EUR", target="GBP").rate)
+
+    def test_stale_rates_fall_back(self):
+        CurrencyRate.objects.create(source="EUR", target="GBP", rate=Decimal("0.5"),
+                                    fetched_at=timezone.now() - timedelta(days=1))
+        rates = RateTable(fallback={"EUR": 1, "GBP": "0.86"})
+        self.assertEqual(rates.convert(Decimal("100"), "EUR", "GBP"), Decimal("86.00"))
+        self.assertIsNone(rates.convert(Decimal("100"), "EUR", "CHF"))
+
+
+# ---------- Jobs ----------
+
+@jobs.task(name="tests.fail", max_attempts=2)
+def fail(message):
+    raise ValueError(message)
+
+
+class WorkerTests(TestCase):
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        first, second = tasks.send_email.delay("a", "b", ["x@example.org"]), fail.delay("boom")
+        self.assertEqual(jobs.claim("one", queues=["mail"]), [first])
+        self.assertEqual(jobs.claim("two", queues=["mail", "default"]), [second])
+        self.assertEqual(jobs.claim("three"), [])
+        # a lock older than max_run_time was left by a dead worker
+        self.assertEqual(jobs.claim("three", max_run_time=timedelta(0)), [first, second])
+        self.assertEqual(jobs.perform(first.pk, "one"), ("lost", 0.0))
+
+    def test_failures_back_off_then_give_up(self):
+        job = fail.delay("boom")
+        jobs.claim("worker")
+        with self.assertLogs("event.jobs", "ERROR"):
+            self.assertEqual(jobs.perform(job.pk, "worker")[0], "failed")
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.locked_by, job.failed_at), (1, None, None))
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + jobs.backoff(1) - timedelta(seconds=1))
+        self.assertEqual(jobs.claim("worker"), [])
+        DelayedJob.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        jobs.claim("worker")
+        with self.assertLogs("event.jobs", "ERROR"):
+            jobs.perform(job.pk, "worker")
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNotNone(job.failed_at)
+        self.assertEqual(jobs.claim("worker"), [])
+
+    def test_succeeded_jobs_are_deleted(self):
+        job = tasks.send_email.delay("subject", "message", ["attendee@example.org"])
+        jobs.claim("worker", queues=["mail"])
+        self.assertEqual(jobs.perform(job.pk, "worker")[0], "succeeded")
+        self.assertFalse(DelayedJob.objects.filter(pk=job.pk).exists())
+
+
+class PeriodicJobTests(TestCase):
+
+    def run_job(self, job):
+        DelayedJob.objects.filter(pk=job.pk).update(locked_by="test", locked_at=timezone.now())
+        return jobs.perform(job.pk, "test")[0]
+
+    def test_refresh_rates_is_enqueued_once_and_reschedules_itself(self):
+        self.assertIn("event.tasks.refresh_rates", jobs.schedule_periodic(["default"]))
+        self.assertNotIn("event.tasks.refresh_rates", jobs.schedule_periodic(["default"]))
+        job = jobs.waiting("event.tasks.refresh_rates").get()
+        with mock.patch("event.wise.get_client", return_value=FakeWise().client()):
+            self.assertEqual(self.run_job(job), "succeeded")
+        self.assertTrue(CurrencyRate.objects.exists())
+        following = jobs.waiting("event.tasks.refresh_rates").get()
+        self.assertGreater(following.run_at, timezone.now() + timedelta(minutes=59))
+
+
+# ---------- Dashboards ----------
+
+class JobDashboardTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user("staff", is_staff=True))
+
+    def minutes(self, value):
+        response = self.client.get(reverse("event:job_dashboard"), {"minutes": value})
+        self.assertEqual(response.status_code, 200)
+        return len(response.json()["minutes"])
+
+    def test_minutes_are_parsed_and_clamped(self):
+        self.assertEqual(self.minutes("15"), 15)
+        self.assertEqual(self.minutes("soon"), 60)
+        self.assertEqual(self.minutes("-5"), 1)
+        self.assertEqual(self.minutes("100000"), 24 * 60)
+
+    def test_processed_jobs_are_a_gauge_over_the_last_hour(self):
+        now = timezone.now().replace(second=0, microsecond=0)
+        JobStat.objects.create(minute=now, queue="mail", succeeded=3, failed=1)
+        JobStat.objects.create(minute=now - timedelta(hours=2), queue="mail", succeeded=50)
+        response = self.client.get(reverse("event:job_metrics"))
+        self.assertContains(response, "# TYPE tsp_jobs_processed_last_hour gauge")
+        self.assertContains(response, 'tsp_jobs_processed_last_hour{queue="mail",priority="0",outcome="succeeded"} 3\n')
+        self.assertNotContains(response, "tsp_jobs_processed_total")
+
+
+# ---------- Audits ----------
+
+class AuditTests(TestCase):
+
+    def audits(self, obj):
+        return list(Audit.objects.filter(auditable_object_id=obj.pk, auditable_content_type__model=obj._meta.model_name)
+                    .order_by("version").values_list("action", "version"))
+
+    def test_audits_of_a_transaction_are_written_once_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                budget = Budget.objects.create(name="budget", amount=Decimal("1000"), currency="EUR")
+                budget.amount = Decimal("1200")
+                budget.save()
+                Budget.objects.filter(pk=budget.pk).first().save()  # nothing changed, nothing audited
+                self.assertFalse(Audit.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.audits(budget), [("create", 1), ("update", 2)])
+
+    def test_audits_of_a_rolled_back_savepoint_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                budget = Budget.objects.create(name="budget", amount=Decimal("1000"), currency="EUR")
+                try:
+                    with transaction.atomic():
+                        budget.name = "renamed"
+                        budget.save()
+                        raise ValueError
+                except ValueError:
+                    pass
+        self.assertEqual(self.audits(budget), [("create", 1)])
+
+    def test_versions_continue_across_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            budget = Budget.objects.create(name="budget", amount=Decimal("1000"), currency="EUR")
+        # a transaction of its own: executed callbacks stay registered in captureOnCommitCallbacks
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            budget.name = "renamed"
+            budget.save()
+            budget.name = "again"
+            budget.save()
+        self.assertEqual(self.audits(budget), [("create", 1), ("update", 2), ("update", 3)])
+
+
+    def test_field_history_reads_the_change_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            budget = Budget.objects.create(name="budget", amount=Decimal("1000"), currency="EUR")
+            budget.name, budget.amount = "renamed", Decimal("5")
+            budget.save()
+            budget.amount = Decimal("6")
+            budget.save()
+        self.assertEqual(AuditChange.objects.filter(object_id=budget.pk, field="name").count(), 2)
+        history = audit.field_history(Budget, budget.pk, "name")
+        self.assertEqual([(entry["version"], entry["old"], entry["new"]) for entry in history],
+                         [(2, "budget", "renamed"), (1, None, "budget")])
+
+    def test_large_changes_are_compressed(self):
+        changes = {"description": ["x" * 2000, "y" * 2000]}
+        encoded = audit.encode_changes(changes)
+        self.assertTrue(encoded.startswith(audit.COMPRESSED_PREFIX))
+        self.assertEqual(audit.decode_changes(encoded), changes)
+        self.assertEqual(audit.decode_changes(audit.encode_changes({"a": [1, 2]})), {"a": [1, 2]})
+
+
+# ---------- Audit archive ----------
+
+class AuditArchiveTests(TestCase):
+
+    def test_expired_months_are_exported_then_dropped(self):
+        old = timezone.now() - timedelta(days=3 * 366)
+        Audit.objects.bulk_create([Audit(action="update", version=n, created_at=old) for n in (1, 2, 3)])
+        with tempfile.TemporaryDirectory() as root, override_settings(AUDIT_ARCHIVE_ROOT=root):
+            summary = archive.run(retention_months=24, hot_months=3)
+            self.assertEqual(summary["archived"], 3)
+            [path] = summary["files"]
+            self.assertEqual(os.path.dirname(path), root)
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                versions = [json.loads(line)["version"] for line in f]
+        self.assertEqual(versions, [1, 2, 3])
+        self.assertFalse(Audit.objects.exists())
+        self.assertEqual(archive.month_tables(Audit), {})
+
+
+# ---------- Approvals ----------
+
+class ApprovalTests(TestCase):
+
+    def setUp(self):
+        self.request = make_request(expenses=[(Decimal("300"), None), (Decimal("200"), None)])
+        self.first, self.second = self.request.expenses.order_by("pk")
+        self.rates = RateTable(fallback={"EUR": 1, "GBP": "0.5"})
+
+    def approve(self, amounts, versions=None):
+        return approvals.approve(self.request, amounts, rates=self.rates,
+                                 versions=versions or {pk: 0 for pk in amounts})
+
+    def test_approval_within_the_budget(self):
+        self.approve({self.first.pk: Decimal("300"), self.second.pk: (Decimal("100"), "GBP")})
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.approved_amount, self.first.lock_version), (Decimal("300"), 1))
+        self.assertEqual(budgets.position(self.request.event.budget, self.rates)["available"], Decimal("500"))
+
+    def test_over_the_budget_nothing_is_saved(self):
+        with self.assertRaises(budgets.BudgetExceeded):
+            self.approve({self.first.pk: Decimal("900"), self.second.pk: (Decimal("100"), "GBP")})
+        self.assertFalse(RequestExpense.objects.filter(approved_amount__isnull=False).exists())
+        self.assertEqual(RequestExpense.objects.filter(lock_version=0).count(), 2)
+
+    def test_stale_version_conflicts(self):
+        self.approve({self.first.pk: Decimal("100")})
+        with self.assertRaises(approvals.ApprovalConflict) as caught:
+            self.approve({self.first.pk: Decimal("250")})
+        self.assertEqual(caught.exception.stale, [("requestexpense", self.first.pk, 0, 1)])
+
+    def test_amounts_without_a_rate_are_refused(self):
+        with self.assertRaises(budgets.UnknownRate):
+            self.approve({self.first.pk: (Decimal("1"), "XAF")})
+        self.first.refresh_from_db()
+        self.assertIsNone(self.first.approved_amount)
+
+    def test_unconverted_totals_refuse_further_approvals(self):
+        RequestExpense.objects.create(request=self.request, subject="visa", approved_amount=Decimal("5000"),
+                                      approved_currency="XAF")
+        with self.assertRaises(budgets.UnknownRate) as caught:
+            self.approve({self.first.pk: Decimal("10")})
+        self.assertEqual(caught.exception.currencies, ["XAF"])
+
+
+class ApprovalAdminTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.org", "x"))
+        self.expense = make_request(expenses=[(Decimal("300"), None)]).expenses.get()
+        self.url = reverse("admin:event_requestexpense_change", args=[self.expense.pk])
+
+    def post(self, approved_amount, lock_version=0, **fields):
+        data = {"request": self.expense.request_id, "subject": "travel", "estimated_amount": "300",
+                "estimated_currency": "EUR", "approved_amount": approved_amount, "approved_currency": "EUR",
+                "lock_version": lock_version, **fields}
+        return self.client.post(self.url, data)
+
+    def test_approval_goes_through_approvals(self):
+        self.assertContains(self.client.get(self.url), 'name="lock_version" value="0"')
+        self.assertRedirects(self.post("250"), reverse("admin:event_requestexpense_changelist"))
+        self.expense.refresh_from_db()
+        self.assertEqual((self.expense.approved_amount, self.expense.lock_version), (Decimal("250"), 1))
+
+    def test_conflicts_and_budget_are_form_errors(self):
+        RequestExpense.objects.filter(pk=self.expense.pk).update(lock_version=1)
+        response = self.post("250")
+        self.assertContains(response, "changed by someone else")
+        response = self.post("5000", lock_version=1)
+        self.assertContains(response, "needed")
+        self.expense.refresh_from_db()
+        self.assertIsNone(self.expense.approved_amount)
+
+    def test_lost_race_saves_nothing(self):
+        conflict = approvals.ApprovalConflict([("requestexpense", self.expense.pk, 0, 1)])
+        with mock.patch("event.approvals.approve_expense", side_effect=conflict):
+            response = self.post("250", subject="renamed")
+        self.assertRedirects(response, self.url)
+        self.expense.refresh_from_db()
+        self.assertEqual((self.expense.subject, self.expense.approved_amount), ("travel", None))
+
+
+    def test_request_form_does_not_write_the_version_back(self):
+        request = self.expense.request
+        Request.objects.filter(pk=request.pk).update(lock_version=3)
+        url = reverse("admin:event_request_change", args=[request.pk])
+        page = self.client.get(url)
+        self.assertNotIn("lock_version", page.context["adminform"].form.fields)
+        data = {"state": "submitted", "user": request.user_id, "event": request.event_id, "description": "changed",
+                "lock_version": 0}
+        for inline in page.context["inline_admin_formsets"]:
+            prefix = inline.formset.prefix
+            data |= {f"{prefix}-TOTAL_FORMS": 0, f"{prefix}-INITIAL_FORMS": 0}
+        self.assertRedirects(self.client.post(url, data), reverse("admin:event_request_changelist"))
+        request.refresh_from_db()
+        self.assertEqual((request.description, request.lock_version), ("changed", 3))
+
+# ---------- Admin changelists ----------
+
+class KeysetChangeListTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.org", "x"))
+        now = timezone.now()
+        # three audits share a timestamp, so pages must break the tie by pk
+        Audit.objects.bulk_create([Audit(action="update", created_at=now - timedelta(minutes=minutes))
+                                   for minutes in (0, 1, 1, 1, 2)])
+        self.url = reverse("admin:event_audit_changelist")
+
+    def changelist(self, query=""):
+        with mock.patch.object(admin.AuditAdmin, "list_per_page", 2):
+            response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"]
+
+    def test_pages_seek_past_the_last_row(self):
+        expected = list(Audit.objects.order_by("-created_at", "-pk").values_list("pk", flat=True))
+        seen, query = [], ""
+        while True:
+            cl = self.changelist(query)
+            self.assertTrue(cl.keyset)
+            seen += [row.pk for row in cl.result_list]
+            if cl.next_page_link is None:
+                break
+            query = cl.next_page_link
+        self.assertEqual(seen, expected)
+        self.assertEqual(cl.first_page_link, "?")
+
+    def test_sorting_by_a_column_uses_numbered_pages(self):
+        cl = self.changelist("?o=2")
+        self.assertFalse(cl.keyset)
+        self.assertEqual(cl.paginator.num_pages, 3)
+
+    def test_unknown_anchor_is_rejected(self):
+        with mock.patch.object(admin.AuditAdmin, "list_per_page", 2):
+            self.assertRedirects(self.client.get(self.url + "?after=999999"), self.url + "?e=1",
+                                 fetch_redirect_response=False)
+
+
+# ---------- Exports ----------
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user("staff", "staff@example.org", is_staff=True)
+        event = make_request().event
+        for n in range(5):
+            make_request(event=event, visa_letter=n % 2 == 0)
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(EXPORT_ROOT=self.root, SITE_URL="https://tsp.example.org"))
+
+    def test_selection_is_plain_primary_keys(self):
+        pks = sorted(Request.objects.values_list("pk", flat=True))
+        selection = jobs.Selection.of(Request.objects.exclude(pk=pks[2]))
+        dumped = json.loads(json.dumps(selection.dump()))
+        self.assertEqual(dumped, ["event.Request", [[pks[0], pks[1]], [pks[3], pks[5]]]])
+        loaded = jobs.Selection.load(dumped)
+        self.assertEqual(len(loaded), 5)
+        self.assertEqual(list(loaded.chunks(2)), [[pks[0], pks[1]], [pks[3], pks[4]], [pks[5]]])
+        with self.assertRaises(ValueError):
+            jobs.Selection.load(["event.Request", "gASV"])
+
+    def test_background_export_is_served_to_its_owner_only(self):
+        selection = jobs.Selection.of(Request.objects.filter(visa_letter=True))
+        tasks.export_rows(selection.dump(), "csv", self.staff.pk)
+        [mail] = DelayedJob.objects.all()
+        [url] = [word for word in json.loads(mail.handler)["args"][1].split() if word.startswith("https://")]
+        self.assertTrue(url.startswith("https://tsp.example.org/event/exports/requests-"))
+        path = url.removeprefix("https://tsp.example.org")
+
+        self.client.force_login(self.staff)
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + 3)
+
+        self.client.force_login(User.objects.create_user("other", is_staff=True))
+        self.assertEqual(self.client.get(path).status_code, 404)
+        self.assertEqual(self.client.get(reverse("event:download_export", args=["..%2Fsecret.csv"])).status_code,
+                         404)
+
+
+# ---------- Bulk actions ----------
+
+class BulkJobTests(TestCase):
+
+    def test_background_run_archives_the_selection_and_reports_progress(self):
+        user = User.objects.create_user("staff", "staff@example.org", is_staff=True)
+        event = make_request().event
+        Event.objects.bulk_create([Event(name=f"event {n}", budget=event.budget) for n in range(4)])
+        job = tasks.bulk_action.delay(jobs.Selection.of(Event.objects.exclude(pk=event.pk)).dump(), "archive",
+                                      user.pk)
+        DelayedJob.objects.filter(pk=job.pk).update(locked_by="test", locked_at=timezone.now())
+        seen = []
+        report_progress = jobs.report_progress
+
+        def record(text):
+            report_progress(text)
+            seen.append(DelayedJob.objects.get(pk=job.pk).progress)
+
+        with mock.patch("event.jobs.report_progress", side_effect=record):
+            self.assertEqual(jobs.perform(job.pk, "test")[0], "succeeded")
+        self.assertEqual(seen, ["4 / 4"])
+        self.assertEqual(list(Event.objects.order_by("pk").values_list("archived", flat=True)),
+                         [False, True, True, True, True])
+        self.assertIn("4 of 4 changed", json.loads(jobs.waiting("event.tasks.send_email").get().handler)["args"][1])
+
+
+# ---------- State machines ----------
+
+class StateMachineTests(TestCase):
+
+    def test_guard_blocks_and_fire_moves(self):
+        request = make_request(expenses=[(Decimal("100"), None)])
+        with self.assertRaisesMessage(states.TransitionNotAllowed, "every expense needs an approved amount"):
+            states.request_machine.fire(request, "approve")
+        RequestExpense.objects.filter(request=request).update(approved_amount=Decimal("100"))
+        change = states.request_machine.fire(request, "approve", notes="ok")
+        self.assertEqual((change.from_state, change.to_state, change.notes), ("submitted", "approved", "ok"))
+        request.refresh_from_db()
+        self.assertEqual((request.state, request.lock_version), ("approved", 1))
+        self.assertEqual(states.request_machine.events(request), ["accept", "roll_back", "cancel"])
+
+    def test_bulk_reports_skipped_and_costs_the_same_for_any_size(self):
+        def bulk_cancel(count):
+            event = make_request(state="accepted").event
+            for _ in range(count):
+                make_request(event=event)
+            with CaptureQueriesContext(connection) as queries:
+                result = states.request_machine.bulk(Request.objects.filter(event=event), "cancel")
+            self.assertEqual(len(result.changed), count + 1)
+            return len(queries)
+
+        self.assertEqual(bulk_cancel(1), bulk_cancel(6))
+        make_request(state="canceled")
+        result = states.request_machine.bulk(Request.objects.filter(state="canceled"), "submit")
+        self.assertEqual(result.changed, [])
+        self.assertEqual(set(result.skipped.values()), {"submit is not possible from canceled"})
+
+
+# ---------- Counters ----------
+
+class StateCountTests(TestCase):
+
+    def test_counts_follow_saves_transitions_and_moves(self):
+        request = make_request()
+        event, other = request.event, Event.objects.create(name="other", budget=request.event.budget)
+        make_request(event=event)
+        make_request(event=event, state="incomplete")
+        self.assertEqual(counters.counts(event)["request"], {"submitted": 2, "incomplete": 1})
+        states.request_machine.bulk(Request.objects.filter(event=event), "cancel")
+        self.assertEqual(counters.counts(event)["request"], {"canceled": 3})
+        request.refresh_from_db()
+        request.event = other
+        request.save()
+        self.assertEqual(counters.counts(event)["request"], {"canceled": 2})
+        self.assertEqual(counters.counts(other)["request"], {"canceled": 1})
+
+    def test_pending_work_and_rebuild(self):
+        busy = make_request().event
+        make_request(event=busy)
+        quiet = make_request(state="accepted").event
+        Reimbursement.objects.create(user=User.objects.get(username="attendee"),
+                                     request=quiet.requests.get(), state="approved")
+        self.assertEqual([(row["event"], row["requests"], row["reimbursements"]) for row in counters.pending_work()],
+                         [(busy, 2, 0), (quiet, 0, 1)])
+        Request.objects.filter(event=busy).update(state="approved")  # no signals
+        self.assertEqual(counters.rebuild(), {(busy.pk, "request", "submitted"): (2, 0),
+                                              (busy.pk, "request", "approved"): (0, 2)})
+        self.assertEqual(counters.counts(busy)["request"], {"approved": 2})
+        self.assertEqual(counters.rebuild(), {})
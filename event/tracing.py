@@ -0,0 +1,178 @@
+"""
+Request correlation and per-request timing.
+
+Every web request and every job runs inside a ``Trace``. The trace carries a request
+id, taken from a sane incoming ``X-Request-Id`` or generated. The id is stamped on
+log records (``RequestIdFilter``) and on audits (``Audit.request_uuid``). It is sent
+with outbound Wise calls, and enqueued jobs carry it along, so one id follows an
+approval from the browser through its jobs and payouts.
+
+While a trace is active, time is summed per kind:
+
+* ``db``: SQL, through a database execute wrapper;
+* ``tpl``: template rendering, which includes queries run from templates;
+* ``http``: calls to Wise.
+
+Web responses report the sums in a ``Server-Timing`` header. Traces slower than
+``TRACE_SLOW_SECONDS``, and a ``TRACE_SAMPLE_RATE`` share of the others, are logged
+on the ``event.tracing`` logger with their slowest steps.
+"""
+import contextvars
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+HEADER = "X-Request-Id"
+KINDS = {"db": "SQL", "tpl": "Templates", "http": "External HTTP"}
+MAX_SPANS = 200
+TOP_SPANS = 10
+_VALID_ID = re.compile(r"^[A-Za-z0-9._:-]{8,64}$")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+def clean_id(value):
+    """``value`` if it is usable as a request id (no spaces, sane length), else ``None``."""
+    return value if value and _VALID_ID.match(value) else None
+
+
+class Trace:
+
+    def __init__(self, request_id=None, name=""):
+        self.request_id = request_id or new_id()
+        self.name = name
+        self.started = time.perf_counter()
+        self.totals = {kind: [0, 0.0] for kind in KINDS}  # kind -> [count, seconds]
+        self.spans = []  # (seconds, kind, detail), capped at MAX_SPANS
+        self.rendering = False
+
+    def record(self, kind, seconds, detail=""):
+        total = self.totals[kind]
+        total[0] += 1
+        total[1] += seconds
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((seconds, kind, detail))
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        parts = [f'{kind};dur={seconds * 1000:.1f};desc="{KINDS[kind]} ({count})"'
+                 for kind, (count, seconds) in self.totals.items() if count]
+        parts.append(f"total;dur={self.elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self, **extra):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            **extra,
+            "seconds": round(self.elapsed, 4),
+            **{kind: {"count": count, "seconds": round(seconds, 4)} for kind, (count, seconds) in self.totals.items()},
+            "slowest": [{"kind": kind, "seconds": round(seconds, 4), "detail": detail[:300]}
+                        for seconds, kind, detail in sorted(self.spans, key=lambda span: span[0],
+                                                            reverse=True)[:TOP_SPANS]],
+        }
+
+
+def current():
+    return _current.get()
+
+
+def current_request_id():
+    trace = _current.get()
+    return trace.request_id if trace is not None else None
+
+
+def record(kind, seconds, detail=""):
+    trace = _current.get()
+    if trace is not None:
+        trace.record(kind, seconds, detail)
+
+
+def outbound_headers(headers=None):
+    """``headers`` plus the request id of the current trace, for calls to other services."""
+    request_id = current_request_id()
+    if request_id is None:
+        return headers
+    return {HEADER: request_id, **(headers or {})}
+
+
+def _time_sql(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record("db", time.perf_counter() - started, sql)
+
+
+class trace:
+    """``with trace(request_id, name) as t:`` runs a block as one traced unit of work."""
+
+    def __init__(self, request_id=None, name=""):
+        self.trace = Trace(request_id, name)
+
+    def __enter__(self):
+        self._token = _current.set(self.trace)
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(_time_sql))
+        return self.trace
+
+    def __exit__(self, *exc):
+        self._stack.close()
+        _current.reset(self._token)
+
+
+def maybe_log(trace, **extra):
+    """Log the trace if it was slow or is sampled."""
+    slow = trace.elapsed >= getattr(settings, "TRACE_SLOW_SECONDS", 1.0)
+    if slow or random.random() < getattr(settings, "TRACE_SAMPLE_RATE", 0.0):
+        logger.info("trace %s", json.dumps(trace.summary(slow=slow, **extra), default=str))
+
+
+def install():
+    """Time template rendering (called once from the app config)."""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, "_traced", False):
+        return
+    render = Template.render
+
+    def traced_render(self, context=None, request=None):
+        trace = _current.get()
+        # templates rendered from a template (form widgets) are part of the outer one's time
+        if trace is None or trace.rendering:
+            return render(self, context, request)
+        trace.rendering = True
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            trace.rendering = False
+            trace.record("tpl", time.perf_counter() - started, getattr(self.origin, "template_name", "") or "")
+
+    traced_render._traced = True
+    Template.render = traced_render
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds ``record.request_id`` (``-`` outside a trace) for use in log formats."""
+
+    def filter(self, record):
+        record.request_id = current_request_id() or "-"
+        return True
@@ -0,0 +1,98 @@
+"""
+Field change tracking for models that are audited.
+
+Every instance of a tracked model remembers the values it was loaded (or last saved,
+or refreshed from the database) with, so ``changes(instance)`` can tell what a ``save()`` is about to write without
+reading the row again. ``TrackedManager`` adds the same to ``bulk_update``, which
+Django runs without signals: it sends ``post_bulk_update`` with the changes of every
+object instead.
+"""
+import functools
+
+from django.db import models
+from django.db.models.signals import post_init
+from django.dispatch import Signal
+
+SNAPSHOT = "_tracked_values"
+
+# sent with model, changes ({instance: {field: (old, new)}}) and using after a bulk_update
+post_bulk_update = Signal()
+
+_tracked = {}  # model -> tuple of (name, attname) of the tracked fields
+
+
+def track(model, exclude=()):
+    """Start tracking the concrete fields of ``model`` (except ``exclude``)."""
+    _tracked[model] = tuple(
+        (field.name, field.attname) for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in exclude
+    )
+    post_init.connect(_remember, sender=model, weak=False, dispatch_uid=f"track-{model._meta.label}")
+    if not hasattr(model.refresh_from_db, "tracked"):
+        model.refresh_from_db = _refreshing(model.refresh_from_db)
+
+
+def tracked_fields(model):
+    return _tracked.get(model, ())
+
+
+def _remember(sender, instance, **kwargs):
+    remember(instance)
+
+
+def _refreshing(refresh_from_db):
+    # the values are copied over from another instance, so post_init does not see them
+    @functools.wraps(refresh_from_db)
+    def refresh(self, using=None, fields=None, **kwargs):
+        refresh_from_db(self, using=using, fields=fields, **kwargs)
+        remember(self, fields)
+    refresh.tracked = True
+    return refresh
+
+
+def remember(instance, fields=None):
+    """Take the current values of ``instance`` (or only of ``fields``, after a partial save) as its saved state."""
+    values = instance.__dict__
+    if fields is not None and SNAPSHOT in values:
+        values[SNAPSHOT].update({
+            attname: values.get(attname) for name, attname in _tracked.get(type(instance), ())
+            if name in fields or attname in fields
+        })
+        return
+    instance.__dict__[SNAPSHOT] = {
+        attname: values.get(attname) for _, attname in _tracked.get(type(instance), ())
+    }
+
+
+def saved_values(instance):
+    return instance.__dict__.get(SNAPSHOT) or {}
+
+
+def changes(instance, fields=None):
+    """``{field name: (old, new)}`` of the tracked fields that differ from the saved state."""
+    snapshot = saved_values(instance)
+    result = {}
+    for name, attname in _tracked.get(type(instance), ()):
+        if fields is not None and name not in fields and attname not in fields:
+            continue
+        old, new = snapshot.get(attname), instance.__dict__.get(attname)
+        if old != new:
+            result[name] = (old, new)
+    return result
+
+
+class TrackedQuerySet(models.QuerySet):
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        diffs = {obj: changes(obj, fields) for obj in objs}
+        updated = super().bulk_update(objs, fields, batch_size=batch_size)
+        diffs = {obj: diff for obj, diff in diffs.items() if diff}
+        if diffs:
+            post_bulk_update.send(sender=self.model, changes=diffs, using=self.db)
+        for obj in diffs:
+            remember(obj, fields)
+        return updated
+
+
+TrackedManager = models.Manager.from_queryset(TrackedQuerySet)
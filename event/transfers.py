@@ -0,0 +1,223 @@
+"""
+Transfer status tracking for Wise payouts.
+
+Wise pushes ``transfers#state-change`` webhooks; ``apply_transfer_status`` turns each
+of them into an update of the matching ``Payment`` and, once the transfer is done, an
+event of the reimbursement state machine (see ``event.states``). For transfers whose
+webhooks may have been missed, ``TransferPoller`` checks many in-flight transfers per
+tick from a single thread, backing off per transfer while its state stays the same.
+"""
+import asyncio
+import base64
+import heapq
+import logging
+import time
+
+import httpx
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Payment
+from .payouts import PAYMENT_METHOD, PROCESSED_STATE
+from .states import TransitionNotAllowed, reimbursement_machine
+from .wise import AsyncWiseClient, WiseError
+
+logger = logging.getLogger(__name__)
+
+PAYED_STATE = "payed"
+
+# Wise transfer states that end the life of a transfer, and the reimbursement event each one fires
+TERMINAL_STATES = {
+    "outgoing_payment_sent": "confirm",
+    "cancelled": "payout_failed",
+    "funds_refunded": "payout_failed",
+    "bounced_back": "payout_failed",
+    "charged_back": "payout_failed",
+}
+
+
+# ---------- Webhooks ----------
+
+def verify_signature(body, signature, public_key_pem=None):
+    """
+    Check the ``X-Signature-SHA256`` header Wise sends with every webhook.
+
+    The signature is an RSA/SHA-256 signature of the raw request body made with
+    Wise's private key; ``public_key_pem`` defaults to ``WISE_WEBHOOK_PUBLIC_KEY``.
+    """
+    public_key_pem = public_key_pem or settings.WISE_WEBHOOK_PUBLIC_KEY
+    if not signature or not public_key_pem:
+        return False
+    if isinstance(public_key_pem, str):
+        public_key_pem = public_key_pem.encode()
+    try:
+        key = serialization.load_pem_public_key(public_key_pem)
+        key.verify(base64.b64decode(signature), body, padding.PKCS1v15(), hashes.SHA256())
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+
+def handle_webhook(payload):
+    """Apply a decoded ``transfers#state-change`` payload; other event types are ignored."""
+    if payload.get("event_type") != "transfers#state-change":
+        return None
+    data = payload.get("data", {})
+    resource = data.get("resource", {})
+    if resource.get("type") != "transfer":
+        return None
+    return apply_transfer_status(resource.get("id"), data.get("current_state"),
+                                 occurred_at=data.get("occurred_at"))
+
+
+# ---------- Applying a status ----------
+
+def apply_transfer_status(transfer_id, state, occurred_at=None, user=None):
+    """
+    Record that Wise transfer ``transfer_id`` is now in ``state``.
+
+    Runs in one transaction with the payment row locked, and is idempotent: replaying
+    the same webhook or polling result changes nothing. Returns the ``Payment`` or
+    ``None`` when the transfer is not one of ours.
+    """
+    if not transfer_id or not state:
+        return None
+    now = timezone.now()
+    with transaction.atomic():
+        payment = (
+            Payment.objects.select_for_update()
+            .select_related("reimbursement")
+            .filter(method=PAYMENT_METHOD, code=str(transfer_id))
+            .first()
+        )
+        if payment is None:
+            logger.info("ignoring status %s for unknown transfer %s", state, transfer_id)
+            return None
+        if payment.status == state:
+            return payment
+
+        payment.status = state
+        payment.updated_at = now
+        payment.save(update_fields=["status", "updated_at"])
+
+        reimbursement = payment.reimbursement
+        event = TERMINAL_STATES.get(state)
+        if reimbursement is not None and event:
+            notes = f"Wise transfer {transfer_id}: {state}" + (f" at {occurred_at}" if occurred_at else "")
+            try:
+                reimbursement_machine.fire(reimbursement, event, user=user, notes=notes)
+            except TransitionNotAllowed as e:
+                logger.info("transfer %s is %s, reimbursement %s left alone: %s",
+                            transfer_id, state, reimbursement.pk, e)
+    return payment
+
+
+def in_flight_transfers():
+    """Wise transfer ids of payments that have not reached a terminal state."""
+    return list(
+        Payment.objects.filter(method=PAYMENT_METHOD, reimbursement__state=PROCESSED_STATE)
+        .exclude(status__in=list(TERMINAL_STATES))
+        .values_list("code", flat=True)
+    )
+
+
+# ---------- Polling ----------
+
+class TransferPoller:
+    """
+    Polls the status of many in-flight transfers from one thread.
+
+    Every transfer has its own next-check time on a heap. Each tick fetches all the
+    due transfers concurrently (at most ``batch_size`` of them), applies any changed
+    states and reschedules: a changed state resets the interval to ``min_interval``,
+    an unchanged one doubles it up to ``max_interval``, and terminal transfers drop out.
+
+    The poller keeps one event loop and one client, so every tick re-uses the same
+    pooled connections; ``close`` releases them.
+    """
+
+    def __init__(self, *, min_interval=30.0, max_interval=1800.0, batch_size=100, concurrency=10,
+                 client_factory=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.client_factory = client_factory or AsyncWiseClient.from_settings
+        self._heap = []
+        self._tracked = {}  # transfer id -> (current interval, last seen state)
+        self._loop = None
+        self._client = None
+
+    def track(self, transfer_id, state=None):
+        transfer_id = str(transfer_id)
+        if transfer_id not in self._tracked:
+            self._tracked[transfer_id] = (self.min_interval, state)
+            heapq.heappush(self._heap, (time.monotonic(), transfer_id))
+
+    def refresh(self):
+        """Pick up payments created since the last refresh."""
+        for transfer_id in in_flight_transfers():
+            self.track(transfer_id)
+
+    def due(self, now=None):
+        now = time.monotonic() if now is None else now
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self._heap)[1])
+        return batch
+
+    async def _fetch(self, transfer_ids):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if self._client is None:
+            self._client = self.client_factory()
+        client = self._client
+
+        async def fetch(transfer_id):
+            async with semaphore:
+                try:
+                    return transfer_id, (await client.get_transfer(transfer_id)).get("status")
+                except (WiseError, httpx.TransportError) as e:
+                    # the client retried already; the transfer is checked again after its backoff
+                    logger.warning("status check of transfer %s failed: %s", transfer_id, e)
+                    return transfer_id, None
+
+        return await asyncio.gather(*(fetch(t) for t in transfer_ids))
+
+    def tick(self):
+        """Check every due transfer once; returns the number of transfers checked."""
+        batch = self.due()
+        if not batch:
+            return 0
+        now = time.monotonic()
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        for transfer_id, state in self._loop.run_until_complete(self._fetch(batch)):
+            interval, last_state = self._tracked[transfer_id]
+            if state and state != last_state:
+                apply_transfer_status(transfer_id, state)
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            if state in TERMINAL_STATES:
+                del self._tracked[transfer_id]
+                continue
+            self._tracked[transfer_id] = (interval, state or last_state)
+            heapq.heappush(self._heap, (now + interval, transfer_id))
+        return len(batch)
+
+    def next_due_in(self):
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._client is not None:
+            self._loop.run_until_complete(self._client.aclose())
+        self._loop.close()
+        self._loop = self._client = None
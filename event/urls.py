@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import views
+
+app_name = "event"
+
+urlpatterns = [
+    path("wise/webhook/", views.wise_webhook, name="wise_webhook"),
+    path("metrics", views.job_metrics, name="job_metrics"),
+    path("jobs/dashboard.json", views.job_dashboard, name="job_dashboard"),
+    path("reports/expenses.json", views.expense_report, name="expense_report"),
+    path("reports/expenses.csv", views.expense_report_csv, name="expense_report_csv"),
+    path("exports/<str:name>", views.download_export, name="download_export"),
+]
@@ -1,3 +1,109 @@
-from django.shortcuts import render
+import hmac
+import json
+import logging
 
-# Create your views here.
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import exports, metrics, reports
+from .models import RequestExpense
+from .transfers import handle_webhook, verify_signature
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_MINUTES = 60
+
+
+@csrf_exempt
+@require_POST
+def wise_webhook(request):
+    """Receives Wise webhooks; only signed transfer state changes touch the database."""
+    if not verify_signature(request.body, request.headers.get("X-Signature-SHA256")):
+        logger.warning("rejected Wise webhook with a bad signature (delivery %s)",
+                       request.headers.get("X-Delivery-Id"))
+        return HttpResponseForbidden()
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+    handle_webhook(payload)
+    return HttpResponse()
+
+
+@never_cache
+@require_GET
+def job_metrics(request):
+    """Prometheus scrape target: queue depth and rolled-up job counts (staff or ``METRICS_TOKEN``)."""
+    token = getattr(settings, "METRICS_TOKEN", None)
+    bearer = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not (request.user.is_staff or (token and hmac.compare_digest(bearer, token))):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render_queue_state(), content_type=metrics.CONTENT_TYPE)
+
+
+@never_cache
+@staff_member_required
+def job_dashboard(request):
+    """Series for the job charts of the staff home page."""
+    try:
+        minutes = int(request.GET.get("minutes") or DASHBOARD_MINUTES)
+    except ValueError:
+        minutes = DASHBOARD_MINUTES
+    minutes = max(1, min(minutes, 24 * 60))
+    return JsonResponse(metrics.dashboard(minutes))
+
+
+def _ids(request, name):
+    """The integer ids of every ``?name=`` parameter; raises ``ValueError`` for anything else."""
+    return [int(value) for value in request.GET.getlist(name)]
+
+
+def _report(request):
+    """The rollup of the report parameters and its grouping; raises ``ValueError`` for bad ids."""
+    expenses = RequestExpense.objects.exclude(request__state=reports.CANCELED_STATE)
+    if events := _ids(request, "event"):
+        expenses = expenses.filter(request__event_id__in=events)
+    if budgets := _ids(request, "budget"):
+        expenses = expenses.filter(request__event__budget_id__in=budgets)
+    currency = (request.GET.get("currency") or "EUR").upper()[:10]
+    by = request.GET.get("by") if request.GET.get("by") in reports.GROUPS else "event"
+    return reports.expense_rollup(expenses, currency=currency), by
+
+
+@never_cache
+@staff_member_required
+def expense_report(request):
+    """Expense rollup of the largest groups for the dashboard chart (``?by=event|country|budget``)."""
+    try:
+        rollup, by = _report(request)
+    except ValueError:
+        return HttpResponseBadRequest("event and budget must be ids")
+    column = request.GET.get("column") if request.GET.get("column") in reports.COLUMNS else "approved"
+    return JsonResponse({**rollup.chart(by, column), "unconverted": rollup.unconverted})
+
+
+@staff_member_required
+def expense_report_csv(request):
+    """The same rollup, every group, as a CSV download."""
+    try:
+        rollup, by = _report(request)
+    except ValueError:
+        return HttpResponseBadRequest("event and budget must be ids")
+    response = HttpResponse(content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="expenses-by-{by}-{rollup.currency}.csv"'
+    reports.write_csv(rollup, response, by=by)
+    return response
+
+
+@never_cache
+@staff_member_required
+def download_export(request, name):
+    """An export written by the ``export_rows`` job; only ever one of the requesting user's own."""
+    path = exports.path(request.user.pk, name)
+    if path is None:
+        raise Http404("No such export.")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
@@ -0,0 +1,10 @@
+from .client import (
+    AsyncWiseClient,
+    WiseClient,
+    WiseError,
+    get_async_client,
+    get_client,
+)
+from . import recipients
+from .rates import RateTable, rate_table
+from .ratelimit import RequestScheduler, TokenBucket
@@ -0,0 +1,408 @@
+"""
+Pooled client for the Wise payout API.
+
+One client owns one bounded connection pool, so every call made through it re-uses
+kept-alive TCP/TLS connections (multiplexed over HTTP/2 when the ``h2`` package is
+installed) instead of paying for a fresh handshake per step. ``WiseClient`` is the
+blocking front-end and ``AsyncWiseClient`` the asyncio one; both expose the same
+endpoint methods.
+
+Use ``get_client()`` / ``get_async_client()`` to share a client configured from the
+Django settings. The sync client is safe to share between threads; a forked worker
+process transparently builds its own pool on first use. Every request is paced and,
+where safe, retried by the process-wide ``RequestScheduler`` (see ``ratelimit``), and
+carries the current request id (see ``event.tracing``).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+
+import httpx
+from django.conf import settings
+
+from .. import tracing
+from .ratelimit import RETRY_STATUSES, RequestScheduler, endpoint_key
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (only needed for HTTP/2 support in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+SANDBOX_URL = "https://api.sandbox.transferwise.tech"
+LIVE_URL = "https://api.transferwise.com"
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+KEEPALIVE_EXPIRY = 30.0
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+# namespace for idempotency keys derived from the id of what is being funded
+IDEMPOTENCY_NAMESPACE = uuid.UUID("0c7d6a4e-8a53-4a0e-9d7b-2f6f5d3c9b21")
+
+
+class WiseError(Exception):
+    """
+    Raised when Wise answers with a non-successful status code.
+
+    Keeps the parsed error payload and the response headers, since some of them
+    (``x-2fa-approval``, ``x-trace-id``, ``Retry-After``) drive what happens next.
+    """
+
+    def __init__(self, step, status_code, payload=None, headers=None):
+        self.step = step
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+        super().__init__(f"[{step}] HTTP {status_code}: {payload}")
+
+    @property
+    def trace_id(self):
+        return self.headers.get("x-trace-id")
+
+
+def _parse(response, step):
+    """Return the JSON body of ``response`` or raise ``WiseError``."""
+    try:
+        payload = response.json() if response.content else {}
+    except ValueError:
+        payload = response.text
+    if response.is_error:
+        logger.warning("%s failed: HTTP %s trace=%s %s", step, response.status_code,
+                       response.headers.get("x-trace-id"), payload)
+        raise WiseError(step, response.status_code, payload, response.headers)
+    return payload
+
+
+def _idempotency_key(*parts):
+    return str(uuid.uuid5(IDEMPOTENCY_NAMESPACE, ":".join(map(str, parts))))
+
+
+def _not_sent(exc):
+    """Connection errors that guarantee the request never reached the provider."""
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class _Endpoints:
+    """
+    The Wise endpoints used by the payout flow.
+
+    Each method only describes the call and returns whatever ``_call`` returns, which
+    is the decoded JSON for ``WiseClient`` and an awaitable of it for ``AsyncWiseClient``.
+    """
+
+    def get_profiles(self):
+        return self._call("GET", "/v2/profiles")
+
+    def list_balances(self, profile_id, types="STANDARD"):
+        return self._call("GET", f"/v4/profiles/{profile_id}/balances", params={"types": types})
+
+    def create_quote(self, profile_id, *, source_currency, target_currency, source_amount=None,
+                     target_amount=None, pay_in="BALANCE", pay_out="BANK_TRANSFER", target_account=None):
+        if (source_amount is None) == (target_amount is None):
+            raise ValueError("Provide exactly one of source_amount or target_amount")
+        body = {
+            "sourceCurrency": source_currency,
+            "targetCurrency": target_currency,
+            "payIn": pay_in,
+            "payOut": pay_out,
+        }
+        if source_amount is not None:
+            body["sourceAmount"] = source_amount
+        if target_amount is not None:
+            body["targetAmount"] = target_amount
+        if target_account is not None:
+            body["targetAccount"] = target_account
+        return self._call("POST", f"/v3/profiles/{profile_id}/quotes", json=body, idempotent=True)
+
+    def get_rates(self, source=None, target=None):
+        params = {k: v for k, v in (("source", source), ("target", target)) if v}
+        return self._call("GET", "/v1/rates", params=params or None)
+
+    def get_account_requirements(self, quote_id):
+        return self._call("GET", f"/v1/quotes/{quote_id}/account-requirements")
+
+    def list_recipients(self, profile_id, currency=None):
+        params = {"profile": profile_id}
+        if currency:
+            params["currency"] = currency
+        return self._call("GET", "/v1/accounts", params=params)
+
+    def create_recipient(self, profile_id, *, currency, account_holder_name, recipient_type, details,
+                         idempotency_key=None):
+        body = {
+            "profile": profile_id,
+            "currency": currency,
+            "type": recipient_type,
+            "accountHolderName": account_holder_name,
+            "ownedByCustomer": True,
+            "details": details,
+        }
+        # the same key goes with every retry, so a retried create never makes a second recipient
+        headers = {"X-idempotence-uuid": idempotency_key or str(uuid.uuid4())}
+        return self._call("POST", "/v1/accounts", json=body, headers=headers, idempotent=True)
+
+    def delete_recipient(self, recipient_id):
+        return self._call("DELETE", f"/v1/accounts/{recipient_id}")
+
+    def create_transfer(self, *, target_account_id, quote_uuid, customer_transaction_id, reference="",
+                        source_account_id=None):
+        """``customer_transaction_id`` is Wise's idempotency token: re-use it when retrying."""
+        body = {
+            "targetAccount": target_account_id,
+            "quoteUuid": quote_uuid,
+            "customerTransactionId": customer_transaction_id,
+            "details": {"reference": reference or ""},
+        }
+        if source_account_id:
+            body["sourceAccount"] = source_account_id
+        return self._call("POST", "/v1/transfers", json=body, idempotent=True)
+
+    def fund_transfer(self, profile_id, transfer_id, funding_type="BALANCE", sca_headers=None):
+        """``sca_headers`` carry the approved one-time token when retrying after a 403 (see ``sca``)."""
+        headers = {"X-idempotence-uuid": _idempotency_key("fund-transfer", transfer_id), **(sca_headers or {})}
+        return self._call("POST", f"/v3/profiles/{profile_id}/transfers/{transfer_id}/payments",
+                          json={"type": funding_type}, headers=headers, idempotent=True)
+
+    def create_batch_group(self, profile_id, *, source_currency, name):
+        return self._call("POST", f"/v3/profiles/{profile_id}/batch-groups",
+                          json={"sourceCurrency": source_currency, "name": name})
+
+    def get_batch_group(self, profile_id, batch_group_id):
+        return self._call("GET", f"/v3/profiles/{profile_id}/batch-groups/{batch_group_id}")
+
+    def create_batch_transfer(self, profile_id, batch_group_id, *, target_account_id, quote_uuid,
+                              customer_transaction_id, reference=""):
+        """Like ``create_transfer``, but the transfer is funded later together with its batch group."""
+        body = {
+            "targetAccount": target_account_id,
+            "quoteUuid": quote_uuid,
+            "customerTransactionId": customer_transaction_id,
+            "details": {"reference": reference or ""},
+        }
+        return self._call("POST", f"/v3/profiles/{profile_id}/batch-groups/{batch_group_id}/transfers",
+                          json=body, idempotent=True)
+
+    def complete_batch_group(self, profile_id, batch_group_id, version):
+        # the version makes a repeated PATCH a no-op rather than a second state change
+        return self._call("PATCH", f"/v3/profiles/{profile_id}/batch-groups/{batch_group_id}",
+                          json={"status": "COMPLETED", "version": version}, idempotent=True)
+
+    def cancel_batch_group(self, profile_id, batch_group_id, version):
+        # only a group that is still NEW can be cancelled; its transfers are cancelled with it
+        return self._call("PATCH", f"/v3/profiles/{profile_id}/batch-groups/{batch_group_id}",
+                          json={"status": "CANCELLED", "version": version}, idempotent=True)
+
+    def fund_batch_group(self, profile_id, batch_group_id, funding_type="BALANCE", sca_headers=None):
+        """Funds every transfer of a completed batch group with a single (single-SCA) call."""
+        headers = {"X-idempotence-uuid": _idempotency_key("fund-batch", batch_group_id), **(sca_headers or {})}
+        return self._call("POST", f"/v3/profiles/{profile_id}/batch-payments/{batch_group_id}/payments",
+                          json={"type": funding_type}, headers=headers, idempotent=True)
+
+    def get_ott_status(self, one_time_token):
+        return self._call("GET", "/v1/one-time-token/status", headers={"One-Time-Token": one_time_token})
+
+    def trigger_ott_otp(self, one_time_token, channel="sms"):
+        return self._call("POST", f"/v1/one-time-token/{channel}/trigger",
+                          headers={"One-Time-Token": one_time_token})
+
+    def verify_ott_otp(self, one_time_token, otp_code, channel="sms"):
+        return self._call("POST", f"/v1/one-time-token/{channel}/verify",
+                          headers={"One-Time-Token": one_time_token}, json={"otpCode": str(otp_code)})
+
+    def get_transfer(self, transfer_id):
+        return self._call("GET", f"/v1/transfers/{transfer_id}")
+
+    def get_activities(self, profile_id, **params):
+        return self._call("GET", f"/v1/profiles/{profile_id}/activities", params=params)
+
+    def simulate_transfer(self, transfer_id, status):
+        """Sandbox only: push a transfer to ``status`` (processing, funds_converted, ...)."""
+        return self._call("GET", f"/v1/simulation/transfers/{transfer_id}/{status}")
+
+
+class _BaseClient(_Endpoints):
+
+    def __init__(self, token, base_url=SANDBOX_URL, *, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 http2=True, transport=None, scheduler=None):
+        self.base_url = base_url.rstrip("/")
+        self.scheduler = scheduler or RequestScheduler()
+        self._options = dict(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {token}", "Accept-Minor-Version": "1"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                keepalive_expiry=KEEPALIVE_EXPIRY),
+            timeout=timeout,
+            http2=http2 and HTTP2_AVAILABLE and transport is None,
+        )
+        if transport is not None:
+            self._options["transport"] = transport
+
+    @classmethod
+    def from_settings(cls, **kwargs):
+        options = dict(
+            base_url=getattr(settings, "WISE_BASE_URL", SANDBOX_URL),
+            pool_size=getattr(settings, "WISE_POOL_SIZE", DEFAULT_POOL_SIZE),
+            http2=getattr(settings, "WISE_HTTP2", True),
+        )
+        options.update(kwargs)
+        options.setdefault("scheduler", get_scheduler())
+        return cls(settings.WISE_API_KEY, **options)
+
+    def _prepare(self, method, path, idempotent):
+        key = endpoint_key(method, path)
+        return key, method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+
+    def _traced(self, key, started, response=None, exc=None):
+        """Adds the call to the current trace; Wise's ``x-trace-id`` goes with it for support tickets."""
+        seconds = time.perf_counter() - started
+        if response is not None:
+            outcome = f"HTTP {response.status_code} trace={response.headers.get('x-trace-id', '-')}"
+        else:
+            outcome = type(exc).__name__
+        tracing.record("http", seconds, f"{key} {outcome}")
+        logger.debug("%s: %s in %.0fms", key, outcome, seconds * 1000)
+
+    def _retry_delay(self, key, attempt, idempotent, response=None, exc=None):
+        """Seconds to wait before retrying, or ``None`` to give up (see ``RequestScheduler.backoff``)."""
+        if exc is not None:
+            delay = self.scheduler.backoff(key, attempt, idempotent=idempotent or _not_sent(exc))
+        elif response.status_code in RETRY_STATUSES:
+            delay = self.scheduler.backoff(key, attempt, response.status_code, response.headers, idempotent)
+        else:
+            return None
+        if delay is not None:
+            logger.info("%s: retry %d in %.2fs after %s", key, attempt, delay,
+                        type(exc).__name__ if exc is not None else f"HTTP {response.status_code}")
+        return delay
+
+
+class WiseClient(_BaseClient):
+    """Blocking client; one instance can be shared by any number of threads."""
+
+    def __init__(self, token, base_url=SANDBOX_URL, **kwargs):
+        super().__init__(token, base_url, **kwargs)
+        self._http = httpx.Client(**self._options)
+
+    def _call(self, method, path, *, params=None, json=None, headers=None, step=None, idempotent=None):
+        key, idempotent = self._prepare(method, path, idempotent)
+        headers = tracing.outbound_headers(headers)
+        attempt = 0
+        while True:
+            wait = self.scheduler.reserve(key)
+            if wait:
+                time.sleep(wait)
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                response = self._http.request(method, path, params=params, json=json, headers=headers)
+            except httpx.TransportError as e:
+                self._traced(key, started, exc=e)
+                delay = self._retry_delay(key, attempt, idempotent, exc=e)
+                if delay is None:
+                    raise
+            else:
+                self._traced(key, started, response=response)
+                delay = self._retry_delay(key, attempt, idempotent, response=response)
+                if delay is None:
+                    return _parse(response, step or key)
+            time.sleep(delay)
+
+    def close(self):
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncWiseClient(_BaseClient):
+    """asyncio client; bound to the event loop it was first used on."""
+
+    def __init__(self, token, base_url=SANDBOX_URL, **kwargs):
+        super().__init__(token, base_url, **kwargs)
+        self._http = httpx.AsyncClient(**self._options)
+
+    async def _call(self, method, path, *, params=None, json=None, headers=None, step=None, idempotent=None):
+        key, idempotent = self._prepare(method, path, idempotent)
+        headers = tracing.outbound_headers(headers)
+        attempt = 0
+        while True:
+            wait = self.scheduler.reserve(key)
+            if wait:
+                await asyncio.sleep(wait)
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                response = await self._http.request(method, path, params=params, json=json, headers=headers)
+            except httpx.TransportError as e:
+                self._traced(key, started, exc=e)
+                delay = self._retry_delay(key, attempt, idempotent, exc=e)
+                if delay is None:
+                    raise
+            else:
+                self._traced(key, started, response=response)
+                delay = self._retry_delay(key, attempt, idempotent, response=response)
+                if delay is None:
+                    return _parse(response, step or key)
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+# ---------- Shared instances ----------
+
+_lock = threading.RLock()
+_shared = {}
+_shared_async = weakref.WeakKeyDictionary()
+_schedulers = {}
+
+
+def get_scheduler():
+    """The ``RequestScheduler`` shared by every client of this process."""
+    pid = os.getpid()
+    scheduler = _schedulers.get(pid)
+    if scheduler is None:
+        with _lock:
+            scheduler = _schedulers.get(pid)
+            if scheduler is None:
+                _schedulers.clear()
+                scheduler = _schedulers[pid] = RequestScheduler.from_settings()
+    return scheduler
+
+
+def get_client():
+    """Return the process-wide ``WiseClient``, building a new pool after a fork."""
+    pid = os.getpid()
+    client = _shared.get(pid)
+    if client is None:
+        with _lock:
+            client = _shared.get(pid)
+            if client is None:
+                _shared.clear()  # pools inherited from a parent process must not be re-used
+                client = _shared[pid] = WiseClient.from_settings()
+    return client
+
+
+def get_async_client():
+    """Return the ``AsyncWiseClient`` shared by everything running on the current event loop."""
+    loop = asyncio.get_running_loop()
+    client = _shared_async.get(loop)
+    if client is None:
+        client = _shared_async[loop] = AsyncWiseClient.from_settings()
+    return client
@@ -0,0 +1,528 @@
+"""
+An in-memory stand-in for the Wise API.
+
+``FakeWise`` implements the endpoints the payout flow uses (profiles, balances,
+quotes, rates, recipients, transfers, funding, batch groups, one-time tokens,
+activities and the sandbox simulation endpoints) closely enough to run payouts,
+pollers and benchmarks without a network connection or sandbox credentials.
+
+Plug it into a client with ``httpx.MockTransport``::
+
+    fake = FakeWise(latency=0.02, error_rate=0.01, sca=True)
+    client = fake.async_client()
+
+or serve it over HTTP (``manage.py fake_wise``) and point ``WISE_BASE_URL`` at it.
+Latency, 5xx errors, 429s and SCA challenges can all be injected; ``calls`` counts
+the requests per endpoint.
+"""
+import asyncio
+import base64
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from .client import AsyncWiseClient, WiseClient
+from .ratelimit import RequestScheduler, endpoint_key
+from .sca import OTT_HEADER, OTT_RESULT_HEADER, SANDBOX_OTP
+
+FAKE_TOKEN = "fake-wise-token"
+# units of each currency per 1 EUR
+FAKE_RATES = {"EUR": Decimal("1"), "GBP": Decimal("0.86"), "USD": Decimal("1.08"), "CHF": Decimal("0.94")}
+QUOTE_TTL = timedelta(minutes=30)
+FEE = Decimal("0.35")
+SIMULATED_STATES = ("processing", "funds_converted", "outgoing_payment_sent", "bounced_back",
+                    "funds_refunded", "cancelled")
+
+_routes = []
+
+
+def route(method, pattern):
+    def register(func):
+        _routes.append((method, re.compile(f"^{pattern}$"), func))
+        return func
+    return register
+
+
+class FakeError(Exception):
+
+    def __init__(self, status_code, code, message=None, headers=None):
+        super().__init__(message or code)
+        self.status_code = status_code
+        self.code = code
+        self.headers = headers or {}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _iso(moment):
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+class FakeWise:
+    """
+    One fake Wise account with a single personal profile.
+
+    ``latency`` (plus up to ``jitter``) seconds are spent on every request;
+    ``error_rate`` and ``throttle_rate`` are the chances of an injected 500 or 429
+    (answered before anything is processed); ``fail`` maps endpoint keys such as
+    ``"POST /v1/accounts"`` to a status every such call gets. With ``sca`` funding
+    calls need an approved one-time token; signatures are checked against
+    ``sca_public_key`` when one is given.
+    """
+
+    def __init__(self, *, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, fail=None, sca=False,
+                 sca_public_key=None, profile_id=1, balances=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.fail = dict(fail or {})
+        self.sca = sca
+        self.sca_public_key = sca_public_key
+        self.profile_id = profile_id
+        self.balances = {currency: Decimal(amount) for currency, amount in
+                         (balances or {"EUR": 1_000_000, "GBP": 100_000, "USD": 100_000}).items()}
+        self.calls = Counter()
+        self.quotes = {}
+        self.recipients = {}
+        self.transfers = {}
+        self._transfer_of = {}  # customerTransactionId -> transfer id
+        self.batch_groups = {}
+        self.tokens = {}
+        self.activities = []
+        self._idempotent = {}  # (endpoint, key) -> response body
+        self._ids = itertools.count(1000)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # ---------- Clients ----------
+
+    def transport(self):
+        return httpx.MockTransport(self.handler)
+
+    def async_transport(self):
+        return httpx.MockTransport(self.async_handler)
+
+    def client(self, **kwargs):
+        """A ``WiseClient`` talking to this fake, without rate limits unless a scheduler is given."""
+        kwargs.setdefault("scheduler", RequestScheduler(base_delay=0.01))
+        return WiseClient(FAKE_TOKEN, transport=self.transport(), **kwargs)
+
+    def async_client(self, **kwargs):
+        kwargs.setdefault("scheduler", RequestScheduler(base_delay=0.01))
+        return AsyncWiseClient(FAKE_TOKEN, transport=self.async_transport(), **kwargs)
+
+    # ---------- Request handling ----------
+
+    def _delay(self):
+        if not (self.latency or self.jitter):
+            return 0.0
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def handler(self, request):
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        return self.respond(request)
+
+    async def async_handler(self, request):
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return self.respond(request)
+
+    def _injected(self, key):
+        if key in self.fail:
+            return FakeError(self.fail[key], "injected")
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return FakeError(429, "rate_limited", headers={"Retry-After": "0"})
+        if roll < self.throttle_rate + self.error_rate:
+            return FakeError(500, "injected")
+        return None
+
+    def respond(self, request):
+        """Answer one ``httpx.Request``."""
+        path = request.url.path
+        key = endpoint_key(request.method, path)
+        self.calls[key] += 1
+        body = json.loads(request.content) if request.content else {}
+        params = dict(request.url.params)
+        try:
+            if request.headers.get("Authorization") != f"Bearer {FAKE_TOKEN}":
+                raise FakeError(401, "unauthorized")
+            error = self._injected(key)
+            if error is not None:
+                raise error
+            for method, pattern, func in _routes:
+                match = pattern.match(path)
+                if match and method == request.method:
+                    with self._lock:
+                        status, payload = func(self, request, body, params, *match.groups())
+                    return httpx.Response(status, json=payload)
+            raise FakeError(404, "not_found", f"no fake for {key}")
+        except FakeError as e:
+            headers = {"x-trace-id": uuid.uuid4().hex, **e.headers}
+            return httpx.Response(e.status_code, headers=headers,
+                                  json={"errors": [{"code": e.code, "message": str(e)}]})
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def _replay(self, request, key, build):
+        """Answer a repeated ``X-idempotence-uuid`` with the first response."""
+        token = request.headers.get("X-idempotence-uuid")
+        if token is None:
+            return build()
+        if (key, token) not in self._idempotent:
+            self._idempotent[(key, token)] = build()
+        return self._idempotent[(key, token)]
+
+    def _check_profile(self, profile_id):
+        if int(profile_id) != self.profile_id:
+            raise FakeError(404, "profile_not_found")
+
+    # ---------- Profiles, balances, rates ----------
+
+    @route("GET", r"/v[12]/profiles")
+    def _profiles(self, request, body, params):
+        return 200, [{"id": self.profile_id, "type": "PERSONAL", "fullName": "Fake Foundation"}]
+
+    @route("GET", r"/v4/profiles/(\d+)/balances")
+    def _balances(self, request, body, params, profile_id):
+        self._check_profile(profile_id)
+        return 200, [{"id": index + 1, "currency": currency, "type": "STANDARD",
+                      "amount": {"value": float(amount), "currency": currency}}
+                     for index, (currency, amount) in enumerate(sorted(self.balances.items()))]
+
+    def rate(self, source, target):
+        if source not in FAKE_RATES or target not in FAKE_RATES:
+            raise FakeError(422, "unsupported_currency", f"{source}->{target}")
+        return FAKE_RATES[target] / FAKE_RATES[source]
+
+    @route("GET", r"/v1/rates")
+    def _rates(self, request, body, params):
+        pairs = [(s, t) for s in FAKE_RATES for t in FAKE_RATES if s != t]
+        if params.get("source"):
+            pairs = [p for p in pairs if p[0] == params["source"]]
+        if params.get("target"):
+            pairs = [p for p in pairs if p[1] == params["target"]]
+        return 200, [{"source": s, "target": t, "rate": float(self.rate(s, t)), "time": _iso(_now())}
+                     for s, t in pairs]
+
+    # ---------- Quotes and recipients ----------
+
+    @route("POST", r"/v3/profiles/(\d+)/quotes")
+    def _create_quote(self, request, body, params, profile_id):
+        self._check_profile(profile_id)
+        rate = self.rate(body["sourceCurrency"], body["targetCurrency"])
+        if body.get("targetAmount") is not None:
+            target = Decimal(str(body["targetAmount"]))
+            source = (target / rate + FEE).quantize(Decimal("0.01"))
+        else:
+            source = Decimal(str(body["sourceAmount"]))
+            target = ((source - FEE) * rate).quantize(Decimal("0.01"))
+        quote = {
+            "id": str(uuid.uuid4()), "profile": self.profile_id,
+            "sourceCurrency": body["sourceCurrency"], "targetCurrency": body["targetCurrency"],
+            "sourceAmount": float(source), "targetAmount": float(target), "rate": float(rate),
+            "payIn": body.get("payIn", "BALANCE"), "payOut": body.get("payOut", "BANK_TRANSFER"),
+            "status": "PENDING", "createdTime": _iso(_now()), "expirationTime": _iso(_now() + QUOTE_TTL),
+        }
+        self.quotes[quote["id"]] = quote
+        return 200, quote
+
+    @route("GET", r"/v1/quotes/([0-9a-f-]+)/account-requirements")
+    def _requirements(self, request, body, params, quote_id):
+        if quote_id not in self.quotes:
+            raise FakeError(404, "quote_not_found")
+        fields = [{"key": key, "type": "text", "required": True} for key in ("legalType", "iban")]
+        return 200, [{"type": "iban", "title": "IBAN", "fields": [{"group": fields}]}]
+
+    @route("GET", r"/v1/accounts")
+    def _list_recipients(self, request, body, params):
+        currency = params.get("currency")
+        return 200, [r for r in self.recipients.values() if not currency or r["currency"] == currency]
+
+    @route("POST", r"/v1/accounts")
+    def _create_recipient(self, request, body, params):
+        def build():
+            if not body.get("details") or not body.get("accountHolderName"):
+                raise FakeError(422, "invalid_recipient")
+            recipient = {
+                "id": self._next_id(), "profile": body.get("profile"), "currency": body["currency"],
+                "type": body["type"], "accountHolderName": body["accountHolderName"],
+                "details": body["details"], "active": True, "ownedByCustomer": body.get("ownedByCustomer"),
+            }
+            self.recipients[recipient["id"]] = recipient
+            return recipient
+        return 200, self._replay(request, "recipient", build)
+
+    @route("DELETE", r"/v1/accounts/(\d+)")
+    def _delete_recipient(self, request, body, params, recipient_id):
+        if self.recipients.pop(int(recipient_id), None) is None:
+            raise FakeError(404, "recipient_not_found")
+        return 200, {}
+
+    # ---------- Transfers ----------
+
+    def _new_transfer(self, body, batch_group_id=None):
+        # customerTransactionId makes creating a transfer idempotent, as at Wise
+        known = self._transfer_of.get(body["customerTransactionId"])
+        if known is not None:
+            return self.transfers[known]
+        quote = self.quotes.get(body.get("quoteUuid"))
+        if quote is None:
+            raise FakeError(422, "quote_not_found")
+        if quote["status"] != "PENDING":
+            raise FakeError(422, "quote_already_used")
+        recipient = self.recipients.get(body.get("targetAccount"))
+        if recipient is None:
+            raise FakeError(422, "recipient_not_found")
+        quote["status"] = "COMPLETED"
+        transfer = {
+            "id": self._next_id(), "user": 1, "targetAccount": recipient["id"], "quoteUuid": quote["id"],
+            "customerTransactionId": body["customerTransactionId"], "status": "incoming_payment_waiting",
+            "reference": body.get("details", {}).get("reference", ""), "rate": quote["rate"],
+            "created": _iso(_now()), "sourceCurrency": quote["sourceCurrency"],
+            "sourceValue": quote["sourceAmount"], "targetCurrency": quote["targetCurrency"],
+            "targetValue": quote["targetAmount"], "batchGroupId": batch_group_id,
+        }
+        self.transfers[transfer["id"]] = transfer
+        self._transfer_of[transfer["customerTransactionId"]] = transfer["id"]
+        return transfer
+
+    @route("POST", r"/v1/transfers")
+    def _create_transfer(self, request, body, params):
+        return 200, self._new_transfer(body)
+
+    @route("GET", r"/v1/transfers/(\d+)")
+    def _get_transfer(self, request, body, params, transfer_id):
+        transfer = self.transfers.get(int(transfer_id))
+        if transfer is None:
+            raise FakeError(404, "transfer_not_found")
+        return 200, transfer
+
+    def _debit(self, transfers):
+        for transfer in transfers:
+            if transfer["status"] != "incoming_payment_waiting":
+                continue
+            currency, amount = transfer["sourceCurrency"], Decimal(str(transfer["sourceValue"]))
+            if self.balances.get(currency, Decimal(0)) < amount:
+                raise FakeError(422, "insufficient_funds", f"balance too low for transfer {transfer['id']}")
+            self.balances[currency] -= amount
+            transfer["status"] = "processing"
+            self.activities.append({
+                "id": f"TU{transfer['id']}", "type": "TRANSFER", "resource": {"type": "TRANSFER",
+                                                                              "id": str(transfer["id"])},
+                "title": f"To recipient {transfer['targetAccount']}", "status": "COMPLETED",
+                "primaryAmount": f"{transfer['targetValue']:.2f} {transfer['targetCurrency']}",
+                "secondaryAmount": f"{transfer['sourceValue']:.2f} {transfer['sourceCurrency']}",
+                "createdOn": _iso(_now()), "updatedOn": _iso(_now()),
+            })
+
+    @route("POST", r"/v3/profiles/(\d+)/transfers/(\d+)/payments")
+    def _fund_transfer(self, request, body, params, profile_id, transfer_id):
+        self._check_profile(profile_id)
+        transfer = self.transfers.get(int(transfer_id))
+        if transfer is None:
+            raise FakeError(404, "transfer_not_found")
+
+        def build():
+            self._require_sca(request)
+            self._debit([transfer])
+            return {"type": body.get("type", "BALANCE"), "status": "COMPLETED", "errorCode": None}
+        return 201, self._replay(request, "fund-transfer", build)
+
+    @route("GET", r"/v1/simulation/transfers/(\d+)/(\w+)")
+    def _simulate(self, request, body, params, transfer_id, status):
+        transfer = self.transfers.get(int(transfer_id))
+        if transfer is None:
+            raise FakeError(404, "transfer_not_found")
+        if status not in SIMULATED_STATES:
+            raise FakeError(400, "unknown_state")
+        transfer["status"] = status
+        return 200, transfer
+
+    # ---------- Batch groups ----------
+
+    def _group(self, profile_id, group_id):
+        self._check_profile(profile_id)
+        group = self.batch_groups.get(group_id)
+        if group is None:
+            raise FakeError(404, "batch_group_not_found")
+        return group
+
+    @route("POST", r"/v3/profiles/(\d+)/batch-groups")
+    def _create_group(self, request, body, params, profile_id):
+        self._check_profile(profile_id)
+        group = {"id": str(uuid.uuid4()), "name": body.get("name"), "sourceCurrency": body["sourceCurrency"],
+                 "status": "NEW", "version": 0, "transferIds": []}
+        self.batch_groups[group["id"]] = group
+        return 200, group
+
+    @route("GET", r"/v3/profiles/(\d+)/batch-groups/([0-9a-f-]+)")
+    def _get_group(self, request, body, params, profile_id, group_id):
+        return 200, self._group(profile_id, group_id)
+
+    @route("PATCH", r"/v3/profiles/(\d+)/batch-groups/([0-9a-f-]+)")
+    def _change_group(self, request, body, params, profile_id, group_id):
+        group = self._group(profile_id, group_id)
+        if body.get("status") not in ("COMPLETED", "CANCELLED"):
+            raise FakeError(400, "unknown_status")
+        if body.get("version") != group["version"]:
+            if group["status"] == body.get("status"):
+                return 200, group
+            raise FakeError(409, "version_conflict")
+        if group["status"] != "NEW":
+            raise FakeError(422, "batch_group_closed")
+        if body["status"] == "CANCELLED":
+            for transfer_id in group["transferIds"]:
+                self.transfers[transfer_id]["status"] = "cancelled"
+        group["status"] = body["status"]
+        group["version"] += 1
+        return 200, group
+
+    @route("POST", r"/v3/profiles/(\d+)/batch-groups/([0-9a-f-]+)/transfers")
+    def _create_group_transfer(self, request, body, params, profile_id, group_id):
+        group = self._group(profile_id, group_id)
+        if group["status"] != "NEW":
+            raise FakeError(422, "batch_group_closed")
+        transfer = self._new_transfer(body, batch_group_id=group_id)
+        if transfer["id"] not in group["transferIds"]:
+            group["transferIds"].append(transfer["id"])
+            group["version"] += 1
+        return 200, transfer
+
+    @route("POST", r"/v3/profiles/(\d+)/batch-payments/([0-9a-f-]+)/payments")
+    def _fund_group(self, request, body, params, profile_id, group_id):
+        group = self._group(profile_id, group_id)
+        if group["status"] != "COMPLETED":
+            raise FakeError(422, "batch_group_not_completed")
+
+        def build():
+            self._require_sca(request)
+            self._debit([self.transfers[t] for t in group["transferIds"]])
+            return {"id": self._next_id(), "type": body.get("type", "BALANCE"), "status": "COMPLETED",
+                    "transferIds": list(group["transferIds"])}
+        return 201, self._replay(request, "fund-batch", build)
+
+    # ---------- SCA ----------
+
+    def _require_sca(self, request):
+        if not self.sca:
+            return
+        signed = request.headers.get(OTT_HEADER)
+        if signed and request.headers.get("X-Signature") and signed in self.tokens:
+            if self._signature_ok(signed, request.headers["X-Signature"]):
+                del self.tokens[signed]
+                return
+        ott = request.headers.get("One-Time-Token")
+        token = self.tokens.get(ott)
+        if token is not None and all(c["passed"] for c in token["challenges"]):
+            del self.tokens[ott]
+            return
+        ott = str(uuid.uuid4())
+        self.tokens[ott] = {"challenges": [{"primaryChallenge": {"type": "SMS"}, "required": True,
+                                            "passed": False}]}
+        raise FakeError(403, "sca_required", "approval required",
+                        headers={OTT_HEADER: ott, OTT_RESULT_HEADER: "REJECTED"})
+
+    def _signature_ok(self, ott, signature):
+        if self.sca_public_key is None:
+            return True
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        key = serialization.load_pem_public_key(self.sca_public_key)
+        try:
+            key.verify(base64.b64decode(signature), ott.encode(), padding.PKCS1v15(), hashes.SHA256())
+        except (InvalidSignature, ValueError):
+            return False
+        return True
+
+    def _token(self, request):
+        token = self.tokens.get(request.headers.get("One-Time-Token"))
+        if token is None:
+            raise FakeError(404, "one_time_token_not_found")
+        return token
+
+    @route("GET", r"/v1/one-time-token/status")
+    def _token_status(self, request, body, params):
+        token = self._token(request)
+        return 200, {"oneTimeTokenProperties": {"oneTimeToken": request.headers["One-Time-Token"],
+                                                "challenges": token["challenges"], "validity": 3600}}
+
+    @route("POST", r"/v1/one-time-token/(\w+)/trigger")
+    def _token_trigger(self, request, body, params, channel):
+        self._token(request)
+        return 200, {"obfuscatedPhoneNo": "*******0000"}
+
+    @route("POST", r"/v1/one-time-token/(\w+)/verify")
+    def _token_verify(self, request, body, params, channel):
+        token = self._token(request)
+        if body.get("otpCode") != SANDBOX_OTP:
+            raise FakeError(400, "invalid_otp")
+        for challenge in token["challenges"]:
+            if challenge["primaryChallenge"]["type"].lower() == channel:
+                challenge["passed"] = True
+        return 200, {}
+
+    # ---------- Activities ----------
+
+    @route("GET", r"/v1/profiles/(\d+)/activities")
+    def _activities(self, request, body, params, profile_id):
+        self._check_profile(profile_id)
+        start = int(params.get("nextCursor") or 0)
+        size = int(params.get("size") or 10)
+        page = self.activities[start:start + size]
+        cursor = str(start + size) if start + size < len(self.activities) else None
+        return 200, {"cursor": cursor, "activities": page}
+
+    # ---------- HTTP server ----------
+
+    def serve(self, host="127.0.0.1", port=0):
+        """Start serving this fake over HTTP in a daemon thread; returns the server (see ``server_port``)."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = httpx.Request(self.command, f"http://{host}{self.path}", headers=dict(self.headers),
+                                        content=self.rfile.read(length) if length else b"")
+                response = fake.handler(request)
+                content = response.content
+                self.send_response(response.status_code)
+                for name, value in response.headers.items():
+                    if name.lower() not in ("content-length", "connection"):
+                        self.send_header(name, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="fake-wise", daemon=True).start()
+        return server
@@ -0,0 +1,147 @@
+"""
+Rate limiting and safe retries for outbound banking calls.
+
+Every Wise request goes through one ``RequestScheduler`` per process. Before a request
+is sent it takes a token from a global bucket and from the bucket of its endpoint
+(``"POST /v1/transfers"``, ``"GET /v1/transfers/{id}"`` ...). When the provider answers
+429 the request is retried after ``Retry-After`` (and the endpoint bucket is held back
+for as long); 5xx answers and connection errors are retried with jittered exponential
+backoff, but only for requests that are safe to repeat: reads, and writes that carry
+an idempotency key such as ``customerTransactionId`` or ``X-idempotence-uuid``.
+"""
+import email.utils
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F-]{32,36})$")
+
+
+def endpoint_key(method, path):
+    """``"GET /v1/transfers/{id}"`` for ``("GET", "/v1/transfers/123")``."""
+    segments = ["{id}" if _ID_SEGMENT.match(s) else s for s in path.split("?", 1)[0].split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def retry_after(headers):
+    """Seconds to wait according to a ``Retry-After`` header (delta-seconds or HTTP-date)."""
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    ``rate`` tokens per second, at most ``burst`` saved up.
+
+    ``reserve`` never blocks: it takes a token (possibly from the future) and says how
+    long the caller has to wait before using it, so the same bucket serves threads
+    (``time.sleep``) and coroutines (``asyncio.sleep``).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.0
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def hold(self, seconds):
+        """Hand out no token for the next ``seconds`` (after a 429)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+            self._updated = now
+
+
+class RequestScheduler:
+    """
+    Token buckets plus retry policy shared by every client of a process.
+
+    ``rate``/``burst`` bound all requests together; ``endpoint_limits`` maps endpoint
+    keys to their own ``(rate, burst)``.
+    """
+
+    def __init__(self, rate=None, burst=None, endpoint_limits=None, *, max_retries=DEFAULT_MAX_RETRIES,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._global = TokenBucket(rate, burst) if rate else None
+        self._limits = dict(endpoint_limits or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, **kwargs):
+        options = dict(
+            rate=getattr(settings, "WISE_RATE_LIMIT", None),
+            endpoint_limits=getattr(settings, "WISE_ENDPOINT_RATE_LIMITS", None),
+            max_retries=getattr(settings, "WISE_MAX_RETRIES", DEFAULT_MAX_RETRIES),
+        )
+        options.update(kwargs)
+        return cls(**options)
+
+    def _bucket(self, key):
+        if key not in self._limits:
+            return None
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(key, TokenBucket(*self._limits[key]))
+        return bucket
+
+    def reserve(self, key):
+        """Seconds to wait before the next request to endpoint ``key`` may be sent."""
+        waits = [bucket.reserve() for bucket in (self._global, self._bucket(key)) if bucket is not None]
+        return max(waits, default=0.0)
+
+    def backoff(self, key, attempt, status=None, headers=None, idempotent=False):
+        """
+        Seconds to wait before retry number ``attempt`` (starting at 1), or ``None`` when
+        the request must not be retried. ``status`` is ``None`` for a connection error.
+        """
+        if attempt > self.max_retries:
+            return None
+        # full jitter keeps a burst of failed payouts from retrying in lockstep
+        jittered = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if status == 429:
+            # the request was not processed, so even a non-idempotent call can go again
+            delay = retry_after(headers)
+            if delay is None:
+                delay = jittered
+            elif delay > self.max_delay:
+                return None
+            for bucket in (self._global, self._bucket(key)):
+                if bucket is not None:
+                    bucket.hold(delay)
+            return delay
+        if not idempotent or (status is not None and status not in RETRY_STATUSES):
+            return None
+        return jittered
@@ -0,0 +1,126 @@
+"""
+A local currency-rate table.
+
+``RateTable`` converts expense amounts between currencies without a round-trip to
+Wise. The ``refresh_rates`` job loads every rate Wise publishes with a single
+``GET /v1/rates`` into ``CurrencyRate`` (``refresh``); every process reads that table
+again once its copy is ``reload_after`` seconds old, so web workers see the rates the
+job worker fetched. Rates of quotes seen by a process are remembered too, and
+``PAYOUT_FALLBACK_RATES`` is the last resort when no rate is fresh.
+"""
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import CurrencyRate
+
+# a few missed hourly refreshes are no reason to fall back to the rough rates yet
+DEFAULT_RATE_TTL = 6 * 3600.0
+DEFAULT_RELOAD_AFTER = 300.0
+PIVOT_CURRENCY = "EUR"
+CENT = Decimal("0.01")
+
+
+class RateTable:
+    """
+    Mid-market rates between currency pairs, from ``CurrencyRate`` and the quotes seen.
+
+    Rates older than ``ttl`` seconds are ignored in favour of ``PAYOUT_FALLBACK_RATES``
+    (units of each currency per one EUR). Pairs that were never seen are converted
+    through EUR.
+    """
+
+    def __init__(self, ttl=DEFAULT_RATE_TTL, fallback=None, reload_after=DEFAULT_RELOAD_AFTER):
+        self.ttl = ttl
+        self.fallback = fallback
+        self.reload_after = reload_after
+        self._rates = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def set(self, source, target, rate, at=None):
+        if source == target or not rate:
+            return
+        with self._lock:
+            self._rates[(source, target)] = (Decimal(str(rate)), at or time.time())
+
+    def observe(self, quote):
+        """Learn the rate of a Wise quote."""
+        self.set(quote.get("sourceCurrency"), quote.get("targetCurrency"), quote.get("rate"))
+
+    def refresh(self, client):
+        """Load every rate Wise publishes with one call and store them for every process."""
+        now = timezone.now()
+        rows = {}
+        for rate in client.get_rates():
+            if rate["source"] != rate["target"] and rate["rate"]:
+                rows[(rate["source"], rate["target"])] = CurrencyRate(
+                    source=rate["source"], target=rate["target"], rate=Decimal(str(rate["rate"])), fetched_at=now)
+        CurrencyRate.objects.bulk_create(
+            list(rows.values()), update_conflicts=True, unique_fields=["source", "target"],
+            update_fields=["rate", "fetched_at"],
+        )
+        for row in rows.values():
+            self.set(row.source, row.target, row.rate, at=now.timestamp())
+        return len(rows)
+
+    def load(self):
+        """Read the stored rates; those newer than what this process has seen win."""
+        rows = CurrencyRate.objects.values_list("source", "target", "rate", "fetched_at")
+        with self._lock:
+            for source, target, rate, fetched_at in rows:
+                at = fetched_at.timestamp()
+                seen = self._rates.get((source, target))
+                if seen is None or seen[1] < at:
+                    self._rates[(source, target)] = (rate, at)
+            self._loaded_at = time.monotonic()
+
+    def _maybe_load(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_after:
+            self.load()
+
+    def _fallback_rates(self):
+        if self.fallback is not None:
+            return self.fallback
+        return getattr(settings, "PAYOUT_FALLBACK_RATES", {})
+
+    def _fresh(self, source, target):
+        entry = self._rates.get((source, target))
+        if entry and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def rate(self, source, target):
+        """Units of ``target`` per unit of ``source``; ``None`` if the pair is unknown."""
+        if source == target:
+            return Decimal("1")
+        self._maybe_load()
+        direct = self._fresh(source, target)
+        if direct is not None:
+            return direct
+        inverse = self._fresh(target, source)
+        if inverse is not None:
+            return Decimal("1") / inverse
+        if PIVOT_CURRENCY not in (source, target):
+            to_pivot, from_pivot = self.rate(source, PIVOT_CURRENCY), self.rate(PIVOT_CURRENCY, target)
+            if to_pivot is not None and from_pivot is not None:
+                return to_pivot * from_pivot
+        fallback = self._fallback_rates()
+        if source in fallback and target in fallback:
+            return Decimal(str(fallback[target])) / Decimal(str(fallback[source]))
+        return None
+
+    def convert(self, amount, source, target):
+        """``amount`` in ``source`` converted to ``target`` and rounded to cents, or ``None``."""
+        if amount is None:
+            return None
+        rate = self.rate(source, target)
+        if rate is None:
+            return None
+        return (Decimal(amount) * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+rate_table = RateTable()
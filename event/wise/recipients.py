@@ -0,0 +1,120 @@
+"""
+Local index of Wise recipients.
+
+Every recipient we create is remembered in ``WiseRecipient`` under a fingerprint of
+its normalised bank details, so the next payout to the same account is a single
+indexed lookup instead of listing (or re-creating) every recipient on the profile.
+``sync`` fills the index from recipients that already exist at Wise and drops the
+ones Wise no longer has; ``forget`` invalidates a recipient Wise rejected.
+"""
+import hashlib
+import re
+
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import WiseRecipient
+
+# detail fields that identify the account itself; legalType, address, email etc. do not
+IDENTITY_FIELDS = (
+    "iban", "bic", "swiftcode", "sortcode", "accountnumber", "abartn", "accounttype",
+    "bankcode", "branchcode", "institutionnumber", "transitnumber", "ifsccode", "clabe",
+)
+_NOT_ALNUM = re.compile(r"[^0-9A-Z]")
+
+
+def fingerprint(currency, recipient_type, details, holder):
+    """
+    SHA-256 of the normalised (currency, type, account details, holder).
+
+    Account fields are compared without spaces, dashes or case and the holder name
+    without case or repeated whitespace, so "BE57 9677 4768 2935" and
+    "be57967747682935" are the same account.
+    """
+    fields = {key.lower(): value for key, value in (details or {}).items()}
+    parts = [(currency or "").upper(), (recipient_type or "").lower()]
+    for name in IDENTITY_FIELDS:
+        value = fields.get(name)
+        if value:
+            parts.append(f"{name}={_NOT_ALNUM.sub('', str(value).upper())}")
+    parts.append(" ".join((holder or "").casefold().split()))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def fingerprint_of(account):
+    """Fingerprint of a recipient as returned by ``GET /v1/accounts``."""
+    return fingerprint(account.get("currency"), account.get("type"), account.get("details"),
+                       account.get("accountHolderName"))
+
+
+def lookup(profile_id, fingerprints):
+    """Map each known fingerprint to its Wise recipient id, in one query."""
+    return dict(
+        WiseRecipient.objects.filter(profile_id=profile_id, fingerprint__in=list(fingerprints))
+        .values_list("fingerprint", "recipient_id")
+    )
+
+
+def remember(profile_id, entries):
+    """
+    Store ``(fingerprint, recipient_id, currency, bank_account_id)`` tuples.
+
+    A fingerprint that is already indexed is pointed at the new recipient id.
+    """
+    now = timezone.now()
+    latest = {entry[0]: entry for entry in entries}  # one row per fingerprint and statement
+    rows = [
+        WiseRecipient(profile_id=profile_id, fingerprint=fp, recipient_id=recipient_id, currency=currency,
+                      bank_account_id=bank_account_id, created_at=now, updated_at=now)
+        for fp, recipient_id, currency, bank_account_id in latest.values()
+    ]
+    WiseRecipient.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=["profile_id", "fingerprint"],
+        update_fields=["recipient_id", "currency", "bank_account", "updated_at"],
+    )
+
+
+def forget(recipient_ids):
+    """Invalidate recipients Wise deleted or rejected."""
+    return WiseRecipient.objects.filter(recipient_id__in=list(recipient_ids)).delete()[0]
+
+
+def resolve(client, profile_id, *, currency, account_holder_name, recipient_type, details, bank_account=None):
+    """Return the recipient id for these bank details, creating the recipient at Wise only if needed."""
+    fp = fingerprint(currency, recipient_type, details, account_holder_name)
+    recipient_id = lookup(profile_id, [fp]).get(fp)
+    if recipient_id is None:
+        recipient_id = client.create_recipient(
+            profile_id, currency=currency, account_holder_name=account_holder_name,
+            recipient_type=recipient_type, details=details,
+        )["id"]
+        remember(profile_id, [(fp, recipient_id, currency, bank_account.pk if bank_account else None)])
+    return recipient_id
+
+
+def sync(client, profile_id, currency=None):
+    """
+    Bring the index in line with the recipients Wise has for ``profile_id``.
+
+    Active recipients are added (the index is filled incrementally, never rebuilt) and
+    indexed recipients that Wise deleted or deactivated are dropped. Returns
+    ``(added, removed)``.
+    """
+    accounts = client.list_recipients(profile_id, currency=currency)
+    active = {}
+    for account in accounts:
+        if account.get("active", True):
+            active[fingerprint_of(account)] = account
+    indexed = WiseRecipient.objects.filter(profile_id=profile_id)
+    if currency:
+        indexed = indexed.filter(currency=currency)
+    known = dict(indexed.values_list("recipient_id", "fingerprint"))
+    live_ids = {account["id"] for account in active.values()}
+
+    with transaction.atomic():
+        removed = forget(set(known) - live_ids)
+        indexed_fps = {fp for recipient_id, fp in known.items() if recipient_id in live_ids}
+        new = [(fp, account["id"], account.get("currency"), None)
+               for fp, account in active.items() if account["id"] not in known and fp not in indexed_fps]
+        remember(profile_id, new)
+    return len(new), removed
@@ -0,0 +1,151 @@
+"""
+Strong Customer Authentication for Wise funding calls.
+
+When Wise wants SCA it answers a funding call with a 403 carrying a one-time token
+(OTT) in ``x-2fa-approval``. ``ScaHandler`` turns that into an approved retry using a
+pluggable signer:
+
+* ``KeySigner`` signs the OTT with the private key registered on the Wise account
+  (the non-interactive path for automated payouts; a locally generated key is a
+  drop-in stand-in when testing against a fake server);
+* ``OtpSigner`` clears the SMS/WhatsApp/voice challenges listed on the OTT.
+
+Approvals are amortised rather than repeated: a batch of transfers is funded through
+one batch group, so the whole batch needs one approval, and where calls cannot share
+an approval the challenges and retries of all of them run concurrently instead of one
+interactive round after another.
+"""
+import asyncio
+import base64
+import os
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from django.conf import settings
+
+from .client import SANDBOX_URL, WiseError
+
+OTT_HEADER = "x-2fa-approval"
+OTT_RESULT_HEADER = "x-2fa-approval-result"
+SANDBOX_OTP = "111111"
+MAX_CHALLENGE_ROUNDS = 3
+
+
+class ScaError(Exception):
+    """SCA was required but the one-time token could not be approved."""
+
+
+def one_time_token(error):
+    """The OTT of a 403 ``WiseError`` asking for SCA, else ``None``."""
+    if isinstance(error, WiseError) and error.status_code == 403:
+        return error.headers.get(OTT_HEADER)
+    return None
+
+
+class KeySigner:
+    """Approves a one-time token by signing it with the account's registered private key."""
+
+    def __init__(self, private_key_pem, password=None):
+        if isinstance(private_key_pem, str):
+            private_key_pem = private_key_pem.encode()
+        self._key = serialization.load_pem_private_key(private_key_pem, password=password)
+
+    def sign(self, ott):
+        signature = self._key.sign(ott.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return base64.b64encode(signature).decode()
+
+    async def approve(self, client, ott):
+        return {OTT_HEADER: ott, "X-Signature": self.sign(ott)}
+
+
+class OtpSigner:
+    """
+    Clears the OTP challenges listed on a one-time token.
+
+    ``otp_provider(challenge_type)`` supplies the code the user received; in the sandbox
+    the code is always ``111111``.
+    """
+
+    CHANNELS = {"SMS": "sms", "WHATSAPP": "whatsapp", "VOICE": "voice"}
+
+    def __init__(self, otp_provider=None):
+        self.otp_provider = otp_provider or (lambda challenge_type: SANDBOX_OTP)
+
+    @staticmethod
+    def _type(challenge):
+        return challenge.get("type") or challenge.get("primaryChallenge", {}).get("type")
+
+    async def approve(self, client, ott):
+        for _ in range(MAX_CHALLENGE_ROUNDS):
+            status = await client.get_ott_status(ott)
+            props = status.get("oneTimeTokenProperties", status)
+            pending = [c for c in props.get("challenges", []) if not c.get("passed")]
+            if not pending:
+                return {"One-Time-Token": ott}
+            for challenge in pending:
+                channel = self.CHANNELS.get(self._type(challenge))
+                if channel is None:
+                    raise ScaError(f"cannot clear a {self._type(challenge)} challenge without a key signer")
+                await client.trigger_ott_otp(ott, channel)
+                await client.verify_ott_otp(ott, self.otp_provider(self._type(challenge)), channel)
+        raise ScaError(f"challenges of one-time token {ott} still pending after {MAX_CHALLENGE_ROUNDS} rounds")
+
+
+def signer_from_settings():
+    """``KeySigner`` from ``WISE_SCA_PRIVATE_KEY`` (PEM or a path to one); sandbox OTPs otherwise."""
+    key = getattr(settings, "WISE_SCA_PRIVATE_KEY", None)
+    if key:
+        if os.path.exists(key):
+            with open(key, "rb") as f:
+                key = f.read()
+        return KeySigner(key)
+    if getattr(settings, "WISE_BASE_URL", SANDBOX_URL) == SANDBOX_URL:
+        return OtpSigner()
+    return None
+
+
+class ScaHandler:
+    """Runs Wise calls on an ``AsyncWiseClient``, approving and retrying them once when SCA is required."""
+
+    def __init__(self, client, signer=None):
+        self.client = client
+        self.signer = signer
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Await ``method(*args, **kwargs)``; on an SCA 403 approve the OTT and retry with
+        ``sca_headers``. Tokens Wise already marked APPROVED are retried as they are.
+        """
+        try:
+            return await method(*args, **kwargs)
+        except WiseError as e:
+            ott = one_time_token(e)
+            if ott is None:
+                raise
+            if e.headers.get(OTT_RESULT_HEADER) == "APPROVED":
+                headers = {"One-Time-Token": ott}
+            elif self.signer is None:
+                raise ScaError(f"SCA required for {e.step} but no signer is configured") from e
+            else:
+                headers = await self.signer.approve(self.client, ott)
+        return await method(*args, sca_headers=headers, **kwargs)
+
+    async def fund_transfer(self, profile_id, transfer_id):
+        return await self.call(self.client.fund_transfer, profile_id, transfer_id)
+
+    async def fund_transfers(self, profile_id, transfer_ids):
+        """
+        Fund transfers that cannot share an approval, pipelined: all first attempts,
+        challenge rounds and retries run concurrently. Returns ``{transfer_id: result}``
+        where a failed funding maps to its exception.
+        """
+        results = await asyncio.gather(*(self.fund_transfer(profile_id, t) for t in transfer_ids),
+                                       return_exceptions=True)
+        return dict(zip(transfer_ids, results))
+
+    async def fund_batch_group(self, profile_id, batch_group_id):
+        """Close ``batch_group_id`` and fund all of its transfers behind one approval."""
+        group = await self.client.get_batch_group(profile_id, batch_group_id)
+        if group.get("status") != "COMPLETED":
+            await self.client.complete_batch_group(profile_id, batch_group_id, group.get("version"))
+        return await self.call(self.client.fund_batch_group, profile_id, batch_group_id)
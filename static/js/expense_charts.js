@@ -0,0 +1,54 @@
+(function () {
+    const panel = document.getElementById('expense_report');
+    if (!panel) {
+        return;
+    }
+    const chart = new Chart(document.getElementById('expenseRollup'), {
+        type: 'bar',
+        data: {labels: [], datasets: []},
+        options: {
+            responsive: true,
+            animation: false,
+            indexAxis: 'y',
+            plugins: {
+                legend: {display: false}
+            },
+            scales: {
+                x: {beginAtZero: true}
+            }
+        }
+    });
+    const csv = document.getElementById('expenseCsv');
+
+    function load(by) {
+        csv.href = csv.dataset.url + '?by=' + by;
+        fetch(panel.dataset.url + '?by=' + by, {credentials: 'same-origin'})
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (data) {
+                chart.data.labels = data.labels;
+                chart.data.datasets = [{
+                    label: data.column + ' (' + data.currency + ')',
+                    data: data.values,
+                    backgroundColor: 'rgb(54, 162, 235)'
+                }];
+                chart.update();
+                const missing = Object.keys(data.unconverted);
+                document.getElementById('expenseUnconverted').textContent = missing.length ?
+                    'Without a rate, left out: ' + missing.map(function (code) {
+                        return (code || '?') + ' (' + data.unconverted[code] + ')';
+                    }).join(', ') : '';
+            });
+    }
+
+    panel.querySelectorAll('[data-by]').forEach(function (button) {
+        button.addEventListener('click', function () {
+            panel.querySelectorAll('[data-by]').forEach(function (other) {
+                other.classList.toggle('active', other === button);
+            });
+            load(button.dataset.by);
+        });
+    });
+    load('event');
+})();
@@ -0,0 +1,85 @@
+(function () {
+    const panel = document.getElementById('job_dashboard');
+    if (!panel) {
+        return;
+    }
+    const colors = [
+        'rgb(54, 162, 235)',
+        'rgb(255, 99, 132)',
+        'rgb(255, 205, 86)',
+        'rgb(75, 192, 192)',
+        'rgb(153, 102, 255)'
+    ];
+    const lineOptions = {
+        responsive: true,
+        animation: false,
+        plugins: {
+            legend: {position: 'bottom'}
+        },
+        scales: {
+            y: {beginAtZero: true}
+        }
+    };
+    const throughput = new Chart(document.getElementById('jobThroughput'), {
+        type: 'bar',
+        data: {labels: [], datasets: []},
+        options: {...lineOptions, scales: {x: {stacked: true}, y: {stacked: true, beginAtZero: true}}}
+    });
+    const latency = new Chart(document.getElementById('jobLatency'), {
+        type: 'line',
+        data: {labels: [], datasets: []},
+        options: lineOptions
+    });
+
+    function datasets(queues, keys) {
+        const sets = [];
+        Object.keys(queues).forEach(function (queue, i) {
+            keys.forEach(function (key, k) {
+                sets.push({
+                    label: queue + ' ' + key.label,
+                    data: queues[queue][key.field],
+                    backgroundColor: colors[(i + k) % colors.length],
+                    borderColor: colors[(i + k) % colors.length],
+                    borderDash: k ? [4, 4] : [],
+                    pointRadius: 0
+                });
+            });
+        });
+        return sets;
+    }
+
+    function refresh() {
+        fetch(panel.dataset.url, {credentials: 'same-origin'})
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (data) {
+                throughput.data.labels = data.minutes;
+                throughput.data.datasets = datasets(data.queues, [
+                    {field: 'succeeded', label: 'done'},
+                    {field: 'failed', label: 'failed'}
+                ]);
+                throughput.update();
+                latency.data.labels = data.minutes;
+                latency.data.datasets = datasets(data.queues, [
+                    {field: 'avg_wait_seconds', label: 'wait'},
+                    {field: 'avg_run_seconds', label: 'run'}
+                ]);
+                latency.update();
+                const body = document.getElementById('jobDepth');
+                body.replaceChildren.apply(body, data.depth.map(function (row) {
+                    const tr = document.createElement('tr');
+                    [row.queue || 'default', row.priority, row.runnable, row.scheduled, row.running, row.failed,
+                        row.oldest ? new Date(row.oldest).toLocaleString() : ''].forEach(function (value) {
+                        const td = document.createElement('td');
+                        td.textContent = value;
+                        tr.appendChild(td);
+                    });
+                    return tr;
+                }));
+            });
+    }
+
+    refresh();
+    setInterval(refresh, 30000);
+})();
@@ -44,15 +44,17 @@ INSTALLED_APPS = [
     'formtools',
     'django_tables2',
     'register',
-    #'event',
+    'event',
 ]
 
 MIDDLEWARE = [
+    'event.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'event.middleware.AuditMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -136,6 +138,12 @@ STATICFILES_DIRS = [
 ]
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# files only the application reads (audit archives, exports); never served by the web server
+PRIVATE_ROOT = os.getenv("PRIVATE_ROOT", os.path.join(BASE_DIR, 'private'))
+# exports written in the background, one directory per user (event.exports)
+EXPORT_ROOT = os.path.join(PRIVATE_ROOT, "exports")
+# scheme and host of the site, for links in emails sent by background jobs
+SITE_URL = os.getenv("SITE_URL", "http://localhost:8000")
 
 # urls
 LOGIN_REDIRECT_URL = "/register/profile/"          # or a named URL via reverse, e.g. 'dashboard'
@@ -161,9 +169,17 @@ EMAIL_PORT = 25
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "filters": {
+        "request_id": {"()": "event.tracing.RequestIdFilter"},
+    },
+    "formatters": {
+        "default": {"format": "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"},
+    },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
+            "filters": ["request_id"],
+            "formatter": "default",
         },
     },
     "root": {
@@ -174,4 +190,43 @@ LOGGING = {
 # WISE BANKING API KEYS
 WISE_API_KEY = os.getenv("WISE_API_KEY")
 WISE_API_SECRET = os.getenv("WISE_API_SECRET")
-
+WISE_BASE_URL = os.getenv("WISE_BASE_URL", "https://api.sandbox.transferwise.tech")
+# size of the keep-alive connection pool shared by all payout calls in a process
+WISE_POOL_SIZE = int(os.getenv("WISE_POOL_SIZE", "20"))
+# HTTP/2 is only used when the optional 'h2' package is installed
+WISE_HTTP2 = True
+WISE_PROFILE_ID = os.getenv("WISE_PROFILE_ID")
+# currency of the balance payouts are funded from
+WISE_SOURCE_CURRENCY = os.getenv("WISE_SOURCE_CURRENCY", "EUR")
+# max requests per second sent to Wise by one process (all endpoints together)
+WISE_RATE_LIMIT = 10
+# per-endpoint (requests per second, burst) on top of WISE_RATE_LIMIT
+WISE_ENDPOINT_RATE_LIMITS = {
+    "POST /v3/profiles/{id}/quotes": (5, 10),
+    "POST /v1/transfers": (5, 10),
+}
+# retries of 429s, 5xx answers and connection errors (idempotent calls only, except 429)
+WISE_MAX_RETRIES = 4
+# PEM public key Wise signs its webhooks with (see the Wise webhook docs)
+WISE_WEBHOOK_PUBLIC_KEY = os.getenv("WISE_WEBHOOK_PUBLIC_KEY")
+# private key (PEM or path) registered with Wise to sign SCA one-time tokens; without it the
+# sandbox OTP challenges are cleared instead
+WISE_SCA_PRIVATE_KEY = os.getenv("WISE_SCA_PRIVATE_KEY")
+# fund batch payouts through Wise batch groups: one funding call and one SCA approval per batch
+WISE_BATCH_GROUPS = True
+# bearer token a Prometheus server sends to scrape /event/metrics (staff sessions work too)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# rough units of each currency per 1 EUR, used to estimate amounts when no live rate is known
+PAYOUT_FALLBACK_RATES = {"EUR": 1, "GBP": 0.86, "USD": 1.08}
+# requests and jobs slower than this are always logged with a timing breakdown (event.tracing),
+# the others only at TRACE_SAMPLE_RATE
+TRACE_SLOW_SECONDS = 1.0
+TRACE_SAMPLE_RATE = 0.01
+# audits older than this many months are exported to AUDIT_ARCHIVE_ROOT and dropped
+# by `manage.py archive_audits`, a whole month at a time
+AUDIT_RETENTION_MONTHS = 24
+# without partitioning (SQLite), older audits are moved to monthly archive tables
+AUDIT_HOT_MONTHS = 3
+AUDIT_ARCHIVE_ROOT = os.path.join(PRIVATE_ROOT, "audit-archive")
+# seconds admin autocomplete results are cached (event.search)
+AUTOCOMPLETE_CACHE_SECONDS = 30
@@ -26,6 +26,7 @@ from register import urls
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('register/', include('register.urls')),
+    path('event/', include('event.urls')),
     path('test/', test),
     path('', home),
 
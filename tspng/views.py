@@ -3,9 +3,13 @@ logger = logging.getLogger(__name__)
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404
 
+from event import counters
+
 #@login_required
 def home(request, pagetitle="static", topic=''):
-    return render(request, 'home.html', {})
+    # counters keep this a read of a few StateCount rows however many requests exist
+    pending = counters.pending_work(request.user) if request.user.is_authenticated else []
+    return render(request, 'home.html', {"pending": pending})
 
 def test(request, pagetitle="static", topic=''):
     return render(request, 'test2.html', {})